@@ -0,0 +1,243 @@
+"""Synthetic wine prefixes, a stub wine binary and local HTTP servers for the benchmarks"""
+import functools
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import threading
+import zipfile
+from urllib.parse import parse_qs, urlsplit
+
+UNINSTALL_KEY = "Software\\\\Wow6432Node\\\\Microsoft\\\\Windows\\\\CurrentVersion\\\\Uninstall\\\\"
+MODS = ["TMUnlimiter", "Competition Patch", "CoreMod", "TMInterface", "Twinkie"]
+
+
+def write_system_reg(path, size, united=False):
+    """A system.reg of about ``size`` bytes of filler keys, with the game's uninstall key at the very end."""
+    rng = random.Random(size)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("WINE REGISTRY Version 2\n;; All keys relative to \\\\Machine\n\n#arch=win32\n\n")
+        written = 0
+        key = 0
+        while written < size:
+            lines = [f"[Software\\\\Classes\\\\CLSID\\\\{{{key:08X}-{rng.getrandbits(16):04X}-4D2A-9C1B-"
+                     f"{rng.getrandbits(48):012X}}}\\\\InprocServer32] 1700000000\n",
+                     f"#time=1d9{key:013x}\n",
+                     '@="C:\\\\windows\\\\system32\\\\ole32.dll"\n',
+                     '"ThreadingModel"="Both"\n',
+                     f'"Counter"=dword:{key:08x}\n',
+                     "\n"]
+            chunk = "".join(lines)
+            f.write(chunk)
+            written += len(chunk)
+            key += 1
+        name = "TmUnitedForever" if united else "TmNationsForever"
+        f.write(f"[{UNINSTALL_KEY}{name}_is1] 1700000000\n"
+                f'"InstallLocation"="C:\\\\Program Files (x86)\\\\{name}\\\\"\n'
+                f'"DisplayName"="{name}"\n\n')
+        f.write(f"[{UNINSTALL_KEY}{name} - UVME_is1] 1700000000\n"
+                f'"UninstallString"="\\"C:\\\\Program Files (x86)\\\\{name}\\\\unins001.exe\\""\n\n')
+
+
+def make_prefix(root, user, reg_size=1 << 20, profiles=0, united=False):
+    """A prefix with the game "installed", a system.reg of ``reg_size`` bytes and ``profiles`` TMLoader profiles."""
+    name = "TmUnitedForever" if united else "TmNationsForever"
+    game = os.path.join(root, "drive_c", "Program Files (x86)", name)
+    os.makedirs(game, exist_ok=True)
+    os.makedirs(os.path.join(root, "drive_c", "users", user, "Documents", "TmForever"), exist_ok=True)
+    reset_game(root, united)
+    write_system_reg(os.path.join(root, "system.reg"), reg_size, united)
+    if profiles:
+        folder = os.path.join(root, "drive_c", "Program Files", "TMLoader", "database", "TmForever", "profiles")
+        os.makedirs(folder, exist_ok=True)
+        rng = random.Random(profiles)
+        for i in range(profiles):
+            mods = "".join(f"- id: {mod}\n" for mod in rng.sample(MODS, rng.randint(1, len(MODS))))
+            with open(os.path.join(folder, f"profile{i:05d}.yaml"), "w", encoding="utf-8") as f:
+                f.write(f"description: Benchmark profile {i}\nprogram:\n  id: TmForever\nmods:\n{mods}")
+    return root
+
+
+def reset_game(root, united=False):
+    """Undo install_modloader's shim swap so it can run again."""
+    name = "TmUnitedForever" if united else "TmNationsForever"
+    game = os.path.join(root, "drive_c", "Program Files (x86)", name)
+    backup = os.path.join(game, "TmForever.bak.exe")
+    if os.path.exists(backup):
+        os.remove(backup)
+    with open(os.path.join(game, "TmForever.exe"), "wb") as f:
+        f.write(b"MZ" + bytes(4094))
+
+
+def write_stub_wine(path):
+    """run_wine only needs WINE to be an executable file; this one exits straight away."""
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\nexit 0\n")
+    os.chmod(path, 0o755)
+    return path
+
+
+def write_tmloader_zip(path, files=200, file_size=64 << 10):
+    """A stand-in for the TMLoader release: ShimRun.exe, TMLoader.exe and a tree of mod files."""
+    rng = random.Random(files)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("ShimRun.exe", b"MZ" + rng.randbytes(file_size))
+        archive.writestr("TMLoader.exe", b"MZ" + rng.randbytes(file_size))
+        archive.writestr("config.yaml", "servers:\n- https://tomashu.pages.dev/modloader/\n")
+        for i in range(files):
+            # Half random, half repetitive, so deflate has something to do
+            data = rng.randbytes(file_size // 2) + bytes(file_size // 2)
+            archive.writestr(f"database/mods/mod{i % 20:02d}/file{i:04d}.dll", data)
+    return path
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class StaticServer:
+    """Serves a directory on localhost from a background thread."""
+    def __init__(self, directory):
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _RangeHandler(_QuietHandler):
+    """Serves files with Range support; ranged responses can be cut short to test resuming and retries."""
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        status = self.server.fail()
+        if status is not None:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+        if match is None:
+            self.send_response(200)
+            body = data
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            body = data[start:end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        cut = self.server.cut_short(self.headers.get("Range"), len(body))
+        if cut is not None:
+            # Promise the whole range, send part of it and hang up
+            body = body[:cut]
+            self.close_connection = True
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.sent += len(body)
+
+
+class RangeServer(StaticServer):
+    """A StaticServer honouring Range requests.
+
+    The next ``cuts`` ranged responses (longer than the one byte download probes ask for) end after
+    ``cut_bytes`` bytes; the next ``failures`` requests get an empty ``failure_status`` response.
+    ``sent`` counts the body bytes served.
+    """
+    def __init__(self, directory, cuts=0, cut_bytes=0, failures=0, failure_status=503):
+        super().__init__(directory)
+        self.httpd.RequestHandlerClass = functools.partial(_RangeHandler, directory=directory)
+        self.httpd.cuts = cuts
+        self.httpd.cut_bytes = cut_bytes
+        self.httpd.failures = failures
+        self.httpd.failure_status = failure_status
+        self.httpd.sent = 0
+        self.httpd.lock = threading.Lock()
+        self.httpd.cut_short = self._cut_short
+        self.httpd.fail = self._fail
+
+    @property
+    def sent(self):
+        return self.httpd.sent
+
+    def _cut_short(self, range_header, length):
+        with self.httpd.lock:
+            if range_header is None or length <= 1 or self.httpd.cuts <= 0:
+                return None
+            self.httpd.cuts -= 1
+            return self.httpd.cut_bytes
+
+    def _fail(self):
+        with self.httpd.lock:
+            if self.httpd.failures <= 0:
+                return None
+            self.httpd.failures -= 1
+            return self.httpd.failure_status
+
+
+class _TMXHandler(_QuietHandler):
+    """Answers ``/api/tracks?id=1,2,3`` like the exchange's API, with made-up tracks and an ETag per batch."""
+    def do_GET(self):
+        self.server.requests += 1
+        query = parse_qs(urlsplit(self.path).query)
+        track_ids = [int(track_id) for track_id in query.get("id", [""])[0].split(",") if track_id]
+        tracks = [{"TrackId": track_id, "TrackName": f"Track {track_id}", "Uploader": {"Name": f"author{track_id % 7}"},
+                   "Environment": 7, "AuthorTime": 20000 + track_id * 10, "UpdatedAt": "2024-01-01T00:00:00"}
+                  for track_id in track_ids if track_id not in self.server.missing]
+        body = json.dumps({"More": False, "Results": tracks}).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if self.server.cuts > 0:
+            # Promise the whole body, send half of it and hang up
+            self.server.cuts -= 1
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+
+class TMXServer(StaticServer):
+    """A stand-in for the TMX track API; ``requests`` counts the requests it got.
+
+    The next ``cuts`` 200 responses end halfway through their body.
+    """
+    def __init__(self, missing=(), cuts=0):
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _TMXHandler)
+        self.httpd.requests = 0
+        self.httpd.missing = set(missing)
+        self.httpd.cuts = cuts
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def api_urls(self):
+        return {"nations": self.url("nations/api/tracks"), "united": self.url("united/api/tracks")}
@@ -0,0 +1,88 @@
+"""Start-up budget for the gui entry point
+
+Times ``gui.py --startup-probe``, which imports everything the window needs (flet and views
+included) and creates the TrackMania it is given, then exits without building or showing a page.
+What it measures is import + init time, the part of start-up this code controls; flet's own time to
+connect and paint the first frame is not included. Exits non-zero when the median run exceeds the
+budget. It also checks that the headless code paths (``--openplanet``, ``--install``...) never
+import flet.
+
+    python benchmarks/startup.py --budget 1.5 --runs 7
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUI = os.path.join(ROOT, "gui.py")
+
+
+def probe_env():
+    env = os.environ.copy()
+    env.setdefault("WINEPREFIX", os.path.join(ROOT, ".startup-probe-prefix"))
+    env.setdefault("WINE", sys.executable)
+    env.setdefault("USER", "steamuser")
+    return env
+
+
+def time_probe(runs, env):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, GUI, "--startup-probe"], env=env, cwd=ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise SystemExit(f"Startup probe failed:\n{result.stderr}")
+        timings.append(elapsed)
+    return timings
+
+
+def import_profile(args, env):
+    """``(module, cumulative seconds)`` pairs from ``python -X importtime``."""
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args, env=env, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        modules.append((name.rstrip()[1:], int(cumulative) / 1e6))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("TM_STARTUP_BUDGET", 1.5)),
+                        help="Maximum median import + init time in seconds")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    env = probe_env()
+    failed = False
+
+    headless = [name for name, _ in import_profile(["-c", "import gui"], env)]
+    if any(name.strip() == "flet" for name in headless):
+        print("FAIL: importing gui for a headless command pulls in flet")
+        failed = True
+
+    timings = time_probe(args.runs, env)
+    median = statistics.median(timings)
+    print(f"import + init time: median {median * 1000:.0f} ms, min {min(timings) * 1000:.0f} ms, "
+          f"max {max(timings) * 1000:.0f} ms over {args.runs} runs (budget {args.budget * 1000:.0f} ms)")
+
+    slowest = sorted(import_profile([GUI, "--startup-probe"], env), key=lambda item: item[1], reverse=True)
+    print("slowest imports (cumulative):")
+    for name, seconds in [item for item in slowest if not item[0].startswith(" ")][:8]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    if median > args.budget:
+        print("FAIL: start-up is over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Detection, profile, install and launch benchmarks against synthetic prefixes
+
+Everything runs offline: prefixes are generated under a temporary directory, WINE points at a stub
+that exits immediately and TMLoader is served from a local HTTP server. Results are written as JSON
+so runs from different commits can be compared:
+
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fixtures import StaticServer, TMXServer, make_prefix, reset_game, write_stub_wine, write_tmloader_zip  # noqa: E402
+
+USER = "benchmark"
+
+
+def measure(function, setup=None, runs=5):
+    """Wall times of ``runs`` calls of ``function``, with ``setup`` (untimed) before each."""
+    times = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"runs": runs, "median": statistics.median(times), "min": min(times), "max": max(times),
+            "mean": statistics.fmean(times)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(work, reg_sizes, profile_count, runs):
+    import cache
+    import registry
+    import trackmania
+    from tools import find_through_uninstaller
+    from trackmania import TrackMania
+
+    results = {}
+
+    def bench(name, function, setup=None, count=runs):
+        results[name] = measure(function, setup, count)
+        print(f"{name:40} median {results[name]['median'] * 1000:10.2f} ms")
+
+    def clear_dir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+    for size_mb in reg_sizes:
+        pfx = make_prefix(os.path.join(work, f"reg{size_mb}mb"), USER, reg_size=size_mb << 20)
+        reg = os.path.join(pfx, "system.reg")
+
+        def cold():
+            registry.invalidate()
+            if os.path.exists(reg + registry.INDEX_SUFFIX):
+                os.remove(reg + registry.INDEX_SUFFIX)
+            clear_dir(cache.get_cache_dir("detection"))
+
+        lookup = lambda: find_through_uninstaller("TmNationsForever_is1", "InstallLocation", pfx)
+        bench(f"find_through_uninstaller[{size_mb}MB,cold]", lookup, cold)
+        bench(f"find_through_uninstaller[{size_mb}MB,index]", lookup, registry.invalidate)
+        bench(f"find_through_uninstaller[{size_mb}MB,warm]", lookup)
+        bench(f"TrackMania.__init__[{size_mb}MB,cold]", lambda: TrackMania(pfx=pfx), cold)
+        bench(f"TrackMania.__init__[{size_mb}MB,saved]", lambda: TrackMania(pfx=pfx), registry.invalidate)
+        bench(f"TrackMania.__init__[{size_mb}MB,warm]", lambda: TrackMania(pfx=pfx))
+
+    pfx = make_prefix(os.path.join(work, "profiles"), USER, profiles=profile_count)
+    tm = TrackMania(pfx=pfx)
+    profile_cache = cache.get_cache_dir("profiles")
+
+    def profiles_cold():
+        tm._profiles = None
+        clear_dir(profile_cache)
+
+    def profiles_disk():
+        tm._profiles = None
+
+    bench(f"get_profiles[{profile_count},cold]", tm.get_profiles, profiles_cold)
+    bench(f"get_profiles[{profile_count},cached]", tm.get_profiles, profiles_disk)
+    bench(f"iter_profiles[{profile_count},cold]", lambda: list(tm.iter_profiles()), profiles_cold)
+    bench(f"iter_profiles[{profile_count},cached]", lambda: list(tm.iter_profiles()), profiles_disk)
+    bench("launch[stub wine]", tm.start_vanilla)
+
+    served = os.path.join(work, "served")
+    os.makedirs(served, exist_ok=True)
+    write_tmloader_zip(os.path.join(served, "TMLoader.zip"))
+    pfx = make_prefix(os.path.join(work, "install"), USER)
+    with StaticServer(served) as server:
+        trackmania.TMLOADER_URL = server.url("TMLoader.zip")
+
+        def fresh_install():
+            reset_game(pfx)
+            shutil.rmtree(os.path.join(pfx, "drive_c", "Program Files", "TMLoader"), ignore_errors=True)
+
+        def uncached_install():
+            fresh_install()
+            os.environ["TM_CACHE"] = "0"
+
+        tm = TrackMania(pfx=pfx)
+        bench("install_modloader[download]", tm.install_modloader, uncached_install, max(3, runs // 2))
+        os.environ.pop("TM_CACHE", None)
+        clear_dir(cache.get_cache_dir("artifacts"))
+        tm.install_modloader()  # fill the artifact cache
+        bench("install_modloader[cached]", tm.install_modloader, fresh_install)
+        bench("install_modloader[reinstall]", tm.install_modloader)
+
+    from tmx import TrackCatalog
+    track_ids = list(range(1, 501))
+    db_path = os.path.join(work, "tmx.sqlite3")
+    with TMXServer() as server:
+        def catalog_cold():
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+
+        lookup = lambda ttl: TrackCatalog(db_path, server.api_urls(), ttl=ttl).lookup(track_ids)
+        bench("tmx_lookup[500,cold]", lambda: lookup(3600), catalog_cold)
+        bench("tmx_lookup[500,cached]", lambda: lookup(3600))
+        bench("tmx_lookup[500,revalidate]", lambda: lookup(0))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change against a previous run; return the names that got slower than ``threshold``."""
+    regressions = []
+    print(f"\n{'benchmark':40} {'before':>10} {'after':>10} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        ratio = result["median"] / max(before["median"], 1e-9)
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:40} {before['median'] * 1000:8.2f}ms {result['median'] * 1000:8.2f}ms {ratio:7.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reg-sizes", default="1,10,100", help="system.reg sizes in MB, comma separated")
+    parser.add_argument("--profiles", type=int, default=2000, help="Number of TMLoader profiles to generate")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="JSON", help="Compare against the results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Slowdown ratio that counts as a regression with --compare")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated prefixes")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="tm-bench-")
+    os.environ.update({
+        "WINE": write_stub_wine(os.path.join(work, "wine")),
+        "WINEPREFIX": work,
+        "USER": USER,
+        "TM_CACHE_DIR": os.path.join(work, "cache"),
+    })
+    try:
+        results = run_suite(work, [int(size) for size in args.reg_sizes.split(",")], args.profiles, args.runs)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "time": time.time(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
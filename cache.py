@@ -0,0 +1,247 @@
+"""Content-addressed download cache shared across wine prefixes"""
+import contextlib
+import fcntl
+import hashlib
+import http.client
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from downloader import DownloadError, file_sha256, filename_from_url, fix_existing, get_downloader
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_FRESH_FOR = 24 * 60 * 60
+
+
+def get_cache_dir(*parts):
+    root = os.environ.get("TM_CACHE_DIR")
+    if not root:
+        root = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "trackmania-assets")
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def link_or_copy(src, dest, link=False):
+    """Put a copy of ``src`` at ``dest`` that can be written without touching ``src``: a reflink where
+    the filesystem can clone, a plain copy otherwise. With ``link``, hardlink instead; only for files
+    that are read and deleted, never edited in place."""
+    if link:
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+    from tools import reflink
+    if not reflink(src, dest):
+        shutil.copyfile(src, dest)
+
+
+class ArtifactStore:
+    """Downloads stored once as ``blobs/<sha256>``, with a URL -> hash index for lookups.
+
+    Cached URLs are revalidated with ETag/Last-Modified once ``fresh_for`` seconds have passed;
+    the least recently used blobs are evicted once the store grows past ``max_bytes``.
+    """
+    def __init__(self, root=None, max_bytes=None, fresh_for=DEFAULT_FRESH_FOR, downloader=None):
+        self.root = root or get_cache_dir("artifacts")
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("TM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self.downloader = downloader
+        self.index_path = os.path.join(self.root, "index.json")
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    @contextlib.contextmanager
+    def _index(self):
+        """Lock the index across threads and processes and yield it for modification."""
+        with self._lock, open(os.path.join(self.root, "index.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {"urls": {}, "blobs": {}}
+            yield index
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def lookup(self, url):
+        with self._index() as index:
+            entry = index["urls"].get(url)
+            if entry is None:
+                return None
+            try:
+                intact = os.path.getsize(self.blob_path(entry["sha256"])) == entry["size"]
+            except OSError:
+                intact = False
+            if not intact:
+                del index["urls"][url]
+                index["blobs"].pop(entry["sha256"], None)
+                return None
+            return dict(entry)
+
+    def add_file(self, path, url=None, etag=None, last_modified=None, sha256=None, link=False):
+        """Adopt a downloaded file into the store, returning its hash.
+
+        ``link`` hardlinks the blob to ``path``; pass it only when ``path`` will be deleted unchanged.
+        """
+        if sha256 is None:
+            sha256 = file_sha256(path)
+        blob = self.blob_path(sha256)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp_path = blob + ".tmp"
+            link_or_copy(path, tmp_path, link)
+            os.replace(tmp_path, blob)
+        self._record(sha256, os.path.getsize(blob), url, os.path.basename(path), etag, last_modified)
+        return sha256
+
+    def place(self, sha256, dest, link=False):
+        if dest is not None:
+            link_or_copy(self.blob_path(sha256), dest, link)
+        with self._index() as index:
+            blob = index["blobs"].get(sha256)
+            if blob is not None:
+                blob["last_used"] = time.time()
+        return dest
+
+    def fetch(self, url, out=None, sha256=None, size=None, progress=None, link=False):
+        """Place ``url`` into ``out`` from the store, downloading it only when missing or changed.
+
+        The placed file is a copy (reflinked where possible) unless ``link`` says it is only run and
+        deleted, as installers are; then it is hardlinked to the stored blob.
+        """
+        downloader = self.downloader or get_downloader()
+        entry = self._cached(downloader, url, sha256, size)
+        if entry is not None:
+            dest = self._destination(url, out, entry)
+            self.place(entry["sha256"], dest, link)
+            if progress:
+                progress(entry["size"], entry["size"])
+            return dest
+
+        result = downloader.fetch(url, out, sha256=sha256, size=size, progress=progress)
+        self.add_file(result.path, url, result.etag, result.last_modified, result.sha256, link)
+        self.evict()
+        return result.path
+
+    def fetch_bytes(self, url, sha256=None, size=None, progress=None):
+        """Return the contents of ``url``, mmapped from the store or downloaded into memory."""
+        downloader = self.downloader or get_downloader()
+        entry = self._cached(downloader, url, sha256, size)
+        if entry is not None:
+            self.place(entry["sha256"], None)
+            if progress:
+                progress(entry["size"], entry["size"])
+            if entry["size"] == 0:
+                return b""
+            with open(self.blob_path(entry["sha256"]), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data, result = downloader.fetch_bytes(url, sha256=sha256, size=size, progress=progress)
+        self.add_bytes(data, url, result.path, result.etag, result.last_modified, result.sha256)
+        self.evict()
+        return data
+
+    def add_bytes(self, data, url=None, filename=None, etag=None, last_modified=None, sha256=None):
+        if sha256 is None:
+            sha256 = hashlib.sha256(data).hexdigest()
+        blob = self.blob_path(sha256)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            with open(blob + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(blob + ".tmp", blob)
+        self._record(sha256, len(data), url, filename, etag, last_modified)
+        return sha256
+
+    def evict(self):
+        """Drop least recently used blobs until the store fits in ``max_bytes``."""
+        with self._index() as index:
+            blobs = index["blobs"]
+            total = sum(blob["size"] for blob in blobs.values())
+            for sha256 in sorted(blobs, key=lambda key: blobs[key]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.blob_path(sha256))
+                total -= blobs.pop(sha256)["size"]
+            index["urls"] = {url: entry for url, entry in index["urls"].items() if entry["sha256"] in blobs}
+
+    def _record(self, sha256, size, url, filename, etag, last_modified):
+        now = time.time()
+        with self._index() as index:
+            index["blobs"][sha256] = {"size": size, "last_used": now}
+            if url is not None:
+                index["urls"][url] = {"sha256": sha256, "size": size, "filename": filename, "etag": etag,
+                                      "last_modified": last_modified, "validated_at": now}
+
+    def _cached(self, downloader, url, sha256, size):
+        entry = self.lookup(url)
+        if entry is None or not self._is_valid(downloader, url, entry):
+            return None
+        if sha256 is not None and entry["sha256"] != sha256.lower():
+            return None
+        if size is not None and entry["size"] != size:
+            return None
+        return entry
+
+    def _is_valid(self, downloader, url, entry):
+        if time.time() - entry.get("validated_at", 0) < self.fresh_for:
+            return True
+        headers = {"Range": "bytes=0-0"}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if len(headers) == 1:
+            return False
+        try:
+            response = downloader.request(url, headers)
+            response.discard()
+        except (OSError, http.client.HTTPException, DownloadError) as e:
+            print(f"Could not revalidate {url} ({e}), using cached copy")
+            return True
+        if response.status != 304:
+            return False
+        with self._index() as index:
+            cached = index["urls"].get(url)
+            if cached is not None:
+                cached["validated_at"] = time.time()
+        return True
+
+    @staticmethod
+    def _destination(url, out, entry):
+        if out is None:
+            out = os.getcwd()
+        if not os.path.isdir(out):
+            return str(out)
+        return fix_existing(os.path.join(out, entry.get("filename") or filename_from_url(url) or "download"))
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_artifact_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ArtifactStore()
+        return _default_store
+
+
+def cache_enabled():
+    return os.environ.get("TM_CACHE", "1") not in ("0", "false", "no")
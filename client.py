@@ -0,0 +1,106 @@
+"""Command line for the helper daemon (gui.py --daemon), starting it on first use
+
+Meant for launchers such as Lutris: ``python client.py launch --profile Default`` answers in
+milliseconds once the daemon is warm, and exits with the game's exit code. Only the standard
+library is imported here.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from daemon import DaemonError, default_socket_path, request
+
+START_TIMEOUT = 15
+
+
+def start_daemon(socket_path):
+    """Start ``gui.py --daemon`` in its own session and wait until it answers."""
+    gui = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gui.py")
+    with open(socket_path + ".log", "ab") as log:
+        subprocess.Popen([sys.executable, gui, "--daemon", "--socket", socket_path], stdin=subprocess.DEVNULL,
+                         stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            return request("ping", socket_path, timeout=1)
+        except OSError:
+            time.sleep(0.05)
+    raise DaemonError(f"The daemon did not start, see {socket_path}.log")
+
+
+def send(args, command, **arguments):
+    on_status = None if args.quiet else lambda reply: print(f"[job {reply['job']}] {reply['status']}", file=sys.stderr)
+    arguments.update(pfx=args.pfx, wine=args.wine, detach=args.detach)
+    try:
+        return request(command, args.socket, on_status, **arguments)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if args.no_start or command == "shutdown":
+            raise DaemonError(f"No daemon is listening on {args.socket}")
+    start_daemon(args.socket)
+    return request(command, args.socket, on_status, **arguments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=default_socket_path(), help="Daemon socket (or TM_DAEMON_SOCKET)")
+    parser.add_argument("--pfx", default=os.environ.get("WINEPREFIX"), help="Wine prefix (default: $WINEPREFIX)")
+    parser.add_argument("--wine", default=os.environ.get("WINE"), help="Wine executable (default: $WINE)")
+    parser.add_argument("--no-start", action="store_true", help="Fail instead of starting the daemon")
+    parser.add_argument("--detach", action="store_true", help="Return the job ID instead of waiting for the result")
+    parser.add_argument("--quiet", action="store_true", help="Do not print progress")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("ping")
+    commands.add_parser("status")
+    commands.add_parser("profiles", help="List the TMLoader profiles of the prefix")
+    launch = commands.add_parser("launch", help="Start the game and wait for it to exit")
+    launch.add_argument("--profile", help="TMLoader profile to start")
+    launch.add_argument("--tmloader", action="store_true", help="Open TMLoader itself")
+    launch.add_argument("--openplanet", action="store_true", help="Start TMUF with OpenPlanet")
+    track = commands.add_parser("track", help="Download one TMX track")
+    track.add_argument("track_id")
+    track.add_argument("--united", action="store_true")
+    tracks = commands.add_parser("tracks", help="Download every track listed in a file, like gui.py --tracks")
+    tracks.add_argument("file")
+    tracks.add_argument("--united", action="store_true")
+    tracks.add_argument("--bandwidth", metavar="KIB_PER_S", type=int)
+    commands.add_parser("install", help="Install or update TMLoader")
+    commands.add_parser("refresh", help="Make the daemon detect the prefix again")
+    commands.add_parser("jobs")
+    cancel = commands.add_parser("cancel")
+    cancel.add_argument("job", type=int)
+    commands.add_parser("shutdown")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "launch":
+            result = send(args, "launch", profile=args.profile, tmloader=args.tmloader, openplanet=args.openplanet,
+                          env=dict(os.environ), clicked=time.monotonic())
+            if isinstance(result, int):
+                return result
+        elif args.command == "track":
+            result = send(args, "download-track", track_id=args.track_id, united=args.united)
+        elif args.command == "tracks":
+            with open(args.file, "r", encoding="utf-8") as f:
+                result = send(args, "download-tracks", lines=f.read().splitlines(), united=args.united,
+                              bandwidth=args.bandwidth * 1024 if args.bandwidth else None)
+        elif args.command == "cancel":
+            result = send(args, "cancel", job=args.job)
+        else:
+            result = send(args, args.command)
+    except (DaemonError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.command == "profiles" and not args.detach:
+        for profile in result:
+            print(f"{profile['name']:30} {profile['description'] or ''}")
+    elif result is not None:
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
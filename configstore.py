@@ -0,0 +1,234 @@
+"""Batched, atomic writes of configuration files
+
+Changes made inside ``with store.batch():`` are collected per file and each file is written once
+when the batch ends: to a temporary file next to it, then renamed over it, while holding an flock
+shared by every process using the same cache dir (fleet workers, the daemon, the window). Edits
+are read-modify-write functions; if another process changed the file since it was read, they are
+replayed on its new contents instead of overwriting them. Files whose contents would not change are
+not written at all.
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+
+from cache import get_cache_dir
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class _Pending:
+    __slots__ = ("data", "base", "edits", "replaced")
+
+    def __init__(self, data, base):
+        self.data = data
+        self.base = base
+        self.edits = []
+        self.replaced = False
+
+
+class ConfigStore:
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        self.stats = {"writes": 0, "unchanged": 0, "coalesced": 0, "replayed": 0, "batches": 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Defer every write until the outermost batch of this thread ends.
+
+        Nothing is written if the batch ends with an exception; what it queued is discarded.
+        """
+        state = self._state()
+        state["depth"] += 1
+        try:
+            yield self
+        except BaseException:
+            state["depth"] -= 1
+            if state["depth"] == 0:
+                self.discard()
+            raise
+        state["depth"] -= 1
+        if state["depth"] == 0:
+            self.flush()
+
+    def read(self, path):
+        """The file's contents as this thread's batch will leave it, or None if there is no such file."""
+        pending = self._state()["pending"].get(os.path.abspath(path))
+        return pending.data if pending is not None else _read(path)
+
+    def write(self, path, data: bytes):
+        """Replace the file's contents; returns False when they are the same already."""
+        return self.edit(path, lambda current: data, replace=True)
+
+    def edit(self, path, function, replace=False):
+        """Apply ``function(current bytes or None) -> bytes`` to the file; returns whether that changed it."""
+        path = os.path.abspath(path)
+        state = self._state()
+        if state["depth"] == 0:
+            with self.locked(path):
+                current = _read(path)
+                data = function(current)
+                if data == current:
+                    return False
+                self._replace(path, data)
+            return True
+        pending = state["pending"].get(path)
+        if pending is None:
+            with self.locked(path):
+                base = _signature(path)
+                current = _read(path)
+            data = function(current)
+            if data == current:
+                return False
+            pending = state["pending"][path] = _Pending(data, base)
+        else:
+            data = function(pending.data)
+            if data == pending.data:
+                return False
+            pending.data = data
+            with self._lock:
+                self.stats["coalesced"] += 1
+        if replace:
+            pending.replaced = True
+            pending.edits.clear()
+        elif not pending.replaced:
+            pending.edits.append(function)
+        return True
+
+    def on_flush(self, key, callback, on_discard=None):
+        """Call ``callback()`` once after the current batch is written (right away outside of a batch),
+        or ``on_discard()`` if it is discarded instead."""
+        state = self._state()
+        if state["depth"] == 0:
+            callback()
+        else:
+            state["callbacks"].setdefault(key, (callback, on_discard))
+
+    def flush(self):
+        state = self._state()
+        pending, callbacks = state["pending"], state["callbacks"]
+        state["pending"], state["callbacks"] = {}, {}
+        with self._lock:
+            self.stats["batches"] += 1
+        for path, entry in pending.items():
+            self._flush_one(path, entry)
+        for callback, _ in callbacks.values():
+            callback()
+
+    def discard(self):
+        """Forget what this thread's batch queued without writing it."""
+        state = self._state()
+        callbacks = state["callbacks"]
+        state["pending"], state["callbacks"] = {}, {}
+        for _, on_discard in callbacks.values():
+            if on_discard is not None:
+                on_discard()
+
+    @contextlib.contextmanager
+    def locked(self, path):
+        """Hold the inter-process lock of ``path``."""
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+        lock_dir = self.lock_dir or get_cache_dir("locks")
+        with open(os.path.join(lock_dir, key + ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _flush_one(self, path, pending):
+        with self.locked(path):
+            data = pending.data
+            if not pending.replaced and pending.edits and _signature(path) != pending.base:
+                # Someone else wrote the file since it was read; redo the edits on top of their version
+                data = _read(path)
+                for function in pending.edits:
+                    data = function(data)
+                with self._lock:
+                    self.stats["replayed"] += 1
+            if data == _read(path):
+                with self._lock:
+                    self.stats["unchanged"] += 1
+                return
+            self._replace(path, data)
+
+    def _replace(self, path, data):
+        """Write ``data`` next to ``path`` and rename it over it; the caller holds the lock."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.stats["writes"] += 1
+
+    def _state(self):
+        state = getattr(self._local, "state", None)
+        if state is None:
+            state = self._local.state = {"depth": 0, "pending": {}, "callbacks": {}}
+        return state
+
+
+class DebouncedWriter:
+    """Writes ``render()`` to ``path`` through a ConfigStore once no change was scheduled for ``delay`` seconds."""
+    def __init__(self, path, render, delay=1.0, store=None):
+        self.path = path
+        self.render = render
+        self.delay = delay
+        self.store = store
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write now if a change is pending."""
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer.cancel()
+            self._timer = None
+        (self.store or get_config_store()).write(self.path, self.render())
+
+
+def format_stats(stats):
+    return (f"{stats['writes']} config files written, {stats['unchanged']} unchanged, "
+            f"{stats['coalesced']} writes coalesced, {stats['replayed']} edits replayed")
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_config_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ConfigStore()
+        return _default_store
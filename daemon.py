@@ -0,0 +1,297 @@
+"""Long-running helper that keeps TrackMania instances warm, driven over a Unix domain socket
+
+Started with ``gui.py --daemon``, it keeps one detected TrackMania per prefix (with its registry
+index and profile cache), the download connection pool and the imported modules for its whole
+life, so a command only pays for the work it does. ``client.py`` is the command line for it.
+
+The protocol is one JSON object per line in both directions. A request is
+``{"command": ..., "pfx": ..., "wine": ..., <arguments>}``; while a command runs the daemon may send
+``{"status": ...}`` lines, then exactly one ``{"ok": true, "result": ...}`` or
+``{"ok": false, "error": ...}``.
+"""
+import json
+import os
+import select
+import socket
+import socketserver
+import threading
+import time
+
+SOCKET_ENV = "TM_DAEMON_SOCKET"
+STATUS_INTERVAL = 0.5
+KEEP_FINISHED_JOBS = 50
+# A daemon's launches are further apart than the window's countdown
+PREWARM_PERSIST = 15 * 60
+
+
+def default_socket_path():
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "trackmania-assets.sock")
+    return f"/tmp/trackmania-assets-{os.getuid()}.sock"
+
+
+class DaemonError(Exception):
+    pass
+
+
+def request(command, socket_path=None, on_status=None, timeout=None, **arguments):
+    """Send one command to the daemon and return its result; raises DaemonError when it failed."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall(json.dumps({"command": command, **arguments}).encode() + b"\n")
+        with sock.makefile("r", encoding="utf-8") as stream:
+            for line in stream:
+                reply = json.loads(line)
+                if "ok" not in reply:
+                    if on_status is not None:
+                        on_status(reply)
+                    continue
+                if not reply["ok"]:
+                    raise DaemonError(reply["error"])
+                return reply["result"]
+    raise DaemonError("The daemon closed the connection")
+
+
+class Daemon:
+    """Commands and the per-prefix state they run against."""
+    def __init__(self, socket_path=None, workers=8):
+        from jobs import JobScheduler
+
+        self.socket_path = socket_path or default_socket_path()
+        self.started = time.monotonic()
+        self.jobs = JobScheduler(workers=workers, max_pending=64)
+        self.instances = {}
+        self.server = None
+        self._lock = threading.Lock()
+        self._prefix_locks = {}
+        self.commands = {
+            "ping": self.ping,
+            "status": self.status,
+            "profiles": self.list_profiles,
+            "launch": self.launch,
+            "download-track": self.download_track,
+            "download-tracks": self.download_tracks,
+            "install": self.install,
+            "refresh": self.refresh,
+            "jobs": self.list_jobs,
+            "cancel": self.cancel,
+            "shutdown": self.shutdown,
+        }
+        # Commands that are answered right away instead of going through the job pool
+        self.immediate = {"ping", "status", "jobs", "cancel", "shutdown", "refresh"}
+
+    def trackmania(self, request):
+        """The warm TrackMania for the request's prefix and wine, detecting it on first use."""
+        from trackmania import TrackMania
+
+        pfx = request.get("pfx") or os.environ.get("WINEPREFIX")
+        if not pfx:
+            raise DaemonError("No prefix given and WINEPREFIX is not set")
+        key = (os.path.abspath(pfx), request.get("wine") or os.environ.get("WINE"))
+        with self._lock:
+            tm = self.instances.get(key)
+            prefix_lock = self._prefix_locks.setdefault(key, threading.Lock())
+        if tm is not None:
+            return tm
+        with prefix_lock:
+            tm = self.instances.get(key)
+            if tm is None:
+                tm = TrackMania(pfx=key[0], wine_path=key[1])
+                # Installs, uninstalls and profile edits made outside the daemon show up without a refresh
+                tm.watch()
+                if tm.prewarm:
+                    # Kept for the launches that follow; it goes away by itself once idle for PREWARM_PERSIST
+                    tm.prewarm_wineserver(persist=PREWARM_PERSIST)
+                with self._lock:
+                    self.instances[key] = tm
+        return tm
+
+    def ping(self, request, job=None):
+        return {"pid": os.getpid(), "uptime": time.monotonic() - self.started}
+
+    def status(self, request, job=None):
+        with self._lock:
+            instances = list(self.instances.items())
+        return {"pid": os.getpid(), "uptime": time.monotonic() - self.started,
+                "prefixes": [{"pfx": pfx, "wine": wine, "united": tm.united, "path": tm.path,
+                              "tmloader": bool(tm.tmloader_path)} for (pfx, wine), tm in instances],
+                "jobs": self.list_jobs(request)}
+
+    def list_profiles(self, request, job=None):
+        tm = self.trackmania(request)
+        if not tm.tmloader_path:
+            raise DaemonError("TMLoader is not installed in this prefix")
+        return [{"name": entry.name, "description": entry.description} for entry in tm.iter_profiles()]
+
+    def launch(self, request, job=None):
+        """Start the game and return its exit code. ``env`` is the client's environment, so a launch
+        sees the variables Lutris set for it rather than the daemon's. ``clicked`` is the client's
+        time.monotonic() when the command was given (the clock is shared by every process)."""
+        tm = self.trackmania(request)
+        env, clicked = request.get("env"), request.get("clicked")
+        if request.get("profile"):
+            return tm.start_tmloader_profile(request["profile"], clicked=clicked, extra_env=env)
+        if request.get("openplanet"):
+            return tm.launch_openplanet(extra_env=env)
+        if request.get("tmloader"):
+            return tm.start_tmloader(clicked=clicked, extra_env=env)
+        return tm.start_vanilla(clicked=clicked, extra_env=env)
+
+    def download_track(self, request, job=None):
+        return self.trackmania(request).download_track(str(request["track_id"]), bool(request.get("united")),
+                                                       progress=job.progress if job else None)
+
+    def download_tracks(self, request, job=None):
+        """``lines`` in the track list format of ``gui.py --tracks``."""
+        if job is not None:
+            job.unit = "tracks"
+        from tracks import parse_track_list
+        tracks = parse_track_list(request["lines"], bool(request.get("united")))
+        return self.trackmania(request).download_tracks(tracks, bandwidth=request.get("bandwidth"),
+                                                        progress=job.progress if job else None)
+
+    def install(self, request, job=None):
+        tm = self.trackmania(request)
+        timings = tm.install_modloader()
+        return {"timings": timings, "report": tm.install_report}
+
+    def refresh(self, request, job=None):
+        """Forget a prefix's state so the next command detects it again."""
+        pfx = request.get("pfx") or os.environ.get("WINEPREFIX") or ""
+        with self._lock:
+            dropped = [key for key in self.instances if key[0] == os.path.abspath(pfx)]
+            for key in dropped:
+                self.instances.pop(key).stop_watching()
+        return len(dropped)
+
+    def list_jobs(self, request, job=None):
+        return [{"id": j.id, "name": j.name, "state": j.state, "status": j.status()} for j in self.jobs.all()]
+
+    def cancel(self, request, job=None):
+        target = self.jobs.jobs.get(request.get("job"))
+        if target is None:
+            raise DaemonError(f"No job {request.get('job')}")
+        target.cancel()
+        return target.id
+
+    def shutdown(self, request, job=None):
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+        return True
+
+    def handle(self, request, send, connected=None):
+        """Run one request, sending status lines while it is in progress; returns the final reply.
+
+        ``connected()`` tells whether the client is still there; a job whose client went away is cancelled.
+        """
+        command = request.get("command")
+        function = self.commands.get(command)
+        if function is None:
+            return {"ok": False, "error": f"Unknown command {command!r}"}
+        try:
+            if command in self.immediate:
+                return {"ok": True, "result": function(request)}
+            self.jobs.prune(KEEP_FINISHED_JOBS)
+            job = self.jobs.submit(f"{command} {request.get('pfx') or ''}".strip(), lambda j: function(request, j))
+            if request.get("detach"):
+                return {"ok": True, "result": {"job": job.id}}
+            last = None
+            while True:
+                result = job.wait(STATUS_INTERVAL)
+                if job.finished_running:
+                    return {"ok": True, "result": result}
+                if connected is not None and not connected():
+                    # Noticed even when the job has nothing new to report, e.g. a running game
+                    job.cancel()
+                    raise ConnectionAbortedError("The client went away")
+                status = job.status()
+                if status != last:
+                    try:
+                        send({"job": job.id, "status": status})
+                    except OSError:
+                        # The client went away, nobody is waiting for the result any more
+                        job.cancel()
+                        raise
+                    last = status
+        except OSError:
+            raise
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def warm(self, pfx=None):
+        """Import what commands need and detect the default prefix ahead of the first request."""
+        import downloader  # noqa: F401
+        import profiles  # noqa: F401
+        import tracks  # noqa: F401
+        if pfx or os.environ.get("WINEPREFIX"):
+            try:
+                tm = self.trackmania({"pfx": pfx})
+                if tm.tmloader_path:
+                    list(tm.iter_profiles())
+            except Exception as e:
+                print(f"Could not detect {pfx or os.environ.get('WINEPREFIX')}: {e}")
+
+    def serve(self, warm_pfx=None):
+        self._claim_socket()
+        self.server = _Server(self.socket_path, _Handler)
+        self.server.helper = self
+        os.chmod(self.socket_path, 0o600)
+        print(f"Listening on {self.socket_path}")
+        threading.Thread(target=self.warm, args=(warm_pfx,), name="warm", daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+            self.jobs.shutdown(wait=False)
+
+    def _claim_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+        try:
+            request("ping", self.socket_path, timeout=2)
+        except OSError:
+            # Left behind by a daemon that did not exit cleanly
+            os.remove(self.socket_path)
+            return
+        raise DaemonError(f"A daemon is already listening on {self.socket_path}")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        lock = threading.Lock()
+
+        def send(message):
+            with lock:
+                self.wfile.write(json.dumps(message, default=str).encode() + b"\n")
+                self.wfile.flush()
+
+        def connected():
+            # A closed connection reads as end of file; pipelined requests just stay buffered
+            try:
+                readable, _, _ = select.select([self.connection], [], [], 0)
+                return not readable or self.connection.recv(1, socket.MSG_PEEK) != b""
+            except OSError:
+                return False
+
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+            except ValueError:
+                send({"ok": False, "error": "Invalid JSON"})
+                continue
+            try:
+                send(self.server.helper.handle(req, send, connected))
+            except OSError:
+                return
@@ -0,0 +1,246 @@
+"""Persisted detection results, kept current with inotify
+
+What ``TrackMania.detect`` finds in a prefix (the game's path and edition, the documents folder
+and the UVME uninstaller) is saved per prefix and user, and reused as long as system.reg is the
+file it was read from. A DetectionWatcher follows system.reg, the game folder, the TMLoader folder
+and its profiles with inotify and re-runs only the part of detection that a change affects, so a
+long-lived process (the window, the daemon) never works from stale state.
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import struct
+import threading
+import time
+
+from cache import cache_enabled, get_cache_dir
+
+STATE_VERSION = 1
+STATE_FIELDS = ("united", "path", "documents_folder", "uvme_uninstaller")
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+DIR_CHANGES = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+FILE_CHANGES = DIR_CHANGES | IN_CLOSE_WRITE
+GAME_EXECUTABLES = {"TmForever.exe", "TmForever.bak.exe", "TmForeverLauncher.exe"}
+# Wine rewrites system.reg several times in a row when it saves the registry
+DEBOUNCE = 0.2
+
+_event = struct.Struct("iIII")
+
+
+def state_path(pfx):
+    key = hashlib.sha1(f"{os.path.abspath(pfx)}\0{os.environ.get('USER')}".encode()).hexdigest()[:16]
+    return os.path.join(get_cache_dir("detection"), key + ".json")
+
+
+def _registry_stat(pfx):
+    try:
+        stat = os.stat(os.path.join(pfx, "system.reg"))
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def save_detection(tm):
+    """Persist the registry-derived detection results of ``tm``."""
+    if not cache_enabled():
+        return
+    state = {"version": STATE_VERSION, "system.reg": _registry_stat(tm.pfx)}
+    state.update((field, getattr(tm, field)) for field in STATE_FIELDS)
+    path = state_path(tm.pfx)
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+
+def load_detection(tm):
+    """Fill in ``tm`` from the saved state if system.reg has not changed since; returns whether it did."""
+    if not cache_enabled():
+        return False
+    try:
+        with open(state_path(tm.pfx), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if state.get("version") != STATE_VERSION or state.get("system.reg") != _registry_stat(tm.pfx):
+        return False
+    # Whatever the caller passed explicitly must agree with what was detected
+    if (tm.path is not None and tm.path != state["path"]) or (tm.united is not None and tm.united != state["united"]):
+        return False
+    if not state["path"] or not os.path.isdir(state["path"]):
+        return False
+    for field in STATE_FIELDS:
+        setattr(tm, field, state[field])
+    return True
+
+
+class Inotify:
+    """Minimal inotify(7) binding through ctypes."""
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """``[(wd, mask, name)]``, waiting up to ``timeout`` seconds for the first event."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _event.unpack_from(data, offset)
+            offset += _event.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class DetectionWatcher:
+    """Keeps a TrackMania's detection results current from a background thread.
+
+    Changes are grouped into the parts of detection they affect: ``registry`` (system.reg: game
+    path, edition, UVME), ``game`` (the game folder), ``tmloader`` and ``profiles``. Only those
+    parts are re-run, then ``on_change(parts)`` is called.
+    """
+    def __init__(self, tm, on_change=None):
+        self.tm = tm
+        self.on_change = on_change
+        self.inotify = Inotify()
+        self.watches = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._arm()
+        self._thread = threading.Thread(target=self._run, name="detection-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.inotify.close()
+
+    def targets(self):
+        """``{path: (part, mask, names)}`` to watch; ``names`` limits a directory watch to those entries."""
+        tm = self.tm
+        program_files = os.path.join(tm.pfx, "drive_c", "Program Files")
+        targets = {
+            tm.pfx: ("registry", FILE_CHANGES, {"system.reg"}),
+            program_files: ("tmloader", DIR_CHANGES, {"TMLoader"}),
+            os.path.join(program_files, "TMLoader"): ("tmloader", DIR_CHANGES, {"TMLoader.exe", "database"}),
+        }
+        if tm.path:
+            targets[tm.path.rstrip("/")] = ("game", DIR_CHANGES, GAME_EXECUTABLES)
+        if tm.tmloader_path:
+            # The profiles folder is only created by the first profile written
+            targets[tm.tmloader_path + "database"] = ("tmloader", DIR_CHANGES, {"TmForever"})
+            targets[tm.tmloader_path + "database/TmForever"] = ("tmloader", DIR_CHANGES, {"profiles"})
+            targets[tm.tmloader_path + "database/TmForever/profiles"] = ("profiles", FILE_CHANGES, None)
+        return targets
+
+    def _arm(self):
+        """Watch what exists of the targets; called again after every change since folders come and go."""
+        targets = self.targets()
+        for wd, (path, _, _, _) in list(self.watches.items()):
+            if path not in targets:
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+        watched = {watch[0] for watch in self.watches.values()}
+        for path, (part, mask, names) in targets.items():
+            if path in watched:
+                continue
+            try:
+                wd = self.inotify.add_watch(path, mask)
+            except OSError:
+                continue
+            self.watches[wd] = (path, part, mask, names)
+        # The profile listing can only be trusted while its folder is actually being watched
+        if self.tm._profiles is not None:
+            self.tm._profiles.listing_watched = self.watching("profiles")
+
+    def watching(self, part):
+        return any(watch[1] == part for watch in self.watches.values())
+
+    def _parts(self, events):
+        parts = set()
+        for wd, mask, name in events:
+            watch = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            if watch is None:
+                continue
+            path, part, _, names = watch
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED) or names is None or name in names:
+                parts.add(part)
+        return parts
+
+    def _run(self):
+        while not self._stop.is_set():
+            events = self.inotify.read(timeout=0.5)
+            if not events:
+                continue
+            deadline = time.monotonic() + DEBOUNCE
+            while (remaining := deadline - time.monotonic()) > 0:
+                events += self.inotify.read(timeout=remaining)
+            parts = self._parts(events)
+            if parts:
+                try:
+                    self.apply(parts)
+                except Exception as e:
+                    print(f"Could not update detection after {', '.join(sorted(parts))} changed: {e!r}")
+
+    def apply(self, parts):
+        """Re-run the parts of detection that ``parts`` affect."""
+        tm = self.tm
+        if parts & {"registry", "game"}:
+            tm.redetect_game()
+        if "tmloader" in parts:
+            tm._check_for_tmloader()
+        if "profiles" in parts and tm._profiles is not None:
+            tm._profiles.invalidate()
+        self._arm()
+        if self.on_change is not None:
+            self.on_change(parts)
@@ -0,0 +1,501 @@
+"""Segmented, resumable HTTP downloads"""
+import hashlib
+import http.client
+import json
+import os
+import re
+import threading
+import time
+from typing import NamedTuple, Optional
+from urllib.parse import urljoin, urlsplit, unquote
+
+USER_AGENT = "TrackManiaAssets"
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Overloaded or briefly broken servers; worth asking again after the backoff
+RETRY_CODES = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+STATE_INTERVAL = 1.0
+
+
+class DownloadError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def _retryable(error):
+    if isinstance(error, DownloadError):
+        return error.status in RETRY_CODES
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+class DownloadResult(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    url: Optional[str] = None
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, reused per scheme/host across downloads and threads."""
+    def __init__(self, timeout=30, max_idle=8):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def get(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            if self._ssl_context is None:
+                import ssl  # only needed once an https URL is actually fetched
+                self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self._ssl_context), False
+        if scheme == "http":
+            return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+        raise DownloadError(f"Unsupported URL scheme: {scheme}")
+
+    def put(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+class _Response:
+    """An open response together with the pooled connection it came from."""
+    def __init__(self, pool, scheme, netloc, conn, response, url):
+        self.pool = pool
+        self.scheme = scheme
+        self.netloc = netloc
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+
+    def header(self, name):
+        return self.response.getheader(name)
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def release(self):
+        """Return the connection to the pool if the body was fully consumed."""
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.scheme, self.netloc, self.conn)
+        else:
+            self.conn.close()
+
+    def discard(self):
+        self.response.read()
+        self.release()
+
+
+def filename_from_headers(content_disposition):
+    if not content_disposition:
+        return None
+    match = re.search(r"filename\*\s*=\s*(?:[\w-]+'[\w-]*')?\"?([^\";]+)\"?", content_disposition, re.IGNORECASE)
+    if match:
+        name = unquote(match.group(1).strip())
+    else:
+        match = re.search(r'filename\s*=\s*"?([^";]+)"?', content_disposition, re.IGNORECASE)
+        if not match:
+            return None
+        name = match.group(1).strip()
+    name = os.path.basename(name.replace("\\", "/"))
+    return name or None
+
+
+def filename_from_url(url):
+    return os.path.basename(urlsplit(url).path) or None
+
+
+def fix_existing(path):
+    """Same naming as wget.download: "name (1).ext" when the file is already there."""
+    if not os.path.exists(path):
+        return path
+    folder, name = os.path.split(path)
+    stem, dot, ext = name.partition(".")
+    i = 1
+    while True:
+        candidate = os.path.join(folder, f"{stem} ({i}){dot}{ext}")
+        if not os.path.exists(candidate):
+            return candidate
+        i += 1
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_segments(total, count):
+    if total <= 0:
+        return []
+    count = max(1, min(count, total))
+    size = -(-total // count)
+    return [[start, min(start + size, total) - 1, 0] for start in range(0, total, size)]
+
+
+class Downloader:
+    """Downloads files over pooled keep-alive connections.
+
+    Servers that honour Range requests get the file in parallel segments written into a ``.part``
+    file next to the destination; progress is kept in a ``.part.json`` sidecar so an interrupted
+    download carries on where it stopped. Other servers fall back to a single stream.
+    """
+    def __init__(self, connections=4, segment_size=4 * 1024 * 1024, timeout=30, retries=5, backoff=0.5):
+        self.connections = connections
+        self.segment_size = segment_size
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(timeout=timeout, max_idle=connections * 2)
+
+    def request(self, url, headers=None, method="GET"):
+        """Send a request following redirects, returning the open response."""
+        request_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+        if headers:
+            request_headers.update(headers)
+        for _ in range(10):
+            parts = urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            conn, reused = self.pool.get(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, headers=request_headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # Stale keep-alive connection, try once more on a fresh one
+                conn, _ = self.pool.get(parts.scheme, parts.netloc)
+                conn.request(method, path, headers=request_headers)
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+            result = _Response(self.pool, parts.scheme, parts.netloc, conn, response, url)
+            if response.status in REDIRECT_CODES and response.getheader("Location"):
+                result.discard()
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            return result
+        raise DownloadError(f"Too many redirects for {url}")
+
+    def fetch(self, url, out=None, sha256=None, size=None, progress=None) -> DownloadResult:
+        """Download ``url`` into ``out`` (a folder or a file path, default the working directory)."""
+        probe = self._with_retries(lambda: self._probe(url))
+        try:
+            dest = self._destination(url, out, probe)
+            etag = probe.header("ETag")
+            last_modified = probe.header("Last-Modified")
+            source = probe.url
+            probe, total = self._open_body(url, probe)
+            if probe is None:
+                self._fetch_segmented(url, source, dest, total, etag or last_modified, progress)
+            else:
+                self._fetch_stream(url, dest, probe, progress)
+                probe = None
+        finally:
+            if probe is not None:
+                probe.response.close()
+                probe.conn.close()
+
+        part = dest + ".part"
+        actual_size = os.path.getsize(part)
+        if size is not None and actual_size != size:
+            os.remove(part)
+            raise DownloadError(f"Size mismatch for {url}: expected {size}, got {actual_size}")
+        digest = file_sha256(part)
+        if sha256 is not None and digest != sha256.lower():
+            os.remove(part)
+            raise DownloadError(f"SHA-256 mismatch for {url}: expected {sha256}, got {digest}")
+        os.replace(part, dest)
+        return DownloadResult(dest, actual_size, digest, etag, last_modified, url)
+
+    def fetch_bytes(self, url, sha256=None, size=None, progress=None):
+        """Download ``url`` straight into memory, returning ``(data, result)`` without touching the disk.
+
+        ``result.path`` is the file name the server suggested.
+        """
+        probe = self._with_retries(lambda: self._probe(url))
+        try:
+            name = filename_from_headers(probe.header("Content-Disposition")) or filename_from_url(url) or "download"
+            etag = probe.header("ETag")
+            last_modified = probe.header("Last-Modified")
+            source = probe.url
+            probe, total = self._open_body(url, probe)
+            if probe is None:
+                data = bytearray(total)
+
+                def write(offset, block):
+                    data[offset:offset + len(block)] = block
+
+                self._run_segments(source, split_segments(total, self._segment_count(total)), total,
+                                   etag or last_modified, write, progress)
+            else:
+                data = self._read_stream(url, probe, progress)
+                probe = None
+        finally:
+            if probe is not None:
+                probe.response.close()
+                probe.conn.close()
+
+        if size is not None and len(data) != size:
+            raise DownloadError(f"Size mismatch for {url}: expected {size}, got {len(data)}")
+        digest = hashlib.sha256(data).hexdigest()
+        if sha256 is not None and digest != sha256.lower():
+            raise DownloadError(f"SHA-256 mismatch for {url}: expected {sha256}, got {digest}")
+        return data, DownloadResult(name, len(data), digest, etag, last_modified, url)
+
+    def close(self):
+        self.pool.close()
+
+    def _probe(self, url):
+        response = self.request(url, {"Range": "bytes=0-0"})
+        if response.status == 416:
+            # Range requests on an empty file are unsatisfiable, ask for the whole thing
+            response.discard()
+            response = self.request(url)
+        if response.status not in (200, 206):
+            response.discard()
+            raise DownloadError(f"HTTP {response.status} for {url}", response.status)
+        return response
+
+    def _open_body(self, url, probe):
+        """Turn the probe into either a streamable response or ``(None, total)`` for segmented fetching."""
+        if probe.status != 206:
+            return probe, None
+        match = re.match(r"bytes\s+\d+-\d+/(\d+)", probe.header("Content-Range") or "")
+        probe.discard()
+        if match:
+            return None, int(match.group(1))
+        return self._with_retries(lambda: self._get(url)), None
+
+    def _get(self, url):
+        """A plain GET of the whole body; anything but a 200 is a DownloadError carrying the status."""
+        response = self.request(url)
+        if response.status != 200:
+            response.discard()
+            raise DownloadError(f"HTTP {response.status} for {url}", response.status)
+        return response
+
+    def _segment_count(self, total):
+        return max(1, min(self.connections, total // self.segment_size))
+
+    @staticmethod
+    def _destination(url, out, probe):
+        if out is None:
+            out = os.getcwd()
+        if not os.path.isdir(out):
+            return str(out)
+        name = filename_from_headers(probe.header("Content-Disposition")) or filename_from_url(url) or "download"
+        dest = os.path.join(out, name)
+        if os.path.exists(dest + ".part.json"):
+            return dest
+        return fix_existing(dest)
+
+    def _with_retries(self, func):
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except (OSError, http.client.HTTPException, DownloadError) as e:
+                if not _retryable(e):
+                    raise
+                attempt += 1
+                if attempt > self.retries:
+                    if isinstance(e, DownloadError):
+                        raise
+                    raise DownloadError(str(e)) from e
+                time.sleep(min(self.backoff * 2 ** (attempt - 1), 30))
+
+    def _read_stream(self, url, response, progress, sink=None):
+        """Read a whole (non-ranged) body, restarting from scratch on failure."""
+        total = response.header("Content-Length")
+        total = int(total) if total is not None else None
+        attempt = 0
+        while True:
+            data = bytearray()
+            if sink is not None:
+                sink.seek(0)
+                sink.truncate()
+            try:
+                while True:
+                    block = response.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    if sink is None:
+                        data += block
+                    else:
+                        sink.write(block)
+                    done = len(data) if sink is None else sink.tell()
+                    if progress:
+                        progress(done, total)
+                response.release()
+                done = len(data) if sink is None else sink.tell()
+                if total is not None and done != total:
+                    raise http.client.IncompleteRead(b"", total - done)
+                return data
+            except (OSError, http.client.HTTPException) as e:
+                response.conn.close()
+                attempt += 1
+                if attempt > self.retries:
+                    raise DownloadError(f"Download of {url} failed: {e}") from e
+                time.sleep(min(self.backoff * 2 ** (attempt - 1), 30))
+                # Without Range support there is nothing to resume from
+                response = self._with_retries(lambda: self._get(url))
+
+    def _fetch_stream(self, url, dest, response, progress):
+        with open(dest + ".part", "wb") as f:
+            self._read_stream(url, response, progress, sink=f)
+
+    def _fetch_segmented(self, url, source, dest, total, validator, progress):
+        part = dest + ".part"
+        state_path = dest + ".part.json"
+        state = self._load_state(state_path, url, total, validator)
+        if state is None or not os.path.exists(part):
+            state = {"url": url, "total": total, "validator": validator,
+                     "segments": split_segments(total, self._segment_count(total))}
+            with open(part, "wb") as f:
+                f.truncate(total)
+
+        fd = os.open(part, os.O_WRONLY)
+        try:
+            self._run_segments(source, state["segments"], total, validator,
+                               lambda offset, block: os.pwrite(fd, block, offset), progress,
+                               lambda: self._save_state(state_path, state))
+        finally:
+            os.close(fd)
+        os.remove(state_path)
+
+    def _run_segments(self, url, segments, total, validator, write, progress, checkpoint=None):
+        """Fetch the unfinished ``[start, end, done]`` segments in parallel threads."""
+        lock = threading.Lock()
+        errors = []
+        stop = threading.Event()
+
+        def report():
+            if progress:
+                progress(sum(segment[2] for segment in segments), total)
+
+        def worker(segment):
+            try:
+                self._fetch_segment(url, segment, validator, write, lock, stop, report)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        threads = [threading.Thread(target=worker, args=(segment,), daemon=True)
+                   for segment in segments if segment[2] < segment[1] - segment[0] + 1]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(STATE_INTERVAL)
+                if checkpoint:
+                    with lock:
+                        checkpoint()
+        except BaseException:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            if checkpoint:
+                with lock:
+                    checkpoint()
+
+        if errors:
+            raise errors[0]
+
+    def _fetch_segment(self, url, segment, validator, write, lock, stop, report):
+        start, end, _ = segment
+        attempt = 0
+        while segment[2] < end - start + 1 and not stop.is_set():
+            offset = start + segment[2]
+            headers = {"Range": f"bytes={offset}-{end}"}
+            if validator:
+                headers["If-Range"] = validator
+            response = None
+            try:
+                response = self.request(url, headers)
+                if response.status != 206:
+                    response.discard()
+                    if response.status in RETRY_CODES:
+                        raise DownloadError(f"HTTP {response.status} for {url}", response.status)
+                    raise DownloadError(f"Server stopped honouring Range for {url} (HTTP {response.status})")
+                while not stop.is_set() and segment[2] < end - start + 1:
+                    block = response.read(min(CHUNK_SIZE, end - start + 1 - segment[2]))
+                    if not block:
+                        # A body ending early counts as a failed attempt, or this would ask again forever
+                        raise http.client.IncompleteRead(b"", end - start + 1 - segment[2])
+                    write(start + segment[2], block)
+                    with lock:
+                        segment[2] += len(block)
+                    attempt = 0
+                    report()
+                if stop.is_set():
+                    response.conn.close()
+                else:
+                    response.release()
+            except (OSError, http.client.HTTPException, DownloadError) as e:
+                if not _retryable(e):
+                    raise
+                if response is not None and not isinstance(e, DownloadError):
+                    response.conn.close()
+                attempt += 1
+                if attempt > self.retries:
+                    raise DownloadError(f"Segment {offset}-{end} of {url} failed: {e}", getattr(e, "status", None)) from e
+                time.sleep(min(self.backoff * 2 ** (attempt - 1), 30))
+
+    @staticmethod
+    def _load_state(state_path, url, total, validator):
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != url or state.get("total") != total or state.get("validator") != validator:
+            return None
+        return state
+
+    @staticmethod
+    def _save_state(state_path, state):
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+
+_default_downloader = None
+_default_lock = threading.Lock()
+
+
+def get_downloader():
+    global _default_downloader
+    with _default_lock:
+        if _default_downloader is None:
+            _default_downloader = Downloader()
+        return _default_downloader
@@ -0,0 +1,120 @@
+"""Run one operation across many prefixes in a process pool
+
+Every prefix gets its own TrackMania with an explicit ``pfx``; nothing is read from $WINEPREFIX.
+Wine processes started by the workers (``wineboot`` updates each prefix after a wine upgrade) share
+one semaphore, so no more than ``max_wine`` run at once however many workers there are.
+"""
+import glob
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+OPERATIONS = ("detect", "install", "twinkietweaks", "profile", "wineboot")
+
+
+def expand_prefixes(patterns):
+    """Prefix directories matching any of ``patterns`` (paths or globs), without duplicates.
+
+    A pattern that names no directory is kept as it is, so it shows up as a failed result.
+    """
+    prefixes = []
+    seen = set()
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        matches = [path for path in sorted(glob.glob(pattern)) if os.path.isdir(path)]
+        for path in matches or [pattern]:
+            path = os.path.abspath(path)
+            if path not in seen:
+                seen.add(path)
+                prefixes.append(path)
+    return prefixes
+
+
+def _init_worker(slots):
+    from wine import get_wine_supervisor
+    get_wine_supervisor().slots = slots
+
+
+def _run_one(pfx, operation, options):
+    from configstore import get_config_store
+    from trackmania import TrackMania
+
+    store = get_config_store()
+    before = dict(store.stats)
+    start = time.perf_counter()
+    result = {"pfx": pfx, "operation": operation, "ok": False, "error": None, "details": {}}
+    tm = None
+    try:
+        if not os.path.isdir(pfx):
+            raise FileNotFoundError(f"No prefix directory matches {pfx}")
+        tm = TrackMania(pfx=pfx)
+        if operation == "install":
+            result["details"]["timings"] = tm.install_modloader()
+        elif operation == "twinkietweaks":
+            tm.install_twinkietweaks(start=False)
+        elif operation == "profile":
+            tm.create_tmloader_profile(options["profile"], options["mods"], options.get("args"))
+        elif operation == "wineboot":
+            from tools import run_wine
+            returncode = run_wine(Path(pfx, "drive_c/windows/system32/wineboot.exe"), ["--update"], pfx=pfx,
+                                  wine=tm.wine_path)
+            result["details"]["returncode"] = returncode
+            if returncode != 0:
+                raise RuntimeError(f"wineboot exited with {returncode}")
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    if tm is not None and tm.detected.is_set():
+        result["details"].update(united=tm.united, path=tm.path, tmloader=bool(tm.tmloader_path),
+                                 uvme=bool(tm.uvme_uninstaller))
+    result["details"]["config"] = {name: value - before[name] for name, value in store.stats.items()}
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_fleet(prefixes, operation, workers=None, max_wine=2, **options):
+    """Run ``operation`` on every prefix and return one result dict per prefix, in prefix order."""
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown fleet operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+    if operation == "profile" and not options.get("profile"):
+        raise ValueError("The profile operation needs a profile name")
+    start = time.perf_counter()
+    results = {}
+    workers = min(workers or os.cpu_count() or 1, max(1, len(prefixes)))
+    slots = multiprocessing.BoundedSemaphore(max_wine)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(slots,)) as pool:
+        futures = {pool.submit(_run_one, pfx, operation, options): pfx for pfx in prefixes}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["pfx"]] = result
+            print(f"[{len(results)}/{len(prefixes)}] {result['pfx']}: "
+                  f"{'ok' if result['ok'] else result['error']} ({result['seconds']:.2f}s)")
+    return {"operation": operation, "workers": workers, "max_wine": max_wine,
+            "seconds": time.perf_counter() - start, "results": [results[pfx] for pfx in prefixes]}
+
+
+def format_report(report):
+    results = report["results"]
+    failed = [result for result in results if not result["ok"]]
+    seconds = [result["seconds"] for result in results]
+    lines = [f"{'prefix':50} {'status':8} {'game':8} {'tmloader':8} {'seconds':>8}"]
+    for result in results:
+        details = result["details"]
+        game = "" if "united" not in details else "united" if details["united"] else "nations"
+        lines.append(f"{result['pfx']:50} {'ok' if result['ok'] else 'FAILED':8} {game:8} "
+                     f"{'yes' if details.get('tmloader') else 'no':8} {result['seconds']:8.2f}")
+        if result["error"]:
+            lines.append(f"    {result['error']}")
+    if seconds:
+        lines.append(f"{report['operation']}: {len(results) - len(failed)} ok, {len(failed)} failed "
+                     f"in {report['seconds']:.2f}s wall ({sum(seconds):.2f}s total, max {max(seconds):.2f}s "
+                     f"per prefix, {report['workers']} workers, {report['max_wine']} wine at a time)")
+    return "\n".join(lines)
+
+
+def save_report(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
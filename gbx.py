@@ -0,0 +1,229 @@
+"""Reader for the header chunks of TrackMania .Gbx files"""
+import mmap
+import re
+import struct
+
+CHALLENGE_CLASSES = (0x03043000, 0x24003000)
+REPLAY_CLASSES = (0x03093000, 0x2403F000)
+
+# Collection ids that lookback strings may use instead of a name
+COLLECTIONS = {0: "Desert", 1: "Snow", 2: "Rally", 3: "Island", 4: "Bay", 5: "Coast", 6: "StadMM",
+               7: "Stadium", 11: "Valley", 12: "Canyon", 13: "Lagoon", 25: "Stadium256", 26: "Stadium"}
+
+_u16 = struct.Struct("<H")
+_u32 = struct.Struct("<I")
+_xml_attribute = re.compile(r'(\w+)="([^"]*)"')
+
+
+class GbxError(Exception):
+    pass
+
+
+class _Reader:
+    """Little-endian reader over a memoryview; the lookback string table is per chunk."""
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+        self.lookback = None
+
+    def u8(self):
+        if self.pos >= len(self.view):
+            raise GbxError("Unexpected end of chunk")
+        self.pos += 1
+        return self.view[self.pos - 1]
+
+    def u32(self):
+        if self.pos + 4 > len(self.view):
+            raise GbxError("Unexpected end of chunk")
+        value = _u32.unpack_from(self.view, self.pos)[0]
+        self.pos += 4
+        return value
+
+    def string(self):
+        length = self.u32()
+        if self.pos + length > len(self.view):
+            raise GbxError("String runs past the end of the chunk")
+        value = bytes(self.view[self.pos:self.pos + length]).decode("utf-8", errors="replace")
+        self.pos += length
+        return value
+
+    def lookback_string(self):
+        if self.lookback is None:
+            self.u32()
+            self.lookback = []
+        index = self.u32()
+        if index == 0xFFFFFFFF:
+            return ""
+        if index & 0xC0000000 == 0:
+            return COLLECTIONS.get(index, str(index))
+        if index & 0x3FFFFFFF == 0:
+            value = self.string()
+            self.lookback.append(value)
+            return value
+        try:
+            return self.lookback[(index & 0x3FFFFFFF) - 1]
+        except IndexError:
+            raise GbxError("Invalid lookback string index") from None
+
+
+def header_chunks(buffer):
+    """Return ``(class_id, {chunk_id & 0xFFF: memoryview})`` for the user data chunks of a Gbx file.
+
+    Nothing is copied: the chunk views point into ``buffer``, and the (possibly compressed) body is never touched.
+    """
+    view = memoryview(buffer)
+    if len(view) < 9 or view[:3] != b"GBX":
+        raise GbxError("Not a Gbx file")
+    version = _u16.unpack_from(view, 3)[0]
+    if version < 6:
+        raise GbxError(f"Unsupported Gbx version {version}")
+    pos = 5 + 4  # format byte, ref table compression, body compression, unknown byte
+    if len(view) < pos + 12:
+        raise GbxError("Truncated Gbx header")
+    class_id, user_data_size = struct.unpack_from("<II", view, pos)
+    pos += 8
+    chunks = {}
+    if user_data_size == 0:
+        return class_id, chunks
+
+    count = _u32.unpack_from(view, pos)[0]
+    pos += 4
+    data_pos = pos + count * 8
+    if data_pos > len(view) or pos + user_data_size > len(view):
+        raise GbxError("Truncated Gbx header")
+    for _ in range(count):
+        chunk_id, size = struct.unpack_from("<II", view, pos)
+        pos += 8
+        size &= 0x7FFFFFFF  # high bit marks "heavy" chunks
+        if data_pos + size > len(view):
+            raise GbxError("Header chunk runs past the end of the file")
+        chunks[chunk_id & 0xFFF] = view[data_pos:data_pos + size]
+        data_pos += size
+    return class_id, chunks
+
+
+def _parse_xml(chunk):
+    xml = _Reader(chunk).string()
+    attributes = {}
+    for tag in re.finditer(r"<(\w+)([^>]*)>", xml):
+        for name, value in _xml_attribute.findall(tag.group(2)):
+            attributes.setdefault(tag.group(1) + "." + name, value)
+    return attributes
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_challenge(chunks):
+    info = {"kind": "challenge", "uid": None, "name": None, "author": None, "environment": None,
+            "bronze_time": None, "silver_time": None, "gold_time": None, "author_time": None}
+
+    if 0x003 in chunks:
+        r = _Reader(chunks[0x003])
+        r.u8()
+        info["uid"] = r.lookback_string()
+        info["environment"] = r.lookback_string()
+        info["author"] = r.lookback_string()
+        info["name"] = r.string()
+
+    if 0x002 in chunks:
+        r = _Reader(chunks[0x002])
+        version = r.u8()
+        if version < 3:
+            info["uid"] = r.lookback_string()
+            info["environment"] = r.lookback_string()
+            info["author"] = r.lookback_string()
+            info["name"] = r.string()
+        r.u32()
+        if version >= 1:
+            info["bronze_time"] = r.u32()
+            info["silver_time"] = r.u32()
+            info["gold_time"] = r.u32()
+            info["author_time"] = r.u32()
+
+    if info["uid"] is None and 0x005 in chunks:
+        xml = _parse_xml(chunks[0x005])
+        info["uid"] = xml.get("ident.uid")
+        info["name"] = xml.get("ident.name")
+        info["author"] = xml.get("ident.author")
+        info["environment"] = xml.get("desc.envir")
+        info["bronze_time"] = _int_or_none(xml.get("times.bronze"))
+        info["silver_time"] = _int_or_none(xml.get("times.silver"))
+        info["gold_time"] = _int_or_none(xml.get("times.gold"))
+        info["author_time"] = _int_or_none(xml.get("times.authortime"))
+    return info
+
+
+def parse_replay(chunks):
+    info = {"kind": "replay", "uid": None, "name": None, "author": None, "environment": None,
+            "player": None, "race_time": None, "checkpoints": None}
+
+    if 0x000 in chunks:
+        r = _Reader(chunks[0x000])
+        version = r.u32()
+        if version >= 2:
+            info["uid"] = r.lookback_string()
+            info["environment"] = r.lookback_string()
+            info["author"] = r.lookback_string()
+            info["race_time"] = r.u32()
+            info["player"] = r.string()
+
+    if 0x001 in chunks:
+        xml = _parse_xml(chunks[0x001])
+        info["uid"] = info["uid"] or xml.get("map.uid")
+        info["name"] = xml.get("map.name")
+        info["author"] = info["author"] or xml.get("map.author")
+        info["environment"] = info["environment"] or xml.get("desc.envir")
+        if info["race_time"] is None:
+            info["race_time"] = _int_or_none(xml.get("times.best"))
+        info["checkpoints"] = _int_or_none(xml.get("checkpoints.cur"))
+    if info["race_time"] == 0xFFFFFFFF:
+        info["race_time"] = None
+    return info
+
+
+def parse_header(buffer):
+    """Metadata from the header of an in-memory Gbx file."""
+    class_id, chunks = header_chunks(buffer)
+    try:
+        if class_id in CHALLENGE_CLASSES:
+            info = parse_challenge(chunks)
+        elif class_id in REPLAY_CLASSES:
+            info = parse_replay(chunks)
+        else:
+            info = {"kind": None}
+        info["class_id"] = class_id
+        return info
+    finally:
+        for chunk in chunks.values():
+            chunk.release()
+
+
+def read_header(path):
+    """Metadata from the header of a Gbx file on disk, mapped rather than read."""
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise GbxError("Empty file") from None
+    view = memoryview(mapped)
+    try:
+        return parse_header(view)
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            # A traceback still holds a chunk view; the mapping goes away with it
+            pass
+
+
+def try_read_header(path):
+    try:
+        return read_header(path)
+    except (OSError, GbxError):
+        return None
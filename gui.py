@@ -1,265 +1,13 @@
-import threading
-import flet as ft
 import argparse
 
-from dotenv import load_dotenv
-
 from trackmania import TrackMania
-import configparser
-
-
-load_dotenv()
-
-class EnvironmentDropDown(ft.Dropdown):
-    def __init__(self, environments=None):
-        super().__init__()
-        if environments is None:
-            environments = ["CarCommon", "StadiumCar", "DesertCar", "RallyCar", "BayCar", "CoastCar", "IslandCar",
-                            "SnowCar"]
-        for env in environments:
-            self.options.append(ft.DropdownOption(key=env, content=ft.Text(value=env)))
-        self.value = "CarCommon"
-        self.label = "Environment"
-
-class DownloadModal(ft.AlertDialog):
-    def __init__(self, page: ft.Page, title: str):
-        super().__init__()
-        self.page = page
-        self.column = ft.Column(controls=[ft.Text(title)])
-        self.dropdown = None
-        self.content = self.column
-
-        self.actions= [ft.ElevatedButton("Download", icon=ft.Icons.SAVE, on_click=lambda e: self.save())]
-
-    def save(self):
-        self.open = False
-        self.page.update()
-
-class DownloadTrack(DownloadModal):
-    def __init__(self, page: ft.Page):
-        super().__init__(page, "Paste the ID from either TrackMania Nations Exchange or TrackMania United Exchange")
-        self.title = "Download Track"
-        self.url = ft.TextField(label="TrackMania Exchange ID")
-        self.dropdown = ft.Dropdown(value="Nations", options=[ft.DropdownOption(key="Nations", content=ft.Text(value="TrackMania Nations Forever Exchange")), ft.DropdownOption(key="United", content=ft.Text(value="TrackMania United Forever Exchange"))])
-        self.column.controls.append(self.dropdown)
-        self.column.controls.append(self.url)
-
-    def save(self):
-        united = False
-        if self.dropdown.value == "United":
-            united = True
-        tm.download_track(self.url.value, united)
-        super().save()
-
-class ManiaParkDownload(DownloadModal):
-    def __init__(self, page: ft.Page, title: str, description: str = "Use a direct link to the file. Click the copy link button on ManiaPark as example"):
-        super().__init__(page, description)
-        self.title = title
-        self.url = ft.TextField(label="Direct Link")
-        self.create_locator = ft.Checkbox(label="Create Locator (So others can see your Skin/Mod)", value=True)
-        self.dropdown = None
-
-        if tm.united:
-            self.dropdown = self.get_dropdown()
-            self.column.controls.append(self.dropdown)
-        self.column.controls.append(self.url)
-        self.column.controls.append(self.create_locator)
-
-    def save(self):
-        super().save()
-
-    def get_dropdown(self):
-        return EnvironmentDropDown()
-
-    def get_environment(self):
-        if self.dropdown is None:
-            return "StadiumCar"
-        return self.dropdown.value
-
-class TextureModDownload(ManiaParkDownload):
-    def save(self):
-        tm.download_texture_mod(self.url.value, self.get_environment())
-        super().save()
-
-    def get_environment(self):
-        if self.dropdown is None:
-            return "Stadium"
-        return self.dropdown.value
-
-    def get_dropdown(self):
-        return EnvironmentDropDown(["Stadium", "Alpine", "Bay", "Island", "Rally", "Speed", "Coast"])
-
-class SkinDownload(ManiaParkDownload):
-    def save(self):
-        tm.download_car_skin(self.url.value, self.get_environment())
-        super().save()
-
-
-def log(line: str, log_view: ft.Text):
-    log_view.value += ("" if log_view.value.endswith("\n") or log_view.value == "" else "\n") + line
-    if len(log_view.value) > 10_000:
-        log_view.value = log_view.value[-10_000:]  # truncate
-    log_view.update()
-
-
-def main(page: ft.Page):
-    config = configparser.ConfigParser()
-    page.title = "TrackMania Toolkit"
-    page.theme_mode = "dark"
-    page.padding = 16
-    page.horizontal_alignment = "stretch"
-
-    options = tm.get_profiles()
-
-
-    config_profile = config.read("config.ini")
-    if config_profile:
-        launch_profile = config["general"]["profile"]
-        print(launch_profile)
-    else:
-        launch_profile = "default"
-
-    selected_label = ft.Text(f"Selected: " + launch_profile, weight=ft.FontWeight.W_600)
-
-    def on_radio_change(e: ft.ControlEvent):
-        selected_label.value = f"Selected: {radio_group.value}"
-        nonlocal launch_profile
-        launch_profile = radio_group.value
-
-        config["general"] = {"profile": radio_group.value}
-
-        with open("config.ini", "w") as f:
-            config.write(f)
-
-        page.update()
-
-
-    radio_column = ft.Column([], tight=True, spacing=6)
-
-    for key in options:
-        description = options[key].get("description")
-        if not description:
-            description = "TMLoader Profile: " + key.split(".")[0]
-        radio_column.controls.append(ft.Radio(value=key.split(".")[0], label=description, data=options[key]))
-
-    radio_group = ft.RadioGroup(
-        value=launch_profile,
-        content=radio_column,
-        on_change=on_radio_change,
-    )
-
-
-    def launch():
-        page.window.destroy()
-        tm.start_tmloader_profile(launch_profile)
-    left_panel = ft.Container(
-        ft.Column([ft.Text("Select one", weight=ft.FontWeight.BOLD), radio_group, selected_label, ft.ElevatedButton("Start", icon=ft.Icons.START, on_click=lambda e: launch())], spacing=10),
-        padding=12, border_radius=12, bgcolor=ft.Colors.SURFACE, expand=True
-    )
-
-    log_view = ft.Text("", selectable=True, size=12)
-    log_card = ft.Container(
-        ft.Column([ft.Text("Log", weight=ft.FontWeight.BOLD), log_view], spacing=8),
-        padding=12, border_radius=12, bgcolor=ft.Colors.SURFACE, expand=True
-    )
-
-    uvme = ft.ElevatedButton("Install UVME", icon=ft.Icons.DOWNLOAD,
-                             on_click=lambda e: tm.download_uvme())
-    if tm.uvme_uninstaller:
-        uvme = ft.ElevatedButton("Uninstall UVME", icon=ft.Icons.REMOVE,
-                          on_click=lambda e: tm.uninstall_uvme())
-
-
-    actions_col = ft.Column(
-        controls=[
-            uvme,
-            ft.ElevatedButton("Start Vanilla Game", icon=ft.Icons.BUILD, on_click=lambda e: tm.start_vanilla()),
-            ft.ElevatedButton("Start Launcher", icon=ft.Icons.REFRESH, on_click=lambda e: tm.start_launcher()),
-            ft.ElevatedButton("Install TwinkieTweaks", icon=ft.Icons.REFRESH, on_click=lambda e: tm.install_twinkietweaks()),
-            ft.ElevatedButton("Download Skin", icon=ft.Icons.DOWNLOAD, on_click=lambda e: page.open(SkinDownload(page, "Download Car Skin"))),
-            ft.ElevatedButton("Download Texture Mod", icon=ft.Icons.DOWNLOAD, on_click=lambda e: page.open(TextureModDownload(page, "Download Texture Mod"))),
-            ft.ElevatedButton("Download Track", icon=ft.Icons.DOWNLOAD, on_click=lambda e: page.open(DownloadTrack(page))),
-        ],
-        spacing=10,
-        horizontal_alignment=ft.CrossAxisAlignment.STRETCH,
-        alignment=ft.MainAxisAlignment.START,
-    )
-
-    if tm.tmloader_path:
-        actions_col.controls.append(ft.ElevatedButton("Start TMLoader", icon=ft.Icons.LAUNCH, on_click=lambda e: tm.start_tmloader()))
-
-    right_panel = ft.Container(
-        ft.Column([ft.Text("Actions", weight=ft.FontWeight.BOLD), actions_col], spacing=10),
-        padding=12, border_radius=12, bgcolor=ft.Colors.SURFACE, expand=True
-    )
-
-    main_row = ft.Row([left_panel, right_panel, log_card], spacing=16, alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
-
-    # --- Countdown
-    remaining_text = ft.Text("5 s", weight=ft.FontWeight.W_600)
-    progress = ft.ProgressBar(value=0)
-    pause_btn = ft.OutlinedButton("Pause", icon=ft.Icons.PAUSE, disabled=True)
-
-    state = {"running": False, "remaining": 5, "total": 5}
-
-    def _update_ui():
-        total = max(state["total"], 1)
-        progress.value = 1 - (state["remaining"] / total)
-        remaining_text.value = f"{state['remaining']} s" if not state["running"] else f"{state['remaining']} s remaining"
-        pause_btn.disabled = not state["running"]
-
-        page.update()
-        if state["remaining"] <= 0:
-            page.window.destroy()
-            tm.start_tmloader_profile(launch_profile)
-
-    def start_clicked(e):
-        if state["remaining"] <= 0:
-            return
-        state["running"] = True
-        _update_ui()
-
-        def tick():
-            while state["running"] and state["remaining"] > 0:
-                import time
-                time.sleep(1)
-                state["remaining"] = max(0, state["remaining"] - 1)
-                _update_ui()
-            if state["remaining"] <= 0:
-                state["running"] = False
-                _update_ui()
-                log("Countdown finished.", log_view)
-
-        threading.Thread(target=tick, daemon=True).start()
 
-    def pause_clicked(e):
-        state["running"] = False
-        _update_ui()
 
-    start_clicked("")
-    pause_btn.on_click = pause_clicked
-
-    bottom_bar = ft.Container(
-        content=ft.Column(
-            [
-                ft.Row([ft.Container(expand=True), remaining_text]),
-                progress,
-                ft.Row([pause_btn],
-                       alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
-            ],
-            spacing=10,
-        ),
-        padding=12,
-        border=ft.border.all(1, ft.Colors.OUTLINE_VARIANT),
-        border_radius=12,
-        bgcolor=ft.Colors.SURFACE,
-    )
-
-    page.add(ft.Column([main_row, bottom_bar, ft.Container(expand=True), ft.Text("Made with ❤️ by AroPix")], spacing=16, expand=True))
-    _update_ui()
+if __name__ == "__main__":
+    from dotenv import load_dotenv
 
+    load_dotenv()
 
-if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="TrackMania helper")
     parser.add_argument(
         "--install",
@@ -271,23 +19,214 @@ if __name__ == "__main__":
         action="store_true",
         help="Test things",
     )
+    parser.add_argument(
+        "--tracks",
+        metavar="FILE",
+        help="Download every TMX track ID listed in FILE (one per line, optionally prefixed with nations: or united:) and exit",
+    )
+    parser.add_argument(
+        "--united",
+        action="store_true",
+        help="Treat unprefixed track IDs as TrackMania United Forever Exchange IDs",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        metavar="KIB_PER_S",
+        type=int,
+        help="Cap the total track download bandwidth",
+    )
+    parser.add_argument(
+        "--library-update",
+        action="store_true",
+        help="Update the index of local tracks and replays and exit",
+    )
+    parser.add_argument("--find-uid", metavar="UID", help="Find local tracks/replays by map UID")
+    parser.add_argument("--find-author", metavar="NAME", help="Find local tracks/replays by author or player")
+    parser.add_argument("--find-name", metavar="NAME", help="Find local tracks/replays by map name")
+    parser.add_argument(
+        "--tmx-info",
+        nargs="+",
+        metavar="ID",
+        help="Print the name, author, environment and author time of TMX tracks (IDs as in --tracks) and exit",
+    )
+    parser.add_argument(
+        "--tmx-prefetch",
+        metavar="FILE",
+        help="Fetch the TMX metadata of every track listed in FILE into the local catalog and exit",
+    )
+    parser.add_argument("--tmx-search", metavar="TEXT", help="Search the local TMX catalog by track name or author")
+    parser.add_argument("--tmx-environment", metavar="ENV", help="Only list tracks of this environment with --tmx-search")
+    parser.add_argument("--offline", action="store_true", help="Only use the local TMX catalog, never the exchange")
+    parser.add_argument(
+        "--replay-stats",
+        action="store_true",
+        help="Print the best time and median of every map you have replays for and exit",
+    )
     parser.add_argument(
         "--openplanet",
         action="store_true",
         help="Start with TMUF OpenPlanet",
     )
+    parser.add_argument(
+        "--snapshot",
+        nargs=2,
+        metavar=("PREFIX", "TEMPLATE"),
+        help="Save a fully provisioned prefix as a template for --clone and exit",
+    )
+    parser.add_argument(
+        "--clone",
+        nargs=2,
+        metavar=("TEMPLATE", "PREFIX"),
+        help="Provision a new prefix from a template (reflinks or copies instead of installing) and exit",
+    )
+    parser.add_argument("--clone-user", metavar="NAME", help="User of the cloned prefix (default: $USER)")
+    parser.add_argument(
+        "--clone-hardlink",
+        metavar="SUFFIXES",
+        default="",
+        help="Comma separated suffixes of game files that are never modified (e.g. .bik,.ogg), hardlinked by "
+             "--snapshot and --clone instead of copied",
+    )
+    parser.add_argument(
+        "--fleet",
+        nargs="+",
+        metavar="PREFIX",
+        help="Run --fleet-op on every prefix given (paths or quoted globs) in parallel and exit",
+    )
+    parser.add_argument("--fleet-op", choices=["detect", "install", "twinkietweaks", "profile", "wineboot"],
+                        default="detect")
+    parser.add_argument("--workers", type=int, help="Number of prefixes handled at once (default: CPU count)")
+    parser.add_argument("--max-wine", type=int, default=2, help="Maximum number of wine processes at once (--fleet-op wineboot)")
+    parser.add_argument("--profile-name", metavar="NAME", help="Profile written by --fleet-op profile")
+    parser.add_argument("--profile-mods", metavar="MODS", default="", help="Comma separated mod IDs for the profile")
+    parser.add_argument("--report", metavar="FILE", help="Also write the fleet report as JSON")
+    parser.add_argument(
+        "--verify-skins",
+        action="store_true",
+        help="Check every skin and texture mod archive for corruption and conflicting mods and exit",
+    )
+    parser.add_argument(
+        "--mods-gc",
+        action="store_true",
+        help="Delete skins and mods from the shared store that are no longer placed in any prefix and exit",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="With --mods-gc, only report what would be deleted")
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        help="Start the wineserver while the window is open so the game launches faster (or TM_WINE_PREWARM=1)",
+    )
+    parser.add_argument(
+        "--measure-launch",
+        action="store_true",
+        help="Print the time from clicking Start to the game process starting (or TM_MEASURE_LAUNCH=1)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and take commands from client.py over a Unix socket, with every prefix kept warm",
+    )
+    parser.add_argument("--socket", metavar="PATH", help="Socket of --daemon (default: $XDG_RUNTIME_DIR/trackmania-assets.sock)")
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Record timing spans and write them as a Chrome trace to FILE at exit, with a summary (or TM_TRACE=FILE)",
+    )
+    parser.add_argument(
+        "--startup-probe",
+        action="store_true",
+        help=argparse.SUPPRESS,  # used by benchmarks/startup.py
+    )
     args = parser.parse_args()
 
-    if args.install:
+    if args.trace:
+        import tracing
+        tracing.enable(args.trace)
+
+    if args.daemon:
+        from daemon import Daemon
+        Daemon(args.socket).serve()
+    elif args.install:
         tm = TrackMania(pfx=args.install)
         tm.install_modloader()
+    elif args.fleet:
+        from fleet import expand_prefixes, format_report, run_fleet, save_report
+        prefixes = expand_prefixes(args.fleet)
+        report = run_fleet(prefixes, args.fleet_op, workers=args.workers, max_wine=args.max_wine,
+                           profile=args.profile_name,
+                           mods=[mod.strip() for mod in args.profile_mods.split(",") if mod.strip()])
+        print(format_report(report))
+        if args.report:
+            save_report(report, args.report)
+        raise SystemExit(0 if all(result["ok"] for result in report["results"]) else 1)
+    elif args.verify_skins:
+        from skins import format_report
+        report = TrackMania().verify_skins()
+        print(format_report(report))
+        raise SystemExit(1 if report["broken"] else 0)
+    elif args.mods_gc:
+        from modstore import get_mod_store
+        stats = get_mod_store().gc(dry_run=args.dry_run)
+        print(f"{stats['removed']} of {stats['blobs']} stored skins/mods {'would be ' if args.dry_run else ''}removed, "
+              f"{stats['bytes_freed'] / 1048576:.1f} MiB freed, {stats['placements_pruned']} stale placements")
+    elif args.snapshot:
+        from templates import snapshot
+        snapshot(*args.snapshot, hardlink_suffixes=[suffix for suffix in args.clone_hardlink.split(",") if suffix])
+    elif args.clone:
+        from templates import clone
+        clone(*args.clone, user=args.clone_user,
+              hardlink_suffixes=[suffix for suffix in args.clone_hardlink.split(",") if suffix])
+    elif args.tracks:
+        tm = TrackMania()
+        from tracks import parse_track_list
+        with open(args.tracks, "r", encoding="utf-8") as f:
+            track_list = parse_track_list(f, args.united)
+        summary = tm.download_tracks(track_list, bandwidth=args.bandwidth * 1024 if args.bandwidth else None)
+        raise SystemExit(1 if summary["failed"] else 0)
+    elif args.library_update or args.find_uid or args.find_author or args.find_name:
+        tm = TrackMania()
+        library = tm.library()
+        if args.library_update:
+            print(library.update())
+        if args.find_uid or args.find_author or args.find_name:
+            for row in library.find(uid=args.find_uid, author=args.find_author, name=args.find_name):
+                print(f"{row['kind'] or '?':9} {row['uid'] or '':28} {row['name'] or '':30} {row['author'] or '':20} {row['path']}")
+    elif args.tmx_info or args.tmx_prefetch or args.tmx_search or args.tmx_environment:
+        from tmx import TrackCatalog, format_track
+        from tracks import parse_track_list
+        catalog = TrackCatalog()
+        if args.tmx_prefetch:
+            with open(args.tmx_prefetch, "r", encoding="utf-8") as f:
+                print(catalog.prefetch(parse_track_list(f, args.united)))
+        if args.tmx_info:
+            track_list = parse_track_list(args.tmx_info, args.united)
+            for united in (False, True):
+                track_ids = [track_id for track_id, is_united in track_list if is_united == united]
+                if not track_ids:
+                    continue
+                for track_id, track in catalog.lookup(track_ids, united, offline=args.offline).items():
+                    print(format_track(track) if track else f"{'united' if united else 'nations'}:{track_id} not found")
+        if args.tmx_search or args.tmx_environment:
+            for track in catalog.search(args.tmx_search, environment=args.tmx_environment):
+                print(format_track(track))
+    elif args.replay_stats:
+        tm = TrackMania()
+        table = tm.analyse_replays()
+        best_times = table.best_times()
+        for uid in sorted(best_times):
+            best, player, path = best_times[uid]
+            print(f"{uid:28} best {best / 1000:9.3f}s by {player:20} median {table.percentile(uid, 50) / 1000:9.3f}s")
+        print(f"{len(table)} replays of {len(best_times)} maps")
     elif args.script:
         print("!!!!")
+    elif args.startup_probe:
+        # The imports and set-up the window needs, without building or opening it (import + init time)
+        import views
+        tm = TrackMania(detect=False)
+    elif args.openplanet:
+        tm = TrackMania(measure_launch=args.measure_launch or None)
+        if tm.united:
+            tm.launch_openplanet()
     else:
-        tm = TrackMania()
-
-        if args.openplanet:
-            if tm.united:
-                tm.launch_openplanet()
-        else:
-            ft.app(target=main)
+        import views
+        views.run(TrackMania(detect=False, prewarm=args.prewarm or None, measure_launch=args.measure_launch or None))
@@ -0,0 +1,234 @@
+"""Background jobs: a bounded thread pool with progress reporting and cancellation
+
+The GUI submits every long-running action here so its click handlers return immediately.
+A job's function gets the Job as its only argument and reports through ``job.progress(done, total)``,
+which is also the point where a cancelled job stops (by raising JobCancelled).
+"""
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, scheduler, job_id, name, function):
+        self.scheduler = scheduler
+        self.id = job_id
+        self.name = name
+        self.function = function
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.done = 0
+        self.total = None
+        self.unit = "bytes"
+        self.message = ""
+        self.started = None
+        self.finished = None
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._last_notify = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def finished_running(self):
+        """True once the job is done, failed or cancelled and ``wait`` returns right away."""
+        return self._finished.is_set()
+
+    @property
+    def fraction(self):
+        """0-1, or None while the total is unknown (an indeterminate progress bar)."""
+        if self.state == DONE:
+            return 1.0
+        if not self.total:
+            return None
+        return min(1.0, self.done / self.total)
+
+    @property
+    def percent(self):
+        fraction = self.fraction
+        return None if fraction is None else fraction * 100
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def eta(self):
+        """Seconds left, extrapolated from the average rate so far."""
+        fraction = self.fraction
+        if not fraction or self.state != RUNNING:
+            return None
+        return self.elapsed * (1 - fraction) / fraction
+
+    def progress(self, done, total=None, message=None):
+        """Progress callback, compatible with the downloader's ``progress(done, total)``."""
+        if self.cancelled:
+            raise JobCancelled(self.name)
+        self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        self._notify(force=message is not None)
+
+    def step(self, message):
+        """Report a stage of a job that has no byte counts, e.g. "Running installer"."""
+        self.progress(0, 0, message)
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def cancel(self):
+        """Ask the job to stop; a queued job never starts, a running one stops at its next progress report."""
+        self._cancelled.set()
+        self._notify(force=True)
+
+    def wait(self, timeout=None):
+        if not self._finished.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def status(self):
+        if self.state == RUNNING:
+            parts = [self.message] if self.message else []
+            if self.unit != "bytes":
+                if self.total:
+                    parts.append(f"{self.done}/{self.total} {self.unit}")
+            elif self.total:
+                parts.append(f"{format_bytes(self.done)} / {format_bytes(self.total)} ({self.percent:.0f}%)")
+            elif self.done:
+                parts.append(format_bytes(self.done))
+            eta = self.eta
+            if eta is not None:
+                parts.append(f"{eta:.0f}s left")
+            return ", ".join(parts) or "Running"
+        if self.state == FAILED:
+            return f"Failed: {self.error}"
+        if self.state == DONE:
+            return f"Done in {self.elapsed:.1f}s"
+        return self.state.capitalize()
+
+    def _run(self):
+        if self.cancelled:
+            self._finish(CANCELLED)
+            return
+        self.state = RUNNING
+        self.started = time.monotonic()
+        self._notify(force=True)
+        try:
+            self.result = self.function(self)
+        except JobCancelled:
+            self._finish(CANCELLED)
+        except Exception as e:
+            self.error = e
+            self._finish(FAILED)
+        else:
+            self._finish(DONE)
+
+    def _finish(self, state):
+        self.state = state
+        self.finished = time.monotonic()
+        self.scheduler._release(self)
+        self._finished.set()
+        self._notify(force=True)
+
+    def _notify(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_notify < self.scheduler.notify_interval:
+            return
+        self._last_notify = now
+        self.scheduler._notify(self)
+
+
+class JobScheduler:
+    """Runs jobs on ``workers`` threads with at most ``max_pending`` jobs queued or running.
+
+    ``on_update(job)`` is called from the worker threads whenever a job changes state and at most
+    every ``notify_interval`` seconds while it reports progress.
+    """
+    def __init__(self, workers=4, max_pending=32, on_update=None, notify_interval=0.1):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.on_update = on_update
+        self.notify_interval = notify_interval
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, name, function):
+        """Queue ``function(job)`` and return its Job without waiting; raises JobQueueFullError when full."""
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFullError(f"{self.max_pending} jobs are already pending")
+        job = Job(self, next(self._ids), name, function)
+        with self._lock:
+            self.jobs[job.id] = job
+        self._notify(job)
+        self._pool.submit(job._run)
+        return job
+
+    def active(self):
+        with self._lock:
+            return [job for job in self.jobs.values() if job.state in (QUEUED, RUNNING)]
+
+    def all(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def prune(self, keep=0):
+        """Forget finished jobs but the ``keep`` most recent ones."""
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished_running]
+            for job_id in finished[:len(finished) - keep]:
+                del self.jobs[job_id]
+
+    def cancel_all(self):
+        for job in self.active():
+            job.cancel()
+
+    def shutdown(self, wait=True, cancel=True):
+        if cancel:
+            self.cancel_all()
+        self._pool.shutdown(wait=wait)
+
+    def _release(self, job):
+        self._slots.release()
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                print(f"Job update handler failed: {e!r}")
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
@@ -0,0 +1,193 @@
+"""SQLite index of the local track and replay library"""
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import time
+
+from cache import get_cache_dir
+from gbx import try_read_header
+
+SCAN_ROOTS = ("Tracks", "Replays")
+POOL_THRESHOLD = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    kind TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    uid TEXT,
+    name TEXT,
+    author TEXT,
+    environment TEXT,
+    player TEXT,
+    race_time INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_uid ON files (uid);
+CREATE INDEX IF NOT EXISTS files_author ON files (author COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_name ON files (name COLLATE NOCASE);
+"""
+
+COLUMNS = ("path", "dir", "kind", "size", "mtime_ns", "uid", "name", "author", "environment", "player", "race_time")
+
+
+def default_db_path(documents_folder):
+    key = hashlib.sha1(os.path.abspath(documents_folder).encode()).hexdigest()[:16]
+    return os.path.join(get_cache_dir("library"), key + ".sqlite3")
+
+
+def _read_entry(job):
+    """Worker: stat and parse one file, returning a row for the files table."""
+    root, relative = job
+    path = os.path.join(root, relative)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    header = try_read_header(path) or {}
+    kind = header.get("kind")
+    if kind is None:
+        lowered = relative.lower()
+        kind = "challenge" if lowered.endswith(".challenge.gbx") else "replay" if lowered.endswith(".replay.gbx") else None
+    return (relative, os.path.dirname(relative), kind, stat.st_size, stat.st_mtime_ns, header.get("uid"),
+            header.get("name"), header.get("author"), header.get("environment"), header.get("player"),
+            header.get("race_time"))
+
+
+class Library:
+    """Index of every .Gbx file under the Tracks/ and Replays/ folders of a TmForever documents folder.
+
+    ``update`` only lists directories whose mtime changed and only parses files whose size or mtime changed.
+    """
+    def __init__(self, documents_folder, db_path=None):
+        self.documents_folder = os.path.abspath(documents_folder)
+        self.db_path = db_path or default_db_path(self.documents_folder)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, processes=None):
+        start = time.perf_counter()
+        stats = {"dirs_listed": 0, "dirs_unchanged": 0, "files_parsed": 0, "files_removed": 0}
+        changed = []
+        pending = [root for root in SCAN_ROOTS if os.path.isdir(os.path.join(self.documents_folder, root))]
+        seen_roots = set(pending)
+
+        with self.db:
+            for root in SCAN_ROOTS:
+                if root not in seen_roots:
+                    stats["files_removed"] += self._forget_dir(root)
+
+            while pending:
+                relative_dir = pending.pop()
+                full_dir = os.path.join(self.documents_folder, relative_dir)
+                try:
+                    mtime_ns = os.stat(full_dir).st_mtime_ns
+                except OSError:
+                    stats["files_removed"] += self._forget_dir(relative_dir)
+                    continue
+                row = self.db.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (relative_dir,)).fetchone()
+                known = {r["path"]: (r["size"], r["mtime_ns"]) for r in
+                         self.db.execute("SELECT path, size, mtime_ns FROM files WHERE dir = ?", (relative_dir,))}
+
+                if row is not None and row["mtime_ns"] == mtime_ns:
+                    # Nothing was added or removed here, only files edited in place can have changed
+                    stats["dirs_unchanged"] += 1
+                    pending.extend(r["path"] for r in
+                                   self.db.execute("SELECT path FROM dirs WHERE parent = ?", (relative_dir,)))
+                    for path, (size, file_mtime) in known.items():
+                        try:
+                            stat = os.stat(os.path.join(self.documents_folder, path))
+                        except OSError:
+                            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+                            stats["files_removed"] += 1
+                            continue
+                        if stat.st_size != size or stat.st_mtime_ns != file_mtime:
+                            changed.append(path)
+                    continue
+
+                stats["dirs_listed"] += 1
+                present = set()
+                subdirs = set()
+                with os.scandir(full_dir) as entries:
+                    for entry in entries:
+                        relative = os.path.join(relative_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.add(relative)
+                        elif entry.name.lower().endswith(".gbx"):
+                            present.add(relative)
+                            stat = entry.stat()
+                            if known.get(relative) != (stat.st_size, stat.st_mtime_ns):
+                                changed.append(relative)
+                for path in known.keys() - present:
+                    self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+                    stats["files_removed"] += 1
+                for (old_dir,) in self.db.execute("SELECT path FROM dirs WHERE parent = ?", (relative_dir,)).fetchall():
+                    if old_dir not in subdirs:
+                        stats["files_removed"] += self._forget_dir(old_dir)
+                self.db.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                                (relative_dir, os.path.dirname(relative_dir), mtime_ns))
+                pending.extend(subdirs)
+
+            rows = self._parse(changed, processes)
+            self.db.executemany(f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) "
+                                f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        stats["files_parsed"] = len(rows)
+        stats["seconds"] = time.perf_counter() - start
+        return stats
+
+    def _parse(self, paths, processes):
+        jobs = [(self.documents_folder, path) for path in paths]
+        if len(jobs) < POOL_THRESHOLD or processes == 1:
+            rows = map(_read_entry, jobs)
+            return [row for row in rows if row is not None]
+        with multiprocessing.Pool(processes) as pool:
+            rows = pool.imap_unordered(_read_entry, jobs, chunksize=64)
+            return [row for row in rows if row is not None]
+
+    def _forget_dir(self, relative_dir):
+        prefix = relative_dir + os.sep
+        removed = self.db.execute("DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?",
+                                  (relative_dir, len(prefix), prefix)).rowcount
+        self.db.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                        (relative_dir, len(prefix), prefix))
+        return removed
+
+    def find(self, uid=None, author=None, name=None, kind=None, limit=100):
+        """Files matching every given filter; ``author`` and ``name`` are case-insensitive substrings."""
+        clauses = []
+        params = []
+        if uid:
+            clauses.append("uid = ?")
+            params.append(uid)
+        if author:
+            clauses.append("(author LIKE ? OR player LIKE ?)")
+            params += [f"%{author}%"] * 2
+        if name:
+            clauses.append("name LIKE ?")
+            params.append(f"%{name}%")
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        query = "SELECT * FROM files"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY path LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.db.execute(query, params)]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
@@ -0,0 +1,139 @@
+"""Shared store of car skins and texture mods, placed into prefixes as hardlinks
+
+Every skin or mod is stored once under the cache directory by its SHA-256. Installing it into a
+Skins folder, in any prefix, links the stored blob there (reflinking or copying across filesystems)
+and writes the ``.loc`` file. Placements are recorded so ``gc`` can tell which blobs nothing uses.
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+from cache import ArtifactStore, get_cache_dir
+from downloader import file_sha256, filename_from_url, fix_existing, get_downloader
+from tools import reflink, write_if_changed
+
+
+class ModStore(ArtifactStore):
+    """An ArtifactStore that is never LRU-evicted; blobs go away through ``gc`` once unplaced."""
+    def __init__(self, root=None, downloader=None):
+        super().__init__(root or get_cache_dir("mods"), max_bytes=float("inf"), downloader=downloader)
+
+    def install(self, url, folder, locator=None, progress=None):
+        """Place the file at ``url`` into ``folder`` and return its path, downloading it only once.
+
+        Placing the same file into the same folder again is a no-op. ``locator``, when given, is
+        written to ``<file>.loc`` (the URL other players' games fetch the skin from). ``progress``
+        is passed on to the download.
+        """
+        sha256, filename = self.blob_for(url, progress)
+        os.makedirs(folder, exist_ok=True)
+        dest = os.path.join(folder, filename)
+        if os.path.exists(dest) and not self._holds(dest, sha256):
+            dest = self._existing_placement(folder, sha256) or fix_existing(dest)
+        linked = True
+        if not os.path.exists(dest):
+            linked = self._link(sha256, dest)
+        self._record_placement(sha256, dest, linked)
+        if locator is not None:
+            write_if_changed(dest + ".loc", locator.encode("utf-8"))
+        return dest
+
+    def blob_for(self, url, progress=None):
+        """``(sha256, filename)`` of ``url`` in the store, downloading it if it is not there yet."""
+        downloader = self.downloader or get_downloader()
+        entry = self._cached(downloader, url, None, None)
+        if entry is None:
+            with tempfile.TemporaryDirectory(dir=self.root) as tmp:
+                result = downloader.fetch(url, tmp, progress=progress)
+                self.add_file(result.path, url, result.etag, result.last_modified, result.sha256, link=True)
+                return result.sha256, os.path.basename(result.path)
+        return entry["sha256"], entry.get("filename") or filename_from_url(url) or "download"
+
+    def gc(self, dry_run=False):
+        """Delete blobs that are no longer placed anywhere; returns what was (or would be) reclaimed."""
+        stats = {"blobs": 0, "removed": 0, "bytes_freed": 0, "placements_pruned": 0}
+        with self._index() as index:
+            placements = index.setdefault("placements", {})
+            for sha256 in list(index["blobs"]):
+                stats["blobs"] += 1
+                blob = self.blob_path(sha256)
+                try:
+                    blob_stat = os.stat(blob)
+                except FileNotFoundError:
+                    continue
+                alive = [placement for placement in placements.get(sha256, [])
+                         if self._placement_alive(placement, blob_stat)]
+                stats["placements_pruned"] += len(placements.get(sha256, [])) - len(alive)
+                # A link count above one also covers links made outside of install()
+                if alive or blob_stat.st_nlink > 1:
+                    if not dry_run:
+                        placements[sha256] = alive
+                    continue
+                stats["removed"] += 1
+                stats["bytes_freed"] += blob_stat.st_size
+                if not dry_run:
+                    os.remove(blob)
+                    index["blobs"].pop(sha256)
+                    placements.pop(sha256, None)
+            if not dry_run:
+                index["urls"] = {url: entry for url, entry in index["urls"].items()
+                                 if entry["sha256"] in index["blobs"]}
+        return stats
+
+    def _link(self, sha256, dest):
+        """Hardlink the blob to ``dest``; returns False when it had to reflink or copy instead."""
+        blob = self.blob_path(sha256)
+        try:
+            os.link(blob, dest)
+            return True
+        except OSError:
+            pass
+        if not reflink(blob, dest):
+            shutil.copyfile(blob, dest)
+        return False
+
+    def _holds(self, path, sha256):
+        blob = self.blob_path(sha256)
+        if os.path.samefile(path, blob):
+            return True
+        return os.path.getsize(path) == os.path.getsize(blob) and file_sha256(path) == sha256
+
+    def _existing_placement(self, folder, sha256):
+        """A file already placed in ``folder`` with this content, under any name."""
+        with self._index() as index:
+            for placement in index.setdefault("placements", {}).get(sha256, []):
+                path = placement["path"]
+                if os.path.dirname(path) == os.path.abspath(folder) and os.path.exists(path):
+                    return path
+        return None
+
+    def _record_placement(self, sha256, dest, linked):
+        dest = os.path.abspath(dest)
+        with self._index() as index:
+            placements = index.setdefault("placements", {}).setdefault(sha256, [])
+            if not any(placement["path"] == dest for placement in placements):
+                placements.append({"path": dest, "linked": linked})
+
+    @staticmethod
+    def _placement_alive(placement, blob_stat):
+        try:
+            stat = os.stat(placement["path"])
+        except FileNotFoundError:
+            return False
+        if placement["linked"]:
+            return stat.st_ino == blob_stat.st_ino and stat.st_dev == blob_stat.st_dev
+        # Reflinked or copied: still there unless it has been replaced by something else
+        return stat.st_size == blob_stat.st_size
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_mod_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ModStore()
+        return _default_store
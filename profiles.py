@@ -0,0 +1,204 @@
+"""Cached catalog of TMLoader profiles"""
+import hashlib
+import json
+import os
+import re
+
+import yaml
+
+from cache import get_cache_dir
+from configstore import get_config_store
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+PROFILE_SUFFIXES = (".yaml", ".yml")
+CACHE_VERSION = 1
+
+_description_regex = re.compile(rb"^description:[ \t]*(.*?)[ \t]*$", re.MULTILINE)
+
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump_yaml(data, stream, **kwargs):
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
+
+
+class ProfileEntry:
+    """One profile file; ``data`` (the mod list and the rest) is parsed on first access."""
+    def __init__(self, catalog, filename, description):
+        self.catalog = catalog
+        self.filename = filename
+        self.name = filename.rsplit(".", 1)[0]
+        self.description = description
+
+    @property
+    def path(self):
+        return os.path.join(self.catalog.folder, self.filename)
+
+    @property
+    def data(self):
+        return self.catalog.load(self.filename)
+
+
+class ProfileCatalog:
+    """Profiles of a TMLoader install, with parsed contents cached on disk by file mtime and size.
+
+    Iterating only needs each file's description, which comes from the cache or a cheap scan of
+    the raw file, so listing profiles never parses the mod lists.
+    """
+    def __init__(self, folder, cache_path=None):
+        self.folder = folder
+        if cache_path is None:
+            key = hashlib.sha1(os.path.abspath(folder).encode()).hexdigest()[:16]
+            cache_path = os.path.join(get_cache_dir("profiles"), key + ".json")
+        self.cache_path = cache_path
+        # Set while a DetectionWatcher calls invalidate() on changes, so the folder is listed only then
+        self.listing_watched = False
+        self._cache = None
+        self._dirty = False
+        self._listing = None
+        # Profiles written in a config store batch that is not flushed yet
+        self._written = {}
+
+    def __iter__(self):
+        return self.entries()
+
+    def entries(self):
+        for filename, stat in self._files():
+            cached = self._cached(filename, stat)
+            if cached is not None:
+                description = cached.get("description")
+            else:
+                description = self._scan_description(os.path.join(self.folder, filename))
+                self._load_cache()[filename] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                                                "description": description}
+                self._dirty = True
+            yield ProfileEntry(self, filename, description)
+        self.save()
+
+    def load(self, filename):
+        if filename in self._written:
+            return self._written[filename]
+        path = os.path.join(self.folder, filename)
+        stat = os.stat(path)
+        cached = self._cached(filename, stat)
+        if cached is not None and "data" in cached:
+            return cached["data"]
+        with open(path, "r", encoding="utf-8") as f:
+            data = load_yaml(f)
+        self._store(filename, stat, data)
+        return data
+
+    def all(self):
+        """Every profile parsed, keyed by file name, like the old get_profiles."""
+        profiles = {filename: self.load(filename) for filename, _ in self._files()}
+        self.save()
+        return profiles
+
+    def write(self, name, data):
+        """Write a profile and keep the cache in step with it.
+
+        Inside a config store batch the file is written when the batch ends, and the cache is saved
+        once for every profile written in it.
+        """
+        filename = name + ".yaml"
+        path = os.path.join(self.folder, filename)
+        store = get_config_store()
+        self._written[filename] = data
+        store.write(path, dump_yaml(data, None).encode("utf-8"))
+        store.on_flush(("profiles", self.cache_path), self._flushed, self._discarded)
+        return path
+
+    def update(self, name, data):
+        """Write a profile only if its contents differ; returns whether it was written."""
+        filename = name + ".yaml"
+        try:
+            if self.load(filename) == data:
+                return False
+        except FileNotFoundError:
+            pass
+        except yaml.YAMLError:
+            pass
+        self.write(name, data)
+        return True
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "files": self._cache}, f, default=str)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
+        except OSError:
+            pass
+
+    def _flushed(self):
+        written, self._written = self._written, {}
+        for filename, data in written.items():
+            try:
+                self._store(filename, os.stat(os.path.join(self.folder, filename)), data)
+            except FileNotFoundError:
+                pass
+        self._listing = None
+        self.save()
+
+    def _discarded(self):
+        self._written = {}
+        self._listing = None
+
+    def invalidate(self):
+        """Forget the folder listing; it is read again on next use."""
+        self._listing = None
+
+    def _files(self):
+        if self.listing_watched and self._listing is not None:
+            return self._listing
+        try:
+            with os.scandir(self.folder) as entries:
+                files = [(entry.name, entry.stat()) for entry in entries
+                         if entry.name.endswith(PROFILE_SUFFIXES) and entry.is_file()]
+        except FileNotFoundError:
+            files = []
+        self._listing = sorted(files)
+        return self._listing
+
+    def _load_cache(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_path, "r", encoding="utf-8") as f:
+                    cache = json.load(f)
+                self._cache = cache["files"] if cache.get("version") == CACHE_VERSION else {}
+            except (OSError, ValueError, KeyError):
+                self._cache = {}
+        return self._cache
+
+    def _cached(self, filename, stat):
+        cached = self._load_cache().get(filename)
+        if cached is None or cached["mtime_ns"] != stat.st_mtime_ns or cached["size"] != stat.st_size:
+            return None
+        return cached
+
+    def _store(self, filename, stat, data):
+        description = data.get("description") if isinstance(data, dict) else None
+        self._load_cache()[filename] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                                        "description": description, "data": data}
+        self._dirty = True
+
+    @staticmethod
+    def _scan_description(path):
+        with open(path, "rb") as f:
+            match = _description_regex.search(f.read())
+        if not match:
+            return None
+        try:
+            value = load_yaml(match.group(1).decode("utf-8", errors="replace"))
+        except yaml.YAMLError:
+            return None
+        return str(value) if value is not None else None
@@ -0,0 +1,118 @@
+"""Indexed reader for wine registry hives"""
+import json
+import os
+import re
+
+from tracing import span
+
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+
+_key_regex = re.compile(r'^\[(.+?)\](?:\s|$)')
+_value_regex = re.compile(r'^"((?:[^"\\]|\\.)*)"="(.+)"')
+
+_indexes = {}
+
+
+class RegistryIndex:
+    """Key -> values map of one hive, built in a single pass and reused until the hive changes.
+
+    Keys and values are stored exactly as they appear in the .reg file (backslashes still escaped),
+    so lookups behave like the old line-by-line scan.
+    """
+    def __init__(self, reg_file_path, keys=None, mtime_ns=None, size=None):
+        self.reg_file_path = str(reg_file_path)
+        self.keys = keys if keys is not None else {}
+        self.mtime_ns = mtime_ns
+        self.size = size
+
+    @property
+    def index_path(self):
+        return self.reg_file_path + INDEX_SUFFIX
+
+    def get(self, key, value_name):
+        values = self.keys.get(key)
+        if values is None:
+            return None
+        return values.get(value_name)
+
+    def is_current(self, stat=None):
+        if stat is None:
+            try:
+                stat = os.stat(self.reg_file_path)
+            except FileNotFoundError:
+                return False
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+    def build(self):
+        stat = os.stat(self.reg_file_path)
+        keys = {}
+        values = None
+        with open(self.reg_file_path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                first = line[:1]
+                if first == "[":
+                    match = _key_regex.match(line)
+                    if match:
+                        # Like the old scanner, the first occurrence of a key wins
+                        values = keys.setdefault(match.group(1), {})
+                    else:
+                        values = None
+                elif first == '"' and values is not None:
+                    match = _value_regex.match(line.strip())
+                    if match:
+                        values.setdefault(match.group(1), match.group(2))
+        self.keys = keys
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+
+    def save(self):
+        data = {"version": INDEX_VERSION, "mtime_ns": self.mtime_ns, "size": self.size, "keys": self.keys}
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # A read-only prefix still works, it just re-parses next time
+            pass
+
+    def load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != INDEX_VERSION:
+            return False
+        self.keys = data.get("keys", {})
+        self.mtime_ns = data.get("mtime_ns")
+        self.size = data.get("size")
+        return True
+
+
+def get_registry_index(reg_file_path):
+    """Return an up-to-date index for a hive, from memory, the persisted index or a fresh parse."""
+    reg_file_path = str(reg_file_path)
+    stat = os.stat(reg_file_path)
+
+    index = _indexes.get(reg_file_path)
+    if index is not None and index.is_current(stat):
+        return index
+
+    index = RegistryIndex(reg_file_path)
+    with span("registry.load", reg=os.path.basename(reg_file_path)):
+        loaded = index.load() and index.is_current(stat)
+    if not loaded:
+        with span("registry.build", reg=os.path.basename(reg_file_path), bytes=stat.st_size):
+            index.build()
+            index.save()
+    _indexes[reg_file_path] = index
+    return index
+
+
+def invalidate(reg_file_path=None):
+    if reg_file_path is None:
+        _indexes.clear()
+    else:
+        _indexes.pop(str(reg_file_path), None)
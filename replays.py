@@ -0,0 +1,135 @@
+"""Batch analysis of replay headers across a process pool"""
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gbx import try_read_header
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_SIZE = 512
+
+
+def find_replays(folder):
+    replays = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.lower().endswith(".replay.gbx"):
+                replays.append(os.path.join(root, name))
+    return replays
+
+
+def _parse_chunk(paths):
+    """Worker: parse one chunk of replays into plain tuples."""
+    rows = []
+    for path in paths:
+        header = try_read_header(path)
+        if header is None or header.get("kind") != "replay" or not header.get("uid"):
+            continue
+        race_time = header.get("race_time")
+        checkpoints = header.get("checkpoints")
+        rows.append((path, header["uid"], header.get("player") or "",
+                     race_time if race_time is not None else -1, checkpoints if checkpoints is not None else -1))
+    return rows
+
+
+class ReplayTable:
+    """Columnar store of replay headers: map and player columns are dictionary-encoded indices.
+
+    Queries run vectorised through NumPy when it is installed and fall back to plain loops otherwise.
+    """
+    def __init__(self):
+        self.paths = []
+        self.map_ids = array("I")
+        self.player_ids = array("I")
+        self.times = array("q")
+        self.checkpoints = array("q")
+        self.uids = []
+        self.players = []
+        self._uid_index = {}
+        self._player_index = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def extend(self, rows):
+        for path, uid, player, race_time, checkpoints in rows:
+            map_id = self._uid_index.get(uid)
+            if map_id is None:
+                map_id = self._uid_index[uid] = len(self.uids)
+                self.uids.append(uid)
+            player_id = self._player_index.get(player)
+            if player_id is None:
+                player_id = self._player_index[player] = len(self.players)
+                self.players.append(player)
+            self.paths.append(path)
+            self.map_ids.append(map_id)
+            self.player_ids.append(player_id)
+            self.times.append(race_time)
+            self.checkpoints.append(checkpoints)
+
+    def best_times(self, player=None):
+        """``{map_uid: (time, player, path)}`` for the fastest valid replay of every map."""
+        player_id = self._player_index.get(player) if player is not None else None
+        if player is not None and player_id is None:
+            return {}
+        if np is not None:
+            map_ids = np.frombuffer(self.map_ids, dtype=np.uint32)
+            times = np.frombuffer(self.times, dtype=np.int64)
+            mask = times >= 0
+            if player_id is not None:
+                mask &= np.frombuffer(self.player_ids, dtype=np.uint32) == player_id
+            rows = np.flatnonzero(mask)
+            rows = rows[np.lexsort((times[rows], map_ids[rows]))]
+            _, first = np.unique(map_ids[rows], return_index=True)
+            best = rows[first]
+        else:
+            fastest = {}
+            for row, (map_id, race_time) in enumerate(zip(self.map_ids, self.times)):
+                if race_time < 0 or (player_id is not None and self.player_ids[row] != player_id):
+                    continue
+                if map_id not in fastest or race_time < self.times[fastest[map_id]]:
+                    fastest[map_id] = row
+            best = fastest.values()
+        return {self.uids[self.map_ids[row]]: (self.times[row], self.players[self.player_ids[row]], self.paths[row])
+                for row in (int(row) for row in best)}
+
+    def times_for(self, uid):
+        map_id = self._uid_index.get(uid)
+        if map_id is None:
+            return []
+        if np is not None:
+            times = np.frombuffer(self.times, dtype=np.int64)
+            selected = times[(np.frombuffer(self.map_ids, dtype=np.uint32) == map_id) & (times >= 0)]
+            return np.sort(selected)
+        return sorted(t for m, t in zip(self.map_ids, self.times) if m == map_id and t >= 0)
+
+    def percentile(self, uid, q):
+        """Race time at percentile ``q`` (0-100) for one map, linearly interpolated like numpy.percentile."""
+        times = self.times_for(uid)
+        if len(times) == 0:
+            return None
+        if np is not None:
+            return float(np.percentile(times, q))
+        position = (len(times) - 1) * q / 100
+        lower = int(position)
+        upper = min(lower + 1, len(times) - 1)
+        return times[lower] + (times[upper] - times[lower]) * (position - lower)
+
+
+def analyse(folder, workers=None, chunk_size=CHUNK_SIZE):
+    """Parse every replay under ``folder`` in a process pool, streaming results into a ReplayTable."""
+    paths = find_replays(folder)
+    table = ReplayTable()
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    if len(chunks) <= 1:
+        for chunk in chunks:
+            table.extend(_parse_chunk(chunk))
+        return table
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for future in as_completed([pool.submit(_parse_chunk, chunk) for chunk in chunks]):
+            table.extend(future.result())
+    return table
@@ -0,0 +1,137 @@
+"""Integrity check and content index of the skin and texture mod archives in Skins/
+
+Every archive's central directory is read and every member's CRC checked (decompressing in memory,
+nothing is extracted) on a thread pool. The result and the member list are cached by file size and
+mtime, so re-verifying only reads archives that changed. Texture mods of the same environment that
+replace the same file with different contents are reported as conflicts.
+"""
+import hashlib
+import json
+import os
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import get_cache_dir
+
+ARCHIVE_SUFFIXES = (".zip",)
+MOD_FOLDER = "mod"
+CACHE_VERSION = 1
+
+
+def verify_archive(path):
+    """``(error, entries)`` for one archive; ``error`` is None when every member's CRC matches."""
+    entries = []
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                entries.append((info.filename, info.file_size, info.CRC))
+                # Reading the member to the end is what makes zipfile check its CRC
+                with archive.open(info) as member:
+                    while member.read(1 << 20):
+                        pass
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError, NotImplementedError, RuntimeError) as e:
+        return f"{type(e).__name__}: {e}", entries
+    return None, entries
+
+
+class SkinIndex:
+    """Verification results and member lists of every archive under a documents folder's Skins/."""
+    def __init__(self, documents_folder, cache_path=None):
+        self.skins_folder = os.path.join(os.path.abspath(documents_folder), "Skins")
+        if cache_path is None:
+            key = hashlib.sha1(self.skins_folder.encode()).hexdigest()[:16]
+            cache_path = os.path.join(get_cache_dir("skins"), key + ".json")
+        self.cache_path = cache_path
+        self.archives = self._load()
+
+    def verify(self, workers=None):
+        start = time.perf_counter()
+        found = self._find_archives()
+        stale = [path for path, stat in found.items()
+                 if (cached := self.archives.get(path)) is None
+                 or cached["size"] != stat.st_size or cached["mtime_ns"] != stat.st_mtime_ns]
+
+        with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+            for path, (error, entries) in zip(stale, pool.map(verify_archive,
+                                                              [os.path.join(self.skins_folder, p) for p in stale])):
+                stat = found[path]
+                self.archives[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "error": error,
+                                       "entries": entries}
+        for path in set(self.archives) - set(found):
+            del self.archives[path]
+        self.save()
+
+        return {
+            "archives": len(found),
+            "verified": len(stale),
+            "reused": len(found) - len(stale),
+            "broken": {path: archive["error"] for path, archive in sorted(self.archives.items()) if archive["error"]},
+            "conflicts": self.conflicts(),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def conflicts(self):
+        """``{folder: {member: [archives]}}`` for files that several texture mods of one environment
+        replace differently. Car skins are alternatives to each other, so they never conflict."""
+        by_folder = {}
+        for path, archive in self.archives.items():
+            folder = os.path.dirname(path)
+            if os.path.basename(folder).lower() != MOD_FOLDER or archive["error"]:
+                continue
+            members = by_folder.setdefault(folder, {})
+            for name, _, crc in archive["entries"]:
+                members.setdefault(name.lower(), {}).setdefault(crc, []).append(path)
+        conflicts = {}
+        for folder, members in by_folder.items():
+            for name, versions in members.items():
+                if len(versions) > 1:
+                    conflicts.setdefault(folder, {})[name] = sorted(p for paths in versions.values() for p in paths)
+        return conflicts
+
+    def overrides(self, path):
+        """The files an archive replaces (its member names)."""
+        archive = self.archives.get(path)
+        return [] if archive is None else [name for name, _, _ in archive["entries"]]
+
+    def save(self):
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "archives": self.archives}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("version") == CACHE_VERSION:
+                return cache["archives"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def _find_archives(self):
+        found = {}
+        for root, _, files in os.walk(self.skins_folder):
+            for name in files:
+                if name.lower().endswith(ARCHIVE_SUFFIXES):
+                    path = os.path.join(root, name)
+                    found[os.path.relpath(path, self.skins_folder)] = os.stat(path)
+        return found
+
+
+def format_report(report):
+    lines = [f"Skins: {report['archives']} archives, {report['verified']} verified, {report['reused']} unchanged, "
+             f"{len(report['broken'])} broken in {report['seconds']:.2f}s"]
+    for path, error in report["broken"].items():
+        lines.append(f"  BROKEN {path}: {error}")
+    for folder, members in report["conflicts"].items():
+        for name, archives in sorted(members.items()):
+            lines.append(f"  CONFLICT {folder}: {name} in {', '.join(os.path.basename(a) for a in archives)}")
+    return "\n".join(lines)
@@ -0,0 +1,176 @@
+"""Copy-on-write templates of fully provisioned prefixes
+
+A template is a snapshot of a prefix with the game, TMLoader and profiles already installed.
+Cloning one reflinks every file where the filesystem supports it (btrfs, XFS...) and copies the
+rest, then rewrites only what is specific to the new prefix: the user's home folder, the TMLoader
+settings.yaml and the profiles. Game files with suffixes the caller knows are never written to can
+be hardlinked instead; a hardlinked file is the same file in the template and every clone, so a
+patch rewriting it in place would change them all.
+"""
+import json
+import os
+import re
+import shutil
+import time
+
+from tools import reflink
+
+TEMPLATE_FILE = "tm-template.json"
+GAME_DIRS = ("TmNationsForever", "TmUnitedForever")
+# Files in the game folder that get written to (install_modloader swaps the exe), never hardlinked
+MUTABLE_GAME_FILES = ("tmforever.exe", "tmforever.bak.exe")
+MUTABLE_SUFFIXES = (".ini", ".cfg", ".log", ".txt", ".xml", ".yaml", ".yml")
+# Derived data that is rebuilt on demand and only valid for the original file
+SKIP_SUFFIXES = (".index.json",)
+REGISTRY_FILES = ("system.reg", "user.reg", "userdef.reg")
+
+
+class TemplateError(Exception):
+    pass
+
+
+def prefix_user(pfx):
+    """The (single) user of a prefix, from its drive_c/users folder."""
+    users = [name for name in os.listdir(os.path.join(pfx, "drive_c", "users"))
+             if name != "Public" and os.path.isdir(os.path.join(pfx, "drive_c", "users", name))]
+    if len(users) != 1:
+        raise TemplateError(f"Cannot tell the user of {pfx}: {users}")
+    return users[0]
+
+
+class PrefixCloner:
+    """Copies a prefix tree, preferring reflinks and keeping symlinks.
+
+    Game files ending in one of ``hardlink_suffixes`` (e.g. ``(".bik",)``) are hardlinked; only pass
+    suffixes of files that nothing rewrites in place.
+    """
+    def __init__(self, source, destination, hardlink_suffixes=()):
+        self.source = os.path.abspath(source)
+        self.destination = os.path.abspath(destination)
+        self.hardlink_suffixes = tuple(suffix.lower() for suffix in hardlink_suffixes)
+        self.stats = {"files": 0, "reflinked": 0, "hardlinked": 0, "copied": 0, "bytes_copied": 0,
+                      "symlinks": 0}
+        self._reflink = True
+
+    def run(self):
+        if os.path.exists(self.destination) and os.listdir(self.destination):
+            raise TemplateError(f"{self.destination} is not empty")
+        start = time.perf_counter()
+        self._clone_dir(self.source, self.destination, in_game=False)
+        self.stats["seconds"] = time.perf_counter() - start
+        return self.stats
+
+    def _clone_dir(self, source, destination, in_game):
+        os.makedirs(destination, exist_ok=True)
+        with os.scandir(source) as entries:
+            for entry in entries:
+                if entry.name == TEMPLATE_FILE or entry.name.endswith(SKIP_SUFFIXES):
+                    continue
+                target = os.path.join(destination, entry.name)
+                if entry.is_symlink():
+                    self._clone_symlink(entry.path, target)
+                elif entry.is_dir():
+                    self._clone_dir(entry.path, target, in_game or entry.name in GAME_DIRS)
+                elif entry.is_file():
+                    self._clone_file(entry, target, in_game)
+        shutil.copystat(source, destination, follow_symlinks=False)
+
+    def _clone_symlink(self, source, destination):
+        link = os.readlink(source)
+        # Links into the prefix itself (e.g. dosdevices/c:) must point into the clone
+        if os.path.isabs(link) and (link == self.source or link.startswith(self.source + os.sep)):
+            link = self.destination + link[len(self.source):]
+        os.symlink(link, destination)
+        self.stats["symlinks"] += 1
+
+    def _clone_file(self, entry, destination, in_game):
+        self.stats["files"] += 1
+        lowered = entry.name.lower()
+        if (in_game and self.hardlink_suffixes and lowered.endswith(self.hardlink_suffixes)
+                and lowered not in MUTABLE_GAME_FILES and not lowered.endswith(MUTABLE_SUFFIXES)):
+            try:
+                os.link(entry.path, destination)
+                self.stats["hardlinked"] += 1
+                return
+            except OSError:
+                pass
+        if self._reflink and reflink(entry.path, destination):
+            self.stats["reflinked"] += 1
+        else:
+            # One failed reflink means the filesystem cannot do it, stop trying
+            self._reflink = False
+            shutil.copyfile(entry.path, destination)
+            self.stats["copied"] += 1
+            self.stats["bytes_copied"] += entry.stat().st_size
+        shutil.copystat(entry.path, destination)
+
+
+def snapshot(pfx, template, hardlink_suffixes=()):
+    """Turn a provisioned prefix into a template at ``template``."""
+    user = prefix_user(pfx)
+    stats = PrefixCloner(pfx, template, hardlink_suffixes).run()
+    with open(os.path.join(template, TEMPLATE_FILE), "w", encoding="utf-8") as f:
+        json.dump({"user": user, "source": os.path.abspath(pfx), "created": time.time()}, f)
+    print(f"Template {template} created from {pfx}: {format_stats(stats)}")
+    return stats
+
+
+def clone(template, pfx, user=None, hardlink_suffixes=()):
+    """Provision ``pfx`` from a template (or any provisioned prefix) for ``user`` (default: $USER)."""
+    from trackmania import TrackMania
+
+    user = user or os.environ.get("USER")
+    try:
+        with open(os.path.join(template, TEMPLATE_FILE), "r", encoding="utf-8") as f:
+            template_user = json.load(f)["user"]
+    except (OSError, ValueError, KeyError):
+        template_user = prefix_user(template)
+
+    stats = PrefixCloner(template, pfx, hardlink_suffixes).run()
+    start = time.perf_counter()
+    if user != template_user:
+        rename_user(pfx, template_user, user)
+
+    previous_user = os.environ.get("USER")
+    os.environ["USER"] = user
+    try:
+        tm = TrackMania(pfx=os.path.abspath(pfx))
+        if tm.tmloader_path:
+            tm.write_tmloader_settings()
+            tm.create_default_profiles()
+    finally:
+        if previous_user is None:
+            os.environ.pop("USER", None)
+        else:
+            os.environ["USER"] = previous_user
+    stats["rewrite_seconds"] = time.perf_counter() - start
+    print(f"Prefix {pfx} cloned from {template}: {format_stats(stats)}")
+    return stats
+
+
+def rename_user(pfx, old, new):
+    """Move the home folder and point the registry's per-user paths at it."""
+    users = os.path.join(pfx, "drive_c", "users")
+    os.rename(os.path.join(users, old), os.path.join(users, new))
+    for name in REGISTRY_FILES:
+        path = os.path.join(pfx, name)
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        # Paths are stored as C:\\users\\<name>\\... in the hives; the name ends at a separator or the
+        # closing quote, so renaming bob leaves bobby alone
+        rewritten = re.sub(rb'\\\\users\\\\' + re.escape(old.encode()) + rb'(?=\\\\|")',
+                           lambda match: b"\\\\users\\\\" + new.encode(), data)
+        if rewritten != data:
+            # The clone may share its blocks with the template; write a new file rather than in place
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(rewritten)
+            shutil.copystat(path, tmp_path)
+            os.replace(tmp_path, path)
+
+
+def format_stats(stats):
+    return (f"{stats['files']} files ({stats['reflinked']} reflinked, {stats['hardlinked']} hardlinked, "
+            f"{stats['copied']} copied, {stats['bytes_copied'] / 1048576:.1f} MiB) in {stats['seconds']:.2f}s")
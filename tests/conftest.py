@@ -0,0 +1,12 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+def pytest_configure(config):
+    # Keep the caches of the code under test out of the user's cache dir
+    import tempfile
+    os.environ["TM_CACHE_DIR"] = tempfile.mkdtemp(prefix="tm-tests-")
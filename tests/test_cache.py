@@ -0,0 +1,96 @@
+import os
+import time
+
+import pytest
+
+from cache import ArtifactStore
+from downloader import Downloader
+from fixtures import StaticServer
+
+SIZE = 64 << 10
+
+
+class CountingDownloader(Downloader):
+    def __init__(self):
+        super().__init__(connections=1, backoff=0)
+        self.fetches = 0
+
+    def fetch(self, *args, **kwargs):
+        self.fetches += 1
+        return super().fetch(*args, **kwargs)
+
+
+@pytest.fixture
+def www(tmp_path):
+    www = tmp_path / "www"
+    www.mkdir()
+    for name in ("a.gbx", "b.gbx", "c.gbx"):
+        (www / name).write_bytes(os.urandom(SIZE))
+    return www
+
+
+def store(tmp_path, **kwargs):
+    downloader = CountingDownloader()
+    return ArtifactStore(str(tmp_path / "store"), downloader=downloader, **kwargs), downloader
+
+
+def test_hit_and_miss(www, tmp_path):
+    artifacts, downloader = store(tmp_path)
+    with StaticServer(str(www)) as server:
+        first = artifacts.fetch(server.url("a.gbx"), str(tmp_path / "one.gbx"))
+        second = artifacts.fetch(server.url("a.gbx"), str(tmp_path / "two.gbx"))
+    assert downloader.fetches == 1
+    assert open(first, "rb").read() == open(second, "rb").read() == (www / "a.gbx").read_bytes()
+
+
+def test_placed_files_do_not_share_the_blob(www, tmp_path):
+    artifacts, _ = store(tmp_path)
+    with StaticServer(str(www)) as server:
+        url = server.url("a.gbx")
+        placed = artifacts.fetch(url, str(tmp_path / "one.gbx"))
+        with open(placed, "r+b") as f:
+            f.write(b"edited in place")
+        again = artifacts.fetch(url, str(tmp_path / "two.gbx"))
+    assert open(again, "rb").read() == (www / "a.gbx").read_bytes()
+
+
+def test_linked_placement_shares_the_blob(www, tmp_path):
+    artifacts, _ = store(tmp_path)
+    with StaticServer(str(www)) as server:
+        url = server.url("a.gbx")
+        artifacts.fetch(url, str(tmp_path / "one.gbx"), link=True)
+        placed = artifacts.fetch(url, str(tmp_path / "two.gbx"), link=True)
+    assert os.stat(placed).st_nlink == 3
+
+
+def test_revalidation(www, tmp_path):
+    artifacts, downloader = store(tmp_path, fresh_for=0)
+    with StaticServer(str(www)) as server:
+        url = server.url("a.gbx")
+        artifacts.fetch(url, str(tmp_path / "one.gbx"))
+        # Not modified: 304, served from the store
+        artifacts.fetch(url, str(tmp_path / "two.gbx"))
+        assert downloader.fetches == 1
+
+        # Changed on the server: 200, downloaded again
+        (www / "a.gbx").write_bytes(b"new contents")
+        later = time.time() + 10
+        os.utime(www / "a.gbx", (later, later))
+        placed = artifacts.fetch(url, str(tmp_path / "three.gbx"))
+    assert downloader.fetches == 2
+    assert open(placed, "rb").read() == b"new contents"
+
+
+def test_eviction(www, tmp_path):
+    artifacts, downloader = store(tmp_path, max_bytes=2 * SIZE)
+    with StaticServer(str(www)) as server:
+        for name in ("a.gbx", "b.gbx", "c.gbx"):
+            artifacts.fetch(server.url(name), str(tmp_path / name))
+        assert artifacts.lookup(server.url("a.gbx")) is None
+        assert artifacts.lookup(server.url("b.gbx")) is not None
+        assert artifacts.lookup(server.url("c.gbx")) is not None
+        blobs = [name for _, _, names in os.walk(tmp_path / "store" / "blobs") for name in names]
+        assert len(blobs) == 2
+
+        artifacts.fetch(server.url("a.gbx"), str(tmp_path / "again.gbx"))
+    assert downloader.fetches == 4
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from configstore import ConfigStore
+
+
+def test_batch_writes_each_file_once(tmp_path):
+    store = ConfigStore(lock_dir=str(tmp_path))
+    path = str(tmp_path / "settings.yaml")
+    with store.batch():
+        store.write(path, b"a")
+        store.write(path, b"b")
+        assert not os.path.exists(path)
+        assert store.read(path) == b"b"
+    assert open(path, "rb").read() == b"b"
+    assert (store.stats["writes"], store.stats["coalesced"]) == (1, 1)
+
+
+def test_failed_batch_writes_nothing(tmp_path):
+    store = ConfigStore(lock_dir=str(tmp_path))
+    path = str(tmp_path / "config.yaml")
+    discarded = []
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.write(path, b"a")
+            store.on_flush("key", lambda: None, lambda: discarded.append(True))
+            raise RuntimeError
+    assert not os.path.exists(path)
+    assert discarded == [True] and store.stats["writes"] == 0
+    with store.batch():
+        pass
+    assert not os.path.exists(path)
+
+
+def test_edit_is_replayed_on_a_changed_file(tmp_path):
+    store = ConfigStore(lock_dir=str(tmp_path))
+    path = tmp_path / "config.yaml"
+    path.write_bytes(b"one\n")
+    with store.batch():
+        store.edit(str(path), lambda current: current + b"added\n")
+        path.write_bytes(b"one\ntwo\n")
+        os.utime(path, ns=(1, 1))
+    assert path.read_bytes() == b"one\ntwo\nadded\n"
+    assert store.stats["replayed"] == 1
@@ -0,0 +1,67 @@
+import os
+import threading
+
+import pytest
+
+import trackmania
+from detection import state_path
+from fixtures import make_prefix, write_stub_wine
+from trackmania import TrackMania
+
+USER = "tester"
+
+
+@pytest.fixture
+def prefix(tmp_path, monkeypatch):
+    monkeypatch.setenv("USER", USER)
+    monkeypatch.setenv("WINE", write_stub_wine(str(tmp_path / "wine")))
+    pfx = make_prefix(str(tmp_path / "pfx"), USER, reg_size=64 << 10)
+    monkeypatch.setenv("WINEPREFIX", pfx)
+    return pfx
+
+
+def counting_determine_united(monkeypatch):
+    calls = []
+    determine_united = trackmania.determine_united
+    monkeypatch.setattr(trackmania, "determine_united", lambda pfx: calls.append(pfx) or determine_united(pfx))
+    return calls
+
+
+def test_saved_detection_is_reused(prefix, monkeypatch):
+    calls = counting_determine_united(monkeypatch)
+    first = TrackMania(pfx=prefix)
+    assert os.path.exists(state_path(prefix))
+    second = TrackMania(pfx=prefix)
+    assert len(calls) == 1
+    assert (second.united, second.path, second.documents_folder) == \
+        (first.united, first.path, first.documents_folder)
+    assert second.united is False
+
+
+def test_registry_change_invalidates_saved_detection(prefix, monkeypatch):
+    calls = counting_determine_united(monkeypatch)
+    TrackMania(pfx=prefix)
+    # The same prefix, now with United installed
+    make_prefix(prefix, USER, reg_size=64 << 10, united=True)
+    tm = TrackMania(pfx=prefix)
+    assert len(calls) == 2
+    assert tm.united is True
+    assert "TmUnitedForever" in tm.path
+
+
+def test_watcher_follows_system_reg(prefix):
+    tm = TrackMania(pfx=prefix)
+    changed = threading.Event()
+    seen = []
+    watcher = tm.watch(lambda parts: seen.append(parts) or changed.set())
+    if watcher is None:
+        pytest.skip("inotify is not available")
+    try:
+        assert tm.united is False
+        make_prefix(prefix, USER, reg_size=64 << 10, united=True)
+        assert changed.wait(10)
+    finally:
+        tm.stop_watching()
+    assert "registry" in seen[0]
+    assert tm.united is True
+    assert "TmUnitedForever" in tm.path
@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+import pytest
+
+from downloader import DownloadError, Downloader
+from fixtures import RangeServer
+
+SIZE = 1 << 20
+
+
+@pytest.fixture
+def served(tmp_path):
+    www = tmp_path / "www"
+    www.mkdir()
+    data = os.urandom(SIZE)
+    (www / "installer.exe").write_bytes(data)
+    return str(www), hashlib.sha256(data).hexdigest()
+
+
+def downloader(**kwargs):
+    return Downloader(**{"connections": 4, "segment_size": SIZE // 4, "backoff": 0, **kwargs})
+
+
+def test_segmented_fetch(served, tmp_path):
+    www, sha256 = served
+    with RangeServer(www) as server:
+        result = downloader().fetch(server.url("installer.exe"), str(tmp_path), sha256=sha256, size=SIZE)
+    assert result.path == str(tmp_path / "installer.exe")
+    assert (result.size, result.sha256) == (SIZE, sha256)
+    assert not os.path.exists(result.path + ".part.json")
+
+
+def test_short_ranges_are_retried(served, tmp_path):
+    www, sha256 = served
+    with RangeServer(www, cuts=6, cut_bytes=1000) as server:
+        result = downloader().fetch(server.url("installer.exe"), str(tmp_path), sha256=sha256)
+    assert result.sha256 == sha256
+
+
+def test_empty_ranges_give_up(served, tmp_path):
+    www, _ = served
+    with RangeServer(www, cuts=1000, cut_bytes=0) as server:
+        with pytest.raises(DownloadError):
+            downloader(retries=2).fetch(server.url("installer.exe"), str(tmp_path))
+
+
+def test_interrupted_download_resumes(served, tmp_path):
+    www, sha256 = served
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt(done, total):
+        if done >= SIZE // 2:
+            raise Interrupted
+
+    with RangeServer(www) as server:
+        url = server.url("installer.exe")
+        with pytest.raises(Interrupted):
+            downloader().fetch(url, str(tmp_path), progress=interrupt)
+        assert os.path.exists(tmp_path / "installer.exe.part.json")
+        sent = server.sent
+        result = downloader().fetch(url, str(tmp_path), sha256=sha256)
+        resumed = server.sent - sent
+    assert result.sha256 == sha256
+    # Only what was missing is fetched again (plus the one byte probe)
+    assert resumed < SIZE - SIZE // 2 + SIZE // 4
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_overloaded_server_is_retried(served, tmp_path, status):
+    www, sha256 = served
+    with RangeServer(www, failures=3, failure_status=status) as server:
+        result = downloader().fetch(server.url("installer.exe"), str(tmp_path), sha256=sha256)
+    assert result.sha256 == sha256
+
+
+def test_overloaded_server_gives_up(served, tmp_path):
+    www, _ = served
+    with RangeServer(www, failures=1000) as server:
+        with pytest.raises(DownloadError) as error:
+            downloader(retries=2).fetch(server.url("installer.exe"), str(tmp_path))
+    assert error.value.status == 503
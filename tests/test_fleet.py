@@ -0,0 +1,17 @@
+import os
+
+from fleet import expand_prefixes, run_fleet
+
+
+def test_unmatched_prefixes_fail(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "file").write_text("")
+    patterns = [str(tmp_path / "*"), str(tmp_path / "a"), str(tmp_path / "typo"), str(tmp_path / "none-*")]
+    prefixes = expand_prefixes(patterns)
+    assert prefixes == [str(tmp_path / "a"), str(tmp_path / "b"), str(tmp_path / "typo"), str(tmp_path / "none-*")]
+
+    report = run_fleet(prefixes[2:], "detect", workers=1)
+    assert [result["ok"] for result in report["results"]] == [False, False]
+    assert all("No prefix directory" in result["error"] for result in report["results"])
+    assert not os.path.exists(tmp_path / "typo")
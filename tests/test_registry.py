@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import registry
+from fixtures import UNINSTALL_KEY, write_system_reg
+
+GAME_KEY = UNINSTALL_KEY + "TmNationsForever_is1"
+UVME_KEY = UNINSTALL_KEY + "TmNationsForever - UVME_is1"
+
+
+@pytest.fixture
+def hive(tmp_path):
+    path = str(tmp_path / "system.reg")
+    write_system_reg(path, 16 << 10)
+    with open(path, "a", encoding="utf-8") as f:
+        # A second copy of the game's key further down loses to the first
+        f.write(f'[{GAME_KEY}] 1700000001\n"InstallLocation"="C:\\\\Elsewhere\\\\"\n"Extra"="only here"\n\n')
+    registry.invalidate()
+    yield path
+    registry.invalidate()
+
+
+def test_lookups(hive):
+    index = registry.get_registry_index(hive)
+    # Keys and values keep their escaped backslashes
+    assert index.get(GAME_KEY, "InstallLocation") == "C:\\\\Program Files (x86)\\\\TmNationsForever\\\\"
+    assert index.get(GAME_KEY, "Extra") == "only here"
+    # Greedy: the value runs to the last quote, escaped quotes included
+    assert index.get(UVME_KEY, "UninstallString") == \
+        '\\"C:\\\\Program Files (x86)\\\\TmNationsForever\\\\unins001.exe\\"'
+    assert index.get(GAME_KEY, "Missing") is None
+    assert index.get(UNINSTALL_KEY + "Nothing", "InstallLocation") is None
+
+
+def test_index_is_persisted_and_rebuilt_when_stale(hive, monkeypatch):
+    builds = []
+    build = registry.RegistryIndex.build
+    monkeypatch.setattr(registry.RegistryIndex, "build", lambda self: builds.append(1) or build(self))
+
+    registry.get_registry_index(hive)
+    assert os.path.exists(hive + registry.INDEX_SUFFIX)
+    registry.invalidate()
+    registry.get_registry_index(hive)
+    assert len(builds) == 1
+
+    # Same size, newer mtime
+    with open(hive, "r+", encoding="utf-8") as f:
+        data = f.read().replace("C:\\\\Elsewhere", "D:\\\\Elsewhere")
+        f.seek(0)
+        f.write(data)
+    stat = os.stat(hive)
+    os.utime(hive, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    registry.get_registry_index(hive)
+    assert len(builds) == 2
+
+    # Same mtime, different size
+    mtime = os.stat(hive).st_mtime_ns
+    with open(hive, "a", encoding="utf-8") as f:
+        f.write(f'[{UNINSTALL_KEY}New_is1] 1700000002\n"DisplayName"="New"\n\n')
+    os.utime(hive, ns=(mtime, mtime))
+    index = registry.get_registry_index(hive)
+    assert len(builds) == 3
+    assert index.get(UNINSTALL_KEY + "New_is1", "DisplayName") == "New"
@@ -0,0 +1,41 @@
+import os
+
+from templates import PrefixCloner, rename_user
+
+
+def make_prefix(root, user):
+    os.makedirs(root / "drive_c" / "users" / user)
+    game = root / "drive_c" / "Program Files (x86)" / "TmNationsForever"
+    os.makedirs(game / "GameData")
+    (game / "GameData" / "Stadium.pak").write_bytes(b"pack")
+    (game / "intro.bik").write_bytes(b"video")
+    return game
+
+
+def test_clone_copies_game_files_by_default(tmp_path):
+    make_prefix(tmp_path / "template", "bob")
+    stats = PrefixCloner(tmp_path / "template", tmp_path / "clone").run()
+    assert stats["hardlinked"] == 0
+    pack = tmp_path / "clone" / "drive_c" / "Program Files (x86)" / "TmNationsForever" / "GameData" / "Stadium.pak"
+    assert pack.read_bytes() == b"pack" and os.stat(pack).st_nlink == 1
+
+
+def test_clone_hardlinks_only_given_suffixes(tmp_path):
+    make_prefix(tmp_path / "template", "bob")
+    stats = PrefixCloner(tmp_path / "template", tmp_path / "clone", hardlink_suffixes=[".BIK"]).run()
+    assert stats["hardlinked"] == 1
+    game = tmp_path / "clone" / "drive_c" / "Program Files (x86)" / "TmNationsForever"
+    assert os.stat(game / "intro.bik").st_nlink == 2
+    assert os.stat(game / "GameData" / "Stadium.pak").st_nlink == 1
+
+
+def test_rename_user_matches_whole_name(tmp_path):
+    os.makedirs(tmp_path / "drive_c" / "users" / "bob")
+    (tmp_path / "user.reg").write_bytes(b'"Personal"="C:\\\\users\\\\bob\\\\Documents"\n'
+                                        b'"Home"="C:\\\\users\\\\bob"\n'
+                                        b'"Other"="C:\\\\users\\\\bobby\\\\Documents"\n')
+    rename_user(str(tmp_path), "bob", "alice")
+    assert (tmp_path / "user.reg").read_bytes() == (b'"Personal"="C:\\\\users\\\\alice\\\\Documents"\n'
+                                                    b'"Home"="C:\\\\users\\\\alice"\n'
+                                                    b'"Other"="C:\\\\users\\\\bobby\\\\Documents"\n')
+    assert os.path.isdir(tmp_path / "drive_c" / "users" / "alice")
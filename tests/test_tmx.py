@@ -0,0 +1,56 @@
+import pytest
+
+from downloader import Downloader
+from fixtures import TMXServer
+from tmx import TrackCatalog
+
+TRACK_IDS = list(range(1, 121))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "tmx.sqlite3")
+
+
+def catalog(db_path, server, ttl=3600):
+    return TrackCatalog(db_path, server.api_urls(), ttl=ttl, downloader=Downloader(backoff=0))
+
+
+def test_cold_cached_and_revalidated(db_path):
+    with TMXServer(missing={7}) as server:
+        cold = catalog(db_path, server)
+        stats = cold.refresh(TRACK_IDS)
+        assert (stats["requests"], stats["fetched"], stats["missing"]) == (3, 119, 1)
+        tracks = cold.lookup(TRACK_IDS)
+        assert tracks[7] is None
+        assert tracks[8]["name"] == "Track 8"
+        assert server.requests == 3
+
+        stats = catalog(db_path, server).refresh(TRACK_IDS)
+        assert (stats["requests"], stats["cached"]) == (0, 120)
+        assert server.requests == 3
+
+        stats = catalog(db_path, server, ttl=0).refresh(TRACK_IDS)
+        assert (stats["requests"], stats["not_modified"], stats["fetched"]) == (3, 120, 0)
+        assert server.requests == 6
+
+
+def test_offline_falls_back_to_stored(db_path):
+    with TMXServer() as server:
+        catalog(db_path, server).refresh(TRACK_IDS[:10])
+    # The server is gone now
+    stale = catalog(db_path, server, ttl=0)
+    stats = stale.refresh(TRACK_IDS[:20])
+    assert stats["failed"] == 20
+    tracks = stale.lookup(TRACK_IDS[:20], offline=True)
+    assert tracks[5]["name"] == "Track 5"
+    assert tracks[15] is None
+
+
+def test_truncated_response_is_a_failed_batch(db_path):
+    with TMXServer(cuts=1) as server:
+        tracks = catalog(db_path, server)
+        assert tracks.refresh(TRACK_IDS[:10])["failed"] == 10
+        # The broken connection was not pooled; the next lookup works
+        stats = tracks.refresh(TRACK_IDS[:10])
+        assert stats["fetched"] == 10
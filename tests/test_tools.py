@@ -0,0 +1,34 @@
+import io
+import os
+import zipfile
+
+from tools import extract_zip, sync_zip
+
+
+def make_zip(directories=40, files=16):
+    """A zip without directory entries, like those written by most zip tools with -D."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for d in range(directories):
+            for f in range(files):
+                archive.writestr(f"folder{d}/sub/file{f}.txt", f"{d}/{f}".encode() * 64)
+    return buffer.getvalue()
+
+
+def test_extract_zip_without_directory_entries(tmp_path):
+    data = make_zip()
+    for run in range(20):
+        destination = tmp_path / str(run)
+        written = extract_zip(data, str(destination), workers=8)
+        assert written == sum(len(f"{d}/{f}".encode() * 64) for d in range(40) for f in range(16))
+    assert (tmp_path / "0" / "folder39" / "sub" / "file15.txt").read_bytes() == b"39/15" * 64
+    assert len(os.listdir(tmp_path / "0")) == 40
+
+
+def test_sync_zip_without_directory_entries(tmp_path):
+    data = make_zip()
+    manifest = {}
+    written, skipped, removed = sync_zip(data, str(tmp_path), manifest, workers=8)
+    assert (written, skipped, removed) == (sum(len(f"{d}/{f}".encode() * 64) for d in range(40) for f in range(16)), 0, 0)
+    assert len(manifest) == 40 * 16
+    assert sync_zip(data, str(tmp_path), manifest, workers=8) == (0, written, 0)
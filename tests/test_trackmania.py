@@ -0,0 +1,90 @@
+import os
+import zipfile
+
+import pytest
+
+import trackmania
+from fixtures import StaticServer, make_prefix, write_stub_wine, write_tmloader_zip
+from trackmania import TrackMania
+
+USER = "tester"
+GAME = b"MZ" + bytes(4094)
+
+
+@pytest.fixture
+def prefix(tmp_path, monkeypatch):
+    monkeypatch.setenv("USER", USER)
+    monkeypatch.setenv("WINE", write_stub_wine(str(tmp_path / "wine")))
+    pfx = make_prefix(str(tmp_path / "pfx"), USER)
+    monkeypatch.setenv("WINEPREFIX", pfx)
+    return pfx
+
+
+def game_file(pfx, name):
+    with open(os.path.join(pfx, "drive_c", "Program Files (x86)", "TmNationsForever", name), "rb") as f:
+        return f.read()
+
+
+def shim(served, name):
+    with zipfile.ZipFile(os.path.join(served, name)) as archive:
+        return archive.read("ShimRun.exe")
+
+
+def test_tmloader_upgrade_keeps_the_game(prefix, tmp_path, monkeypatch):
+    served = tmp_path / "served"
+    served.mkdir()
+    write_tmloader_zip(str(served / "v1.zip"), files=10)
+    write_tmloader_zip(str(served / "v2.zip"), files=11)
+    assert shim(served, "v1.zip") != shim(served, "v2.zip")
+    with StaticServer(str(served)) as server:
+        tm = TrackMania(pfx=prefix)
+        monkeypatch.setattr(trackmania, "TMLOADER_URL", server.url("v1.zip"))
+        tm.install_modloader()
+        assert game_file(prefix, "TmForever.exe") == shim(served, "v1.zip")
+        assert game_file(prefix, "TmForever.bak.exe") == GAME
+
+        monkeypatch.setattr(trackmania, "TMLOADER_URL", server.url("v2.zip"))
+        tm.install_modloader()
+        assert game_file(prefix, "TmForever.exe") == shim(served, "v2.zip")
+        assert game_file(prefix, "TmForever.bak.exe") == GAME
+
+        # Running it again changes nothing
+        tm.install_modloader()
+        assert tm.install_report["written"] == 0
+        assert game_file(prefix, "TmForever.exe") == shim(served, "v2.zip")
+        assert game_file(prefix, "TmForever.bak.exe") == GAME
+
+
+def test_dedupe_track_reads_only_new_headers(prefix, tmp_path, monkeypatch):
+    import gbx
+    reads = []
+
+    def read_header(path):
+        reads.append(os.path.basename(path))
+        with open(path, "rb") as f:
+            return {"uid": f.read().decode()}
+
+    monkeypatch.setattr(gbx, "try_read_header", read_header)
+    folder = tmp_path / "tracks"
+    folder.mkdir()
+    for i in range(300):
+        (folder / f"track{i}.Challenge.Gbx").write_text(f"uid{i}")
+    tm = TrackMania(pfx=prefix)
+
+    (folder / "new0.Challenge.Gbx").write_text("new0")
+    tm._dedupe_track(str(folder / "new0.Challenge.Gbx"))
+    assert len(reads) == 301
+
+    for i in range(1, 6):
+        reads.clear()
+        (folder / f"new{i}.Challenge.Gbx").write_text(f"new{i}")
+        assert tm._dedupe_track(str(folder / f"new{i}.Challenge.Gbx")) == str(folder / f"new{i}.Challenge.Gbx")
+        assert reads == [f"new{i}.Challenge.Gbx"]
+
+    # A file changed behind our back is read again; a duplicate under another name is dropped
+    (folder / "track7.Challenge.Gbx").write_text("changed7")
+    (folder / "copy.Challenge.Gbx").write_text("uid8")
+    reads.clear()
+    assert tm._dedupe_track(str(folder / "copy.Challenge.Gbx")) == str(folder / "track8.Challenge.Gbx")
+    assert sorted(reads) == ["copy.Challenge.Gbx", "track7.Challenge.Gbx"]
+    assert not (folder / "copy.Challenge.Gbx").exists()
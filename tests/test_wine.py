@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+import time
+
+from conftest import ROOT
+from wine import WineServer
+
+
+def write_wineserver(tmp_path):
+    """A wineserver that logs its arguments and, like a persistent one, never returns from -w."""
+    path = tmp_path / "wineserver"
+    path.write_text(f'#!/bin/sh\necho "$@" >> {tmp_path}/calls\n[ "$1" = "-w" ] && sleep 1000\nexit 0\n')
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_prewarmed_server_has_finite_persistence_and_stops_without_w(tmp_path):
+    server = WineServer(str(tmp_path), write_wineserver(tmp_path), persist=30)
+    assert server.start()
+    start = time.monotonic()
+    server.stop()
+    assert time.monotonic() - start < 5
+    assert (tmp_path / "calls").read_text().split("\n")[:2] == ["-p30", "-k"]
+
+
+def test_process_with_prewarmed_server_exits(tmp_path):
+    env = dict(os.environ, WINESERVER=write_wineserver(tmp_path), WINEPREFIX=str(tmp_path))
+    code = ("from trackmania import TrackMania\n"
+            f"tm = TrackMania(pfx={str(tmp_path)!r}, detect=False)\n"
+            "assert tm.prewarm_wineserver().start()\n")
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, timeout=20, check=True)
+    assert "-w" not in (tmp_path / "calls").read_text().split()
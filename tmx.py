@@ -0,0 +1,257 @@
+"""Local catalog of TrackMania Exchange track metadata
+
+Lookups go to the exchange's API in batches of up to ``BATCH_SIZE`` tracks and are stored in SQLite.
+Entries younger than ``ttl`` are answered locally; older ones are revalidated with the ETag and
+Last-Modified of the batch they came in, so an unchanged batch costs one 304. Searching only reads
+the local database, and lookups fall back to what is stored when the exchange cannot be reached.
+"""
+import http.client
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from cache import get_cache_dir
+from downloader import DownloadError, get_downloader
+
+API_URLS = {
+    "nations": "https://nations.tm-exchange.com/api/tracks",
+    "united": "https://tmuf.exchange/api/tracks",
+}
+FIELDS = ("TrackId", "TrackName", "Uploader.Name", "Environment", "AuthorTime", "UpdatedAt")
+# TMX environment IDs
+ENVIRONMENTS = {1: "Snow", 2: "Desert", 3: "Rally", 4: "Island", 5: "Coast", 6: "Bay", 7: "Stadium"}
+BATCH_SIZE = 50
+DEFAULT_TTL = 7 * 24 * 60 * 60
+MAX_REQUESTS = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    site TEXT NOT NULL,
+    track_id INTEGER NOT NULL,
+    name TEXT,
+    author TEXT,
+    environment TEXT,
+    author_time INTEGER,
+    updated TEXT,
+    missing INTEGER NOT NULL DEFAULT 0,
+    batch TEXT,
+    fetched REAL,
+    PRIMARY KEY (site, track_id)
+);
+CREATE TABLE IF NOT EXISTS batches (
+    key TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_batch ON tracks (batch);
+CREATE INDEX IF NOT EXISTS tracks_name ON tracks (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_author ON tracks (author COLLATE NOCASE);
+"""
+
+
+def site_name(united):
+    return "united" if united else "nations"
+
+
+def batch_key(site, track_ids):
+    return site + ":" + ",".join(str(track_id) for track_id in track_ids)
+
+
+def parse_batch_key(key):
+    site, _, ids = key.partition(":")
+    return site, [int(track_id) for track_id in ids.split(",")]
+
+
+def _track_row(track):
+    """``(track_id, name, author, environment, author_time, updated)`` from one API result."""
+    uploader = track.get("Uploader")
+    environment = track.get("Environment")
+    if isinstance(environment, int):
+        environment = ENVIRONMENTS.get(environment, str(environment))
+    return (int(track["TrackId"]), track.get("TrackName"),
+            uploader.get("Name") if isinstance(uploader, dict) else uploader,
+            environment, track.get("AuthorTime"), track.get("UpdatedAt"))
+
+
+class TrackCatalog:
+    """Track metadata from both exchanges, cached in ``db_path`` (default: the cache dir).
+
+    ``api_urls`` overrides ``API_URLS``, e.g. to point at a local stand-in server.
+    """
+    def __init__(self, db_path=None, api_urls=None, ttl=DEFAULT_TTL, downloader=None):
+        self.db_path = db_path or os.path.join(get_cache_dir("tmx"), "tracks.sqlite3")
+        self.api_urls = api_urls or API_URLS
+        self.ttl = ttl
+        self.downloader = downloader
+        self.db = sqlite3.connect(self.db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, track_ids, united=False, offline=False):
+        """``{track_id: row}`` for every ID; the row is None for tracks the exchange does not have
+        (or, offline, that were never looked up)."""
+        track_ids = list(dict.fromkeys(int(track_id) for track_id in track_ids))
+        if not offline:
+            self.refresh(track_ids, united)
+        rows = self._rows(site_name(united), track_ids)
+        return {track_id: self._public(rows[track_id]) if track_id in rows and not rows[track_id]["missing"] else None
+                for track_id in track_ids}
+
+    def prefetch(self, tracks, force=False):
+        """Refresh ``(track_id, united)`` pairs (as from ``tracks.parse_track_list``); returns the stats."""
+        stats = {}
+        for united in (False, True):
+            track_ids = [track_id for track_id, is_united in tracks if is_united == united]
+            if track_ids:
+                for name, value in self.refresh(track_ids, united, force).items():
+                    stats[name] = stats.get(name, 0) + value
+        return stats
+
+    def refresh(self, track_ids, united=False, force=False):
+        """Fetch the metadata of tracks not stored yet and revalidate those older than the TTL."""
+        start = time.perf_counter()
+        site = site_name(united)
+        track_ids = list(dict.fromkeys(int(track_id) for track_id in track_ids))
+        now = time.time()
+        rows = self._rows(site, track_ids)
+        stale = [track_id for track_id in track_ids
+                 if force or track_id not in rows or now - rows[track_id]["fetched"] >= self.ttl]
+
+        # Tracks fetched before are revalidated with their whole batch, new ones go in new batches
+        keys = list(dict.fromkeys(rows[track_id]["batch"] for track_id in stale
+                                  if track_id in rows and rows[track_id]["batch"]))
+        new_ids = sorted(track_id for track_id in stale if track_id not in rows or not rows[track_id]["batch"])
+        keys += [batch_key(site, new_ids[i:i + BATCH_SIZE]) for i in range(0, len(new_ids), BATCH_SIZE)]
+
+        validators = {}
+        for key in keys:
+            row = self.db.execute("SELECT etag, last_modified FROM batches WHERE key = ?", (key,)).fetchone()
+            if row is not None and not force:
+                validators[key] = (row["etag"], row["last_modified"])
+
+        stats = {"tracks": len(track_ids), "cached": len(track_ids) - len(stale), "requests": len(keys),
+                 "fetched": 0, "not_modified": 0, "missing": 0, "failed": 0}
+        if keys:
+            with ThreadPoolExecutor(max_workers=min(MAX_REQUESTS, len(keys))) as pool:
+                results = list(pool.map(lambda key: self._request(key, validators.get(key)), keys))
+            with self.db:
+                for key, result in zip(keys, results):
+                    self._store(key, result, now, stats)
+                self.db.execute("DELETE FROM batches WHERE key NOT IN (SELECT DISTINCT batch FROM tracks "
+                                "WHERE batch IS NOT NULL)")
+        stats["seconds"] = time.perf_counter() - start
+        return stats
+
+    def search(self, text=None, author=None, environment=None, min_time=None, max_time=None, united=None,
+               limit=100):
+        """Stored tracks whose name (or author) contains ``text``, by author, environment and author
+        time in milliseconds. Never goes to the network."""
+        clauses = ["missing = 0"]
+        params = []
+        if text:
+            clauses.append("(name LIKE ? OR author LIKE ?)")
+            params += [f"%{text}%", f"%{text}%"]
+        if author:
+            clauses.append("author = ? COLLATE NOCASE")
+            params.append(author)
+        if environment:
+            clauses.append("environment = ? COLLATE NOCASE")
+            params.append(environment)
+        if min_time is not None:
+            clauses.append("author_time >= ?")
+            params.append(min_time)
+        if max_time is not None:
+            clauses.append("author_time <= ?")
+            params.append(max_time)
+        if united is not None:
+            clauses.append("site = ?")
+            params.append(site_name(united))
+        params.append(limit)
+        cursor = self.db.execute(f"SELECT * FROM tracks WHERE {' AND '.join(clauses)} "
+                                 "ORDER BY name COLLATE NOCASE, track_id LIMIT ?", params)
+        return [self._public(row) for row in cursor]
+
+    def _request(self, key, validators):
+        """``(status, tracks, etag, last_modified)`` of one batch; ``tracks`` is None on a 304."""
+        site, track_ids = parse_batch_key(key)
+        url = self.api_urls[site] + "?" + urlencode({"fields": ",".join(FIELDS),
+                                                    "id": ",".join(map(str, track_ids)),
+                                                    "count": len(track_ids)})
+        headers = {"Accept": "application/json"}
+        if validators:
+            etag, last_modified = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        try:
+            response = (self.downloader or get_downloader()).request(url, headers)
+            try:
+                body = response.read()
+            except BaseException:
+                # A half-read response leaves the connection unusable; never hand it back to the pool
+                response.conn.close()
+                raise
+            response.release()
+            if response.status == 304:
+                return 304, None, None, None
+            if response.status != 200:
+                raise DownloadError(f"HTTP {response.status} for {url}", response.status)
+            data = json.loads(body)
+            tracks = data.get("Results", []) if isinstance(data, dict) else data
+            return 200, tracks, response.header("ETag"), response.header("Last-Modified")
+        except (DownloadError, OSError, http.client.HTTPException, ValueError) as e:
+            print(f"TMX lookup of {len(track_ids)} tracks failed: {e}")
+            return None, None, None, None
+
+    def _store(self, key, result, now, stats):
+        status, tracks, etag, last_modified = result
+        site, track_ids = parse_batch_key(key)
+        if status is None:
+            stats["failed"] += len(track_ids)
+        elif status == 304:
+            stats["not_modified"] += self.db.execute("UPDATE tracks SET fetched = ? WHERE batch = ?",
+                                                     (now, key)).rowcount
+        else:
+            found = set()
+            for track in tracks:
+                row = _track_row(track)
+                found.add(row[0])
+                self.db.execute("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                                (site, *row, key, now))
+            # Remember tracks the exchange does not have, so they are not asked for again until the TTL
+            missing = [track_id for track_id in track_ids if track_id not in found]
+            self.db.executemany("INSERT OR REPLACE INTO tracks (site, track_id, missing, batch, fetched) "
+                                "VALUES (?, ?, 1, ?, ?)", [(site, track_id, key, now) for track_id in missing])
+            self.db.execute("INSERT OR REPLACE INTO batches VALUES (?, ?, ?)", (key, etag, last_modified))
+            stats["fetched"] += len(found)
+            stats["missing"] += len(missing)
+
+    def _rows(self, site, track_ids):
+        rows = {}
+        for i in range(0, len(track_ids), 500):
+            chunk = track_ids[i:i + 500]
+            cursor = self.db.execute(f"SELECT * FROM tracks WHERE site = ? AND track_id IN "
+                                     f"({','.join('?' * len(chunk))})", (site, *chunk))
+            rows.update((row["track_id"], row) for row in cursor)
+        return rows
+
+    @staticmethod
+    def _public(row):
+        return {"track_id": row["track_id"], "united": row["site"] == "united", "name": row["name"],
+                "author": row["author"], "environment": row["environment"], "author_time": row["author_time"],
+                "updated": row["updated"], "fetched": row["fetched"]}
+
+
+def format_track(track):
+    author_time = f"{track['author_time'] / 1000:9.3f}s" if track["author_time"] is not None else " " * 10
+    site = "united" if track["united"] else "nations"
+    return (f"{site}:{track['track_id']:<10} {track['name'] or '':40} {track['author'] or '':20} "
+            f"{track['environment'] or '':8} {author_time}")
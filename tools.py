@@ -1,8 +1,21 @@
+import contextlib
+import errno
+import fcntl
+import io
 import os
-import re
 import subprocess
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import wget
+
+from cache import cache_enabled, get_artifact_store
+from downloader import get_downloader
+from registry import get_registry_index
+from tracing import annotate, enabled as tracing_enabled, traced
+from wine import get_wine_supervisor
+
+FICLONE = 0x40049409
 
 class WinePrefixNotFoundError(Exception):
     def __init(self, message = "WINEPREFIX env variable is not set!"):
@@ -13,19 +26,41 @@ class WineNotFoundError(Exception):
         self.message = message
         super().__init__(self.message)
 
-def run_wine(exe_path: Path, args=None, extra_env=None) -> int:
+@traced("tools.start_wine")
+def start_wine(exe_path: Path, args=None, extra_env=None, pfx=None, wine=None):
+    """Launch an executable with wine in the background and return its WineProcess handle.
+
+    ``pfx`` and ``wine`` default to $WINEPREFIX and $WINE.
+    """
     if args is None:
         args = []
     env = os.environ.copy()
-    wine = env.get("WINE")
+    wine = wine or env.get("WINE")
     if extra_env:
         env.update(extra_env)
+    if pfx:
+        env["WINEPREFIX"] = pfx
     if not wine or not Path(wine).is_file():
         raise WineNotFoundError()
     wp = env.get("WINEPREFIX")
     if wp and not Path(wp).exists():
         raise WinePrefixNotFoundError()
-    return subprocess.call([wine, str(exe_path)] + args, env=env, cwd=os.path.dirname(exe_path))
+    process = get_wine_supervisor().start([wine, str(exe_path)] + args, env=env, cwd=os.path.dirname(exe_path),
+                                          name=Path(exe_path).name)
+    annotate(exe=Path(exe_path).name, pid=process.pid, spawn_seconds=process.spawn_seconds)
+    return process
+
+@traced("tools.run_wine")
+def run_wine(exe_path: Path, args=None, extra_env=None, timeout=None, pfx=None, wine=None) -> int:
+    """Run an executable with wine and wait for it; its output is kept in the supervisor's buffer."""
+    process = start_wine(exe_path, args, extra_env, pfx=pfx, wine=wine)
+    try:
+        return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        raise
+    finally:
+        annotate(exe=Path(exe_path).name, returncode=process.returncode, wine_seconds=process.duration)
 
 def run_windows(exe_path: str) -> int:
     if exe_path[:2] == "C:\\":
@@ -38,25 +73,10 @@ def run_windows(exe_path: str) -> int:
         raise WinePrefixNotFoundError()
     return run_wine(Path(pfx + exe_path))
 
+@traced("tools.find_registry_value")
 def find_registry_value(reg_file_path, key_pattern, value_name):
-    key_regex = re.compile(r'^\[' + re.escape(key_pattern) + r'\]')
-    value_regex = re.compile(rf'^"{re.escape(value_name)}"="(.+)"')
-
-    in_target_key = False
-    with open(reg_file_path, "r", encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            line = line.strip()
-            if key_regex.match(line):
-                in_target_key = True
-                continue
-            if in_target_key:
-                if line.startswith("["):
-                    in_target_key = False
-                    continue
-                match = value_regex.match(line)
-                if match:
-                    return match.group(1)
-    return None
+    annotate(reg=os.path.basename(reg_file_path), value=value_name)
+    return get_registry_index(reg_file_path).get(key_pattern, value_name)
 
 def path_reg_drive_c(file_name, folder=None):
     if folder is None:
@@ -73,7 +93,7 @@ def windows_path_to_linux_path(windows_path, pfx=None):
     if windows_path is None:
         return None
     if pfx is None:
-        os.environ.get("WINEPREFIX")
+        pfx = os.environ.get("WINEPREFIX")
     windows_path = windows_path.replace('\\\"', "")
     path = windows_path[2:].replace("\\\\", "/")
     return pfx + "/drive_c" + path
@@ -84,13 +104,200 @@ def get_wine_prefix():
 def get_wine_executable():
     return os.environ.get("WINE")
 
-def get_drive_c():
-    return get_wine_prefix() + "/drive_c"
+def get_drive_c(pfx=None):
+    return (pfx or get_wine_prefix()) + "/drive_c"
 
-def download_file(url, folder=None):
+@traced("tools.download_file")
+def download_file(url, folder=None, sha256=None, size=None, progress=None, cache=True, link=False):
     if folder is None:
         folder = get_drive_c()
-    return wget.download(url, folder)
+    progress, received = _count_bytes(progress)
+    if cache and cache_enabled():
+        path = get_artifact_store().fetch(url, folder, sha256=sha256, size=size, progress=progress, link=link)
+    else:
+        path = get_downloader().fetch(url, folder, sha256=sha256, size=size, progress=progress).path
+    annotate(url=url, bytes=received[0], size=os.path.getsize(path))
+    return path
+
+@traced("tools.fetch_bytes")
+def fetch_bytes(url, sha256=None, size=None, progress=None, cache=True):
+    progress, received = _count_bytes(progress)
+    if cache and cache_enabled():
+        data = get_artifact_store().fetch_bytes(url, sha256=sha256, size=size, progress=progress)
+    else:
+        data = get_downloader().fetch_bytes(url, sha256=sha256, size=size, progress=progress)[0]
+    annotate(url=url, bytes=received[0], size=len(data))
+    return data
+
+def _count_bytes(progress):
+    """Wrap a progress callback to count the bytes actually transferred (nothing for cache hits)."""
+    received = [0]
+    if not tracing_enabled():
+        return progress, received
+
+    def counting(done, total):
+        received[0] = done
+        if progress is not None:
+            progress(done, total)
+    return counting, received
+
+class BufferFile(io.RawIOBase):
+    """Seekable read-only file over a bytes-like object, so zipfile can use it without a copy."""
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, b):
+        chunk = self._view[self._pos:self._pos + len(b)]
+        b[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+@traced("tools.extract_zip")
+def extract_zip(buffer, destination, workers=None):
+    """Extract an in-memory zip archive with a thread pool, returning the number of bytes written."""
+    with zipfile.ZipFile(BufferFile(buffer)) as archive:
+        members = archive.infolist()
+    for member in members:
+        if member.is_dir():
+            Path(destination, member.filename).mkdir(parents=True, exist_ok=True)
+    files = [member for member in members if not member.is_dir()]
+    _create_parents(destination, files)
+    written = _extract_members(buffer, destination, files, workers)
+    annotate(files=len(members), bytes=written)
+    return written
+
+@traced("tools.sync_zip")
+def sync_zip(buffer, destination, manifest, workers=None):
+    """Extract only the members that differ from what ``manifest`` says was extracted last time.
+
+    ``manifest`` maps member names to the CRC and size from the archive and the size and mtime the
+    file had on disk once written; it is updated in place. Members whose CRC and size are unchanged
+    and whose file is untouched are skipped, and files no longer in the archive are removed.
+    Returns ``(bytes_written, bytes_skipped, files_removed)``.
+    """
+    with zipfile.ZipFile(BufferFile(buffer)) as archive:
+        members = archive.infolist()
+    changed = []
+    skipped = 0
+    names = set()
+    for member in members:
+        target = os.path.join(destination, member.filename)
+        if member.is_dir():
+            Path(target).mkdir(parents=True, exist_ok=True)
+            continue
+        names.add(member.filename)
+        known = manifest.get(member.filename)
+        if known is not None and known["crc"] == member.CRC and known["size"] == member.file_size:
+            try:
+                stat = os.stat(target)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and stat.st_size == known["size"] and stat.st_mtime_ns == known["mtime_ns"]:
+                skipped += member.file_size
+                continue
+        changed.append(member)
+
+    removed = 0
+    for name in list(manifest):
+        if name not in names:
+            try:
+                os.remove(os.path.join(destination, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+            del manifest[name]
+
+    _create_parents(destination, changed)
+    written = _extract_members(buffer, destination, changed, workers)
+    for member in changed:
+        stat = os.stat(os.path.join(destination, member.filename))
+        manifest[member.filename] = {"crc": member.CRC, "size": member.file_size, "mtime_ns": stat.st_mtime_ns}
+    annotate(files=len(changed), bytes=written, skipped_bytes=skipped, removed=removed)
+    return written, skipped, removed
+
+def _create_parents(destination, files):
+    """Create the folders of ``files`` up front; archives without directory entries would otherwise have
+    the extraction threads race to create them (zipfile checks, then calls os.makedirs)."""
+    root = os.path.abspath(destination)
+    for member in files:
+        parent = os.path.dirname(os.path.abspath(os.path.join(root, member.filename)))
+        # Names escaping the destination are left to zipfile, which sanitises them
+        if parent == root or parent.startswith(root + os.sep):
+            os.makedirs(parent, exist_ok=True)
+
+def _extract_members(buffer, destination, files, workers=None):
+    if not files:
+        return 0
+
+    workers = workers or min(8, os.cpu_count() or 1, len(files))
+    # Every worker gets its own ZipFile, they share nothing but the underlying buffer
+    batches = [files[i::workers] for i in range(workers)]
+
+    def extract(batch):
+        with zipfile.ZipFile(BufferFile(buffer)) as archive:
+            for member in batch:
+                archive.extract(member, destination)
+        return sum(member.file_size for member in batch)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(extract, batches))
+
+def write_if_changed(path, data: bytes):
+    """Write ``data`` to ``path`` unless it already holds exactly that; returns whether it wrote."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(data) + 1) == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+def reflink(source, destination):
+    """Clone ``source`` into a new file with the FICLONE ioctl; False if the filesystem cannot."""
+    with open(source, "rb") as src:
+        dst = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            fcntl.ioctl(dst, FICLONE, src.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM):
+                raise
+            return False
+        finally:
+            os.close(dst)
+
+@contextlib.contextmanager
+def timed(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
 
 def get_home_path(pfx=None):
     if pfx is None:
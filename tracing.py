@@ -0,0 +1,226 @@
+"""Timing spans around TrackMania operations, exported as Chrome trace events
+
+Tracing is off unless ``enable`` is called (gui.py --trace FILE) or TM_TRACE is set, either to the
+trace file or to 1 for one in the cache dir. While it is off, ``span`` returns a shared no-op object
+and ``traced`` functions cost one extra call. At exit the trace is written and a summary printed;
+open the file in ui.perfetto.dev or chrome://tracing.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import types
+
+TRACE_ENV = "TM_TRACE"
+
+_tracer = None
+_local = threading.local()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        _stack().append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        _stack().pop()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.start, end, self.args)
+        return False
+
+    def set(self, **args):
+        """Attach values (bytes transferred, exit codes...) to the span."""
+        self.args.update(args)
+
+
+class Tracer:
+    def __init__(self, path=None):
+        self.path = path
+        self.pid = os.getpid()
+        self.origin = time.perf_counter_ns()
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end, args, tid=None, thread_name=None):
+        """Add a finished span; ``start`` and ``end`` are perf_counter_ns() values."""
+        if tid is None:
+            thread = threading.current_thread()
+            tid, thread_name = thread.ident, thread.name
+        event = {"name": name, "cat": name.partition(".")[0], "ph": "X", "pid": self.pid, "tid": tid,
+                 "ts": (start - self.origin) / 1000, "dur": (end - start) / 1000, "args": args}
+        with self._lock:
+            self.events.append(event)
+            self.threads.setdefault(tid, thread_name)
+
+    def chrome_trace(self):
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in threads.items()]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+    def write(self, path=None):
+        path = path or self.path
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def summary(self):
+        """``{name: {count, total, self, max, bytes}}`` in seconds; ``self`` excludes nested spans."""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: (event["tid"], event["ts"], -event["dur"]))
+        rows = {}
+        stacks = {}
+        for event in events:
+            row = rows.setdefault(event["name"], {"count": 0, "total": 0.0, "self": 0.0, "max": 0.0, "bytes": 0})
+            row["count"] += 1
+            row["total"] += event["dur"] / 1e6
+            row["self"] += event["dur"] / 1e6
+            row["max"] = max(row["max"], event["dur"] / 1e6)
+            row["bytes"] += event["args"].get("bytes") or 0
+            stack = stacks.setdefault(event["tid"], [])
+            while stack and stack[-1]["ts"] + stack[-1]["dur"] <= event["ts"]:
+                stack.pop()
+            if stack:
+                rows[stack[-1]["name"]]["self"] -= event["dur"] / 1e6
+            stack.append(event)
+        return rows
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def enabled():
+    return _tracer is not None
+
+
+def enable(path=None):
+    """Start recording spans; the trace goes to ``path`` (default: the cache dir) at exit."""
+    global _tracer
+    if _tracer is None:
+        if path is None:
+            from cache import get_cache_dir
+            path = os.path.join(get_cache_dir("traces"), time.strftime("trace-%Y%m%d-%H%M%S.json"))
+        _tracer = Tracer(path)
+        atexit.register(_finish)
+    elif path is not None:
+        _tracer.path = path
+    return _tracer
+
+
+def disable():
+    """Stop recording and return the tracer with what was recorded."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def span(name, **args):
+    """``with span("tools.download_file", url=url) as s: ... s.set(bytes=n)``"""
+    if _tracer is None:
+        return NULL_SPAN
+    return Span(_tracer, name, args)
+
+
+def annotate(**args):
+    """Attach values to the innermost span open in this thread, e.g. from inside a traced function."""
+    if _tracer is None:
+        return
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].args.update(args)
+
+
+def add_span(name, start, end, lane=None, **args):
+    """Record a span measured elsewhere with time.monotonic() (e.g. a wine process' lifetime).
+
+    ``lane`` is a ``(tid, name)`` pair to show it on its own track instead of the current thread's.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return
+    offset = time.perf_counter_ns() - time.monotonic_ns()
+    tid, thread_name = lane or (None, None)
+    tracer.record(name, int(start * 1e9) + offset, int(end * 1e9) + offset, args, tid, thread_name)
+
+
+def traced(name=None):
+    """Decorator wrapping every call of a function in a span named ``name`` (default: module.function)."""
+    def decorator(function):
+        span_name = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with Span(_tracer, span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(cls):
+    """Class decorator: trace every public method defined on ``cls``."""
+    for attribute, value in list(vars(cls).items()):
+        if not attribute.startswith("_") and isinstance(value, types.FunctionType):
+            setattr(cls, attribute, traced(f"{cls.__name__}.{attribute}")(value))
+    return cls
+
+
+def format_summary(rows):
+    lines = [f"{'span':45} {'count':>6} {'total':>10} {'self':>10} {'max':>10} {'MiB':>8}"]
+    for name, row in sorted(rows.items(), key=lambda item: -item[1]["total"]):
+        lines.append(f"{name:45} {row['count']:6} {row['total'] * 1000:8.1f}ms {row['self'] * 1000:8.1f}ms "
+                     f"{row['max'] * 1000:8.1f}ms {row['bytes'] / 1048576:8.2f}")
+    return "\n".join(lines)
+
+
+def _finish():
+    tracer = _tracer
+    if tracer is None or not tracer.events:
+        return
+    try:
+        path = tracer.write()
+    except OSError as e:
+        print(f"Could not write the trace: {e}")
+        return
+    print(format_summary(tracer.summary()))
+    print(f"Trace written to {path}")
+
+
+if os.environ.get(TRACE_ENV, "") not in ("", "0"):
+    enable(None if os.environ[TRACE_ENV] == "1" else os.environ[TRACE_ENV])
@@ -1,13 +1,27 @@
-"""TrackMania Specific functions"""
+"""TrackMania Specific functions
+
+Subsystems that are only needed by some commands (YAML, track queue, Gbx reader, library, replays)
+are imported inside the methods using them to keep start-up of the gui binary fast.
+"""
+import filecmp
+import json
 import os
 import shutil
-import zipfile
+import threading
+import time
+import zlib
 from pathlib import Path
 
 from tools import find_through_uninstaller, windows_path_to_linux_path, get_wine_prefix, get_wine_executable, run_wine, \
-    download_file, get_home_path
+    start_wine, download_file, get_home_path, fetch_bytes, sync_zip, timed
 from urllib.parse import quote
-import yaml
+from cache import cache_enabled
+from configstore import get_config_store
+from tracing import trace_methods
+from wine import PREWARM_PERSIST, WineServer, wait_for_windows_process
+
+
+TMLOADER_URL = "https://tomashu.pages.dev/modloader/modloader/TMLoader-1.0.1-win32.zip"
 
 
 class TrackManiaForeverNotFoundError(Exception):
@@ -34,86 +48,307 @@ def determine_united(pfx: str)-> tuple[bool, str, str]:
             return False, nations, get_home_path(pfx) + "/Documents/TmForever"
         raise TrackManiaForeverNotFoundError()
 
+INSTALL_MANIFEST = ".tm-install.json"
+
+
+def load_install_manifest(tmloader_path):
+    try:
+        with open(tmloader_path + INSTALL_MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == 1:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": 1, "url": None, "files": {}}
+
+
+def file_crc32(path):
+    """The CRC-32 of a file, as zip archives (and so the install manifest) record it."""
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def save_install_manifest(tmloader_path, manifest):
+    tmp_path = tmloader_path + INSTALL_MANIFEST + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, tmloader_path + INSTALL_MANIFEST)
+
+
+@trace_methods
 class TrackMania:
-    def __init__(self, path=None, united=None, wine_path=None, pfx=None):
+    def __init__(self, path=None, united=None, wine_path=None, pfx=None, detect=True, prewarm=None,
+                 measure_launch=None):
         self.path = path
         self.united = united
         self.pfx = pfx
         self.wine_path = wine_path
-
+        self.documents_folder = None
+        self.tmloader_path = None
+        self.uvme_uninstaller = None
+        self.detected = threading.Event()
+        self.watcher = None
+        self._given = (path, united)
 
         if self.pfx is None:
             self.pfx = get_wine_prefix()
         if self.wine_path is None:
             self.wine_path = get_wine_executable()
-        if self.path is None:
-            self.united, self.path, self.documents_folder = determine_united(self.pfx)
-        if self.united is None:
-            raise TrackManiaUndefinedGameVersionError
 
-        self.tmloader_path = None
-        self._check_for_tmloader()
+        self._profiles = None
+
+        # Opt-in: keep a wineserver running ahead of the launch, and time click-to-game-window
+        self.prewarm = os.environ.get("TM_WINE_PREWARM") == "1" if prewarm is None else prewarm
+        self.measure_launch = os.environ.get("TM_MEASURE_LAUNCH") == "1" if measure_launch is None else measure_launch
+        self.wineserver = None
+        self.launch_timings = []
+
+        self._track_folder = None
+        self._track_entries = {}
+        self._track_uids = {}
+        self._track_uids_mtime = None
+        self._track_uids_lock = threading.Lock()
+
+        if detect:
+            self.detect()
+
+    def detect(self):
+        """Find the game, TMLoader and UVME in the prefix. Run it in the background with detect=False.
+
+        The registry lookups are skipped when system.reg is unchanged since the last detection.
+        """
+        from detection import load_detection, save_detection
+        if not load_detection(self):
+            if self.path is None:
+                self.united, self.path, self.documents_folder = determine_united(self.pfx)
+            elif self.documents_folder is None:
+                self.documents_folder = get_home_path(self.pfx) + "/Documents/TmForever"
+            if self.united is None:
+                raise TrackManiaUndefinedGameVersionError
+            self.is_uvme_installed()
+            save_detection(self)
 
-        self.uvme_uninstaller = None
+        self._check_for_tmloader()
+        self.detected.set()
+
+    def redetect_game(self):
+        """Read the game's path, edition and UVME from the registry again, e.g. after system.reg changed."""
+        from detection import save_detection
+        path, united = self._given
+        if path is None:
+            try:
+                self.united, self.path, self.documents_folder = determine_united(self.pfx)
+            except TrackManiaForeverNotFoundError:
+                self.united, self.path = united, None
+                return
         self.is_uvme_installed()
-
+        save_detection(self)
+
+    def watch(self, on_change=None):
+        """Keep the detection results current with inotify; ``on_change(parts)`` is called after an update.
+
+        Returns the DetectionWatcher, or None where inotify is not available.
+        """
+        if self.watcher is None:
+            from detection import DetectionWatcher
+            try:
+                self.watcher = DetectionWatcher(self, on_change).start()
+            except OSError as e:
+                print(f"Not watching {self.pfx} for changes: {e}")
+                return None
+        return self.watcher
+
+    def stop_watching(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            if self._profiles is not None:
+                self._profiles.listing_watched = False
 
     def install_modloader(self):
-        modloader_download = download_file("https://tomashu.pages.dev/modloader/modloader/TMLoader-1.0.1-win32.zip", self.pfx)
-
-        self.tmloader_path = self.pfx + "/drive_c/Program Files/TMLoader/"
-        with zipfile.ZipFile(modloader_download, "r") as zip:
-            zip.extractall(self.tmloader_path)
+        """Install or update TMLoader, only writing what changed since the last install.
 
-        settings_path = self.tmloader_path + "database/TmForever/products/TmForever"
-        Path(settings_path).mkdir(parents=True, exist_ok=True)
+        The install manifest records every extracted file, so re-running it (or upgrading to a
+        new TMLoader) skips identical files, and the TmForever.exe shim swap is safe to repeat.
+        """
+        timings = {}
+        report = {"written": 0, "skipped": 0, "removed": 0}
+        with timed(timings, "fetch"):
+            archive = fetch_bytes(TMLOADER_URL)
 
-        with open(settings_path + "/settings.yaml", "w") as f:
-            path = "C:/Program Files (x86)/TmNationsForever"
-            if self.united:
-                path = "C:/Program Files (x86)/TmUnitedForever"
-            yaml.safe_dump({"install": path}, f)
+        self.tmloader_path = self.pfx + "/drive_c/Program Files/TMLoader/"
+        Path(self.tmloader_path).mkdir(parents=True, exist_ok=True)
+        manifest = load_install_manifest(self.tmloader_path)
+        # The shim of the previous install, which sync_zip is about to replace
+        previous_shim = manifest["files"].get("ShimRun.exe")
+        if previous_shim is not None and previous_shim["crc"] not in manifest.setdefault("shims", []):
+            manifest["shims"].append(previous_shim["crc"])
+        if manifest.get("url") != TMLOADER_URL:
+            print(f"Installing TMLoader from {TMLOADER_URL}")
+        with timed(timings, "extract"):
+            written, skipped, removed = sync_zip(archive, self.tmloader_path, manifest["files"])
+        del archive
+        report["written"] += written
+        report["skipped"] += skipped
+        report["removed"] += removed
+        manifest["url"] = TMLOADER_URL
+
+        with timed(timings, "config"):
+            store = get_config_store()
+            writes = store.stats["writes"]
+            # One atomic write per file that changed, and one save of the profile cache
+            with store.batch():
+                settings_changed = self.write_tmloader_settings()
+                profiles_changed = self.create_default_profiles()
+            report["config_writes"] = store.stats["writes"] - writes
+            self._account(report, settings_changed, self._settings_path())
+            folder = self.tmloader_path + "database/TmForever/profiles/"
+            for name, changed in profiles_changed.items():
+                self._account(report, changed, folder + name + ".yaml")
+
+        with timed(timings, "shim"):
+            self._account(report, self._swap_shim(manifest), self.path + "TmForever.exe")
+        save_install_manifest(self.tmloader_path, manifest)
 
-        os.remove(modloader_download)
+        self._check_for_tmloader()
+        self.install_timings = timings
+        self.install_report = report
+        print(f"TMLoader installed in {sum(timings.values()):.2f}s: {report['written']} bytes written, "
+              f"{report['skipped']} bytes skipped, {report['removed']} files removed, "
+              f"{report['config_writes']} config files written ("
+              + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()) + ")")
+        return timings
+
+    @staticmethod
+    def _account(report, changed, path):
+        report["written" if changed else "skipped"] += os.path.getsize(path)
+
+    def _swap_shim(self, manifest=None):
+        """Put ShimRun.exe in place of TmForever.exe, keeping the game as TmForever.bak.exe.
+
+        Safe to run again: a shim that is already in place is left alone, and a TmForever.exe that
+        is neither a shim nor the backup (e.g. after a game patch) becomes the new backup. The CRCs of
+        every shim installed are kept in ``manifest["shims"]``, so after a TMLoader upgrade the old
+        shim is replaced rather than taken for the game.
+        """
+        exe = self.path + "TmForever.exe"
+        backup = self.path + "TmForever.bak.exe"
+        shim = self.tmloader_path + "ShimRun.exe"
+        shims = manifest.setdefault("shims", []) if manifest is not None else []
+        shim_crc = file_crc32(shim)
+        if shim_crc not in shims:
+            shims.append(shim_crc)
+        if os.path.exists(exe):
+            if filecmp.cmp(exe, shim, shallow=False):
+                return False
+            if file_crc32(exe) not in shims and (not os.path.exists(backup)
+                                                 or not filecmp.cmp(exe, backup, shallow=False)):
+                os.replace(exe, backup)
+        shutil.copy(shim, exe)
+        return True
+
+    def _settings_path(self):
+        return self.tmloader_path + "database/TmForever/products/TmForever/settings.yaml"
+
+    def write_tmloader_settings(self):
+        """Point TMLoader at the game; returns whether settings.yaml had to be written."""
+        Path(os.path.dirname(self._settings_path())).mkdir(parents=True, exist_ok=True)
+
+        import yaml
+        path = "C:/Program Files (x86)/TmNationsForever"
+        if self.united:
+            path = "C:/Program Files (x86)/TmUnitedForever"
+        return get_config_store().write(self._settings_path(), yaml.safe_dump({"install": path}).encode())
 
+    def create_default_profiles(self):
+        """Write the default profiles; returns ``{name: written}``."""
         Path(self.tmloader_path + "database/TmForever/profiles").mkdir(parents=True, exist_ok=True)
-        self.create_tmloader_profile("default", ["TMUnlimiter", "Competition Patch", "CoreMod"])
-        self.create_tmloader_profile("comp", ["Competition Patch", "CoreMod"])
-        self.create_tmloader_profile("tminterface", ["TMUnlimiter", "TMInterface", "CoreMod"])
-
-        os.rename(self.path + "TmForever.exe", self.path + "TmForever.bak.exe")
-        shutil.copy(self.tmloader_path + "ShimRun.exe", self.path + "TmForever.exe")
+        with get_config_store().batch():
+            return {
+                "default": self.create_tmloader_profile("default", ["TMUnlimiter", "Competition Patch", "CoreMod"]),
+                "comp": self.create_tmloader_profile("comp", ["Competition Patch", "CoreMod"]),
+                "tminterface": self.create_tmloader_profile("tminterface", ["TMUnlimiter", "TMInterface", "CoreMod"]),
+            }
 
     def _check_for_tmloader(self):
         path = self.pfx + "/drive_c/Program Files/TMLoader/"
         if os.path.exists(path):
             self.tmloader_path = path
             self.tmloader_config = self.tmloader_path + "config.yaml"
-
-    def start_tmloader_profile(self, profile_name: str):
-        self.start_tmloader(["run", "TmForever", profile_name])
-
-    def start_tmloader(self, args: list = None):
-        run_wine(Path(self.tmloader_path + "TMLoader.exe"), args)
-
-    def start_trackmania(self):
-        run_wine(Path(self.path + "TmForever.exe"))
-
-    def start_launcher(self):
-        run_wine(Path(self.path + "TmForeverLauncher.exe"))
-
-    def start_vanilla(self):
-        run_wine(Path(self.path + "TmForever.bak.exe"))
-
-    def download_uvme(self):
+        else:
+            self.tmloader_path = self.tmloader_config = None
+
+    def start_tmloader_profile(self, profile_name: str, clicked=None, extra_env=None):
+        return self.start_tmloader(["run", "TmForever", profile_name], clicked=clicked, watch="TmForever.exe",
+                                   extra_env=extra_env)
+
+    def start_tmloader(self, args: list = None, clicked=None, watch="TMLoader.exe", extra_env=None):
+        return self._launch(Path(self.tmloader_path + "TMLoader.exe"), args, extra_env, watch=watch, clicked=clicked)
+
+    def start_trackmania(self, clicked=None, extra_env=None):
+        return self._launch(Path(self.path + "TmForever.exe"), extra_env=extra_env, clicked=clicked)
+
+    def start_launcher(self, clicked=None, extra_env=None):
+        return self._launch(Path(self.path + "TmForeverLauncher.exe"), extra_env=extra_env, clicked=clicked)
+
+    def start_vanilla(self, clicked=None, extra_env=None):
+        return self._launch(Path(self.path + "TmForever.bak.exe"), extra_env=extra_env, clicked=clicked)
+
+    def prewarm_wineserver(self, persist=PREWARM_PERSIST):
+        """Start a wineserver for the prefix in the background (the GUI does this during its
+        countdown), so the launches that follow do not pay for it. It exits by itself once the
+        prefix has had no wine process for ``persist`` seconds, so the process can exit at any time."""
+        if self.wineserver is None:
+            self.wineserver = WineServer(self.pfx, persist=persist)
+            self.wineserver.start_in_background()
+        return self.wineserver
+
+    def stop_wineserver(self):
+        """Shut the pre-warmed wineserver down now, after a bounded wait for the wine processes we started."""
+        if self.wineserver is not None:
+            self.wineserver.stop()
+            self.wineserver = None
+
+    def _launch(self, exe_path: Path, args=None, extra_env=None, watch=None, clicked=None):
+        """Run a game executable, timing it from ``clicked`` (a time.monotonic() value) when measuring."""
+        if clicked is None:
+            clicked = time.monotonic()
+        warm = self.wineserver is not None and self.wineserver.ready.is_set()
+        process = start_wine(exe_path, args, extra_env, pfx=self.pfx, wine=self.wine_path)
+        if self.measure_launch:
+            seen = wait_for_windows_process(watch or exe_path.name, timeout=120, alive=lambda: process.running)
+            self._record_launch(exe_path.name, warm, process.spawned - clicked,
+                                None if seen is None else seen - clicked)
+        return process.wait()
+
+    def _record_launch(self, exe, warm, spawn, started):
+        timing = {"time": time.time(), "exe": exe, "warm": warm, "spawn": spawn, "started": started}
+        self.launch_timings.append(timing)
+        if started is None:
+            print(f"Launch of {exe} ({'warm' if warm else 'cold'} wineserver): its window process was not seen")
+        else:
+            print(f"Launch of {exe} ({'warm' if warm else 'cold'} wineserver): {started:.2f}s from click to process start")
+        from cache import get_cache_dir
+        try:
+            with open(os.path.join(get_cache_dir(), "launch-timings.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(timing) + "\n")
+        except OSError:
+            pass
+
+    def download_uvme(self, progress=None):
         url = "https://github.com/AroPix/TrackManiaAssets/releases/download/1.0.0/TmNationsForever_UVME_v3.1.exe"
         if self.united:
             url = "https://github.com/AroPix/TrackManiaAssets/releases/download/1.0.0/TmUnitedForever_UVME_v3.1.exe"
 
-        path = download_file(url)
+        # Run and deleted straight away, so it can share the cached copy's inode
+        path = download_file(url, self.pfx + "/drive_c", progress=progress, link=True)
         print(path)
-        run_wine(Path(path))
+        run_wine(Path(path), pfx=self.pfx, wine=self.wine_path)
         os.remove(path)
+        self.redetect_game()
 
     def is_uvme_installed(self):
         if self.united:
@@ -123,63 +358,153 @@ class TrackMania:
 
     def uninstall_uvme(self):
         if self.uvme_uninstaller:
-            run_wine(Path(self.uvme_uninstaller), ["/SILENT"])
-
-    def download_car_skin(self, url: str, car_type = "CarCommon"):
+            run_wine(Path(self.uvme_uninstaller), ["/SILENT"], pfx=self.pfx, wine=self.wine_path)
+            # The uninstaller removes itself; wine may write the registry only later
+            if not os.path.exists(self.uvme_uninstaller):
+                from detection import save_detection
+                self.uvme_uninstaller = None
+                save_detection(self)
+
+    def download_car_skin(self, url: str, car_type = "CarCommon", progress=None, locator=True):
         skins_folder = self.documents_folder + "/Skins/Vehicles/" +  car_type
-        Path(skins_folder).mkdir(parents=True, exist_ok=True)
-        download = download_file(quote(url, safe=":/?=&"), skins_folder)
-
-        file_name = os.path.dirname(download) + "/" + os.path.basename(download) + ".loc"
-        with open(file_name, "w", encoding="utf-8") as f:
-            f.write(url.replace("https", "http"))
+        return self._install_mod(url, skins_folder, progress, locator)
 
-    def download_track(self, track_id: str, united=False):
+    def tracks_folder(self):
         tracks_folder = self.documents_folder + "/Tracks/Challenges/Downloaded/"
         Path(tracks_folder).mkdir(parents=True, exist_ok=True)
-
-        url = "https://nations.tm-exchange.com/trackgbx/" + track_id
-        if united:
-            url = "https://tmuf.exchange/trackgbx/" + track_id
-        download_file(quote(url, safe=":/?=&"), tracks_folder)
-
-    def download_texture_mod(self, url: str, environment = "Stadium"):
+        return tracks_folder
+
+    def download_track(self, track_id: str, united=False, progress=None):
+        from tracks import track_url
+        path = download_file(quote(track_url(track_id, united), safe=":/?=&"), self.tracks_folder(), progress=progress)
+        return self._dedupe_track(path)
+
+    def _dedupe_track(self, path):
+        """Drop a freshly downloaded track if one with the same map UID is already there, by whatever name."""
+        from gbx import try_read_header
+        header = try_read_header(path)
+        if header is None or not header.get("uid"):
+            return path
+        folder, name = os.path.split(path)
+        with self._track_uids_lock:
+            names = self._downloaded_track_uids(folder, {name: header["uid"]}).setdefault(header["uid"], set())
+            names.discard(name)
+            existing = [other for other in sorted(names) if os.path.exists(os.path.join(folder, other))]
+            if existing:
+                os.remove(path)
+                self._track_entries.pop(name, None)
+                print(f"Track {header['uid']} is already downloaded as {existing[0]}")
+                path = os.path.join(folder, existing[0])
+            else:
+                names.add(name)
+            self._track_uids_mtime = os.stat(folder).st_mtime_ns
+        return path
+
+    def _downloaded_track_uids(self, folder, known=None):
+        """``{uid: {names}}`` of the tracks in ``folder``. Only files that are new or changed since the last
+        scan have their header read; ``known`` maps names to UIDs the caller read already."""
+        from gbx import try_read_header
+        mtime = os.stat(folder).st_mtime_ns
+        if self._track_folder == folder and self._track_uids_mtime == mtime:
+            return self._track_uids
+        previous = self._track_entries if self._track_folder == folder else {}
+        entries, uids = {}, {}
+        with os.scandir(folder) as scan:
+            for entry in scan:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                cached = previous.get(entry.name)
+                if cached is not None and cached[0] == signature:
+                    uid = cached[1]
+                elif known and entry.name in known:
+                    uid = known[entry.name]
+                else:
+                    header = try_read_header(entry.path)
+                    uid = header.get("uid") if header is not None else None
+                entries[entry.name] = (signature, uid)
+                if uid:
+                    uids.setdefault(uid, set()).add(entry.name)
+        self._track_folder = folder
+        self._track_entries = entries
+        self._track_uids = uids
+        self._track_uids_mtime = mtime
+        return uids
+
+    def download_tracks(self, tracks: list, per_host=4, bandwidth=None, retries=3, progress=None):
+        """Download many ``(track_id, united)`` pairs concurrently, skipping ones already downloaded."""
+        from tracks import TrackQueue
+        return TrackQueue(self, per_host=per_host, bandwidth=bandwidth, retries=retries,
+                          progress=progress).download(tracks)
+
+    def library(self):
+        from library import Library
+        return Library(self.documents_folder)
+
+    def analyse_replays(self, workers=None):
+        from replays import analyse as analyse_replays
+        return analyse_replays(self.documents_folder + "/Replays", workers=workers)
+
+    def verify_skins(self, workers=None):
+        """Check every skin and mod archive's CRCs and look for mods that replace the same file."""
+        from skins import SkinIndex
+        return SkinIndex(self.documents_folder).verify(workers=workers)
+
+    def download_texture_mod(self, url: str, environment = "Stadium", progress=None, locator=True):
         texture_mods_folder = self.documents_folder + "/Skins/" +  environment + "/Mod/"
-        Path(texture_mods_folder).mkdir(parents=True, exist_ok=True)
-        download = download_file(quote(url, safe=":/?=&"), texture_mods_folder)
-
-        file_name = os.path.dirname(download) + "/" + os.path.basename(download) + ".loc"
-        with open(file_name, "w", encoding="utf-8") as f:
-            f.write(url.replace("https", "http"))
-
-    def install_twinkietweaks(self):
-        twinkie_path = get_home_path() + "/Documents/Twinkie/Fonts"
+        return self._install_mod(url, texture_mods_folder, progress, locator)
+
+    def _install_mod(self, url, folder, progress=None, locator=True):
+        """Place a skin or mod through the shared mod store (one copy on disk, hardlinked) with its .loc file."""
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        locator_url = url.replace("https", "http") if locator else None
+        if not cache_enabled():
+            download = download_file(quote(url, safe=":/?=&"), folder, progress=progress, cache=False)
+            if locator_url:
+                with open(download + ".loc", "w", encoding="utf-8") as f:
+                    f.write(locator_url)
+            return download
+        from modstore import get_mod_store
+        download = get_mod_store().install(quote(url, safe=":/?=&"), folder, locator_url, progress=progress)
+        if progress:
+            # Already in the store, or the download's last update
+            size = os.path.getsize(download)
+            progress(size, size)
+        return download
+
+    def install_twinkietweaks(self, progress=None, start=True):
+        twinkie_path = get_home_path(self.pfx) + "/Documents/Twinkie/Fonts"
         Path(twinkie_path).mkdir(parents=True, exist_ok=True)
 
         twinkie_font_url = "https://github.com/TwinkieTweaks/TwinkieNSIS/raw/refs/heads/main/Twinkie.ttf"
         maniaicons_font_url = "https://github.com/TwinkieTweaks/TwinkieNSIS/raw/refs/heads/main/ManiaIcons.ttf"
 
         if not (os.path.exists(twinkie_path + "/ManiaIcons.ttf") and os.path.exists(twinkie_path + "/Twinkie.ttf")):
-            download_file(twinkie_font_url, twinkie_path)
-            download_file(maniaicons_font_url, twinkie_path)
+            download_file(twinkie_font_url, twinkie_path, progress=progress)
+            download_file(maniaicons_font_url, twinkie_path, progress=progress)
         else:
             print("TwinkieTweaks fonts already installed!")
 
 
-        with open(self.tmloader_config, "r+") as f:
-            data = yaml.safe_load(f)
-            if "https://twinkietweaks.github.io/tmloader/" not in data.get("servers"):
-                data.get("servers").append("https://twinkietweaks.github.io/tmloader/")
-                f.seek(0)
-                yaml.safe_dump(data, f, sort_keys=False)
-                f.truncate()
-            else:
-                print("TwinkieTweaks Repository already installed!")
+        import yaml
+
+        def add_server(current):
+            data = yaml.safe_load(current)
+            if "https://twinkietweaks.github.io/tmloader/" in data.get("servers"):
+                return current
+            data.get("servers").append("https://twinkietweaks.github.io/tmloader/")
+            return yaml.safe_dump(data, sort_keys=False).encode()
 
         Path(self.tmloader_path + "database/TmForever/profiles/").mkdir(parents=True, exist_ok=True)
-        self.create_tmloader_profile("twinkietweaks", ["TMUnlimiter", "Twinkie", "Competition Patch", "CoreMod"])
+        with get_config_store().batch() as store:
+            # Replayed on top of config.yaml if TMLoader rewrites it before the batch is written
+            if not store.edit(self.tmloader_config, add_server):
+                print("TwinkieTweaks Repository already installed!")
+            self.create_tmloader_profile("twinkietweaks", ["TMUnlimiter", "Twinkie", "Competition Patch", "CoreMod"])
 
-        self.start_tmloader()
+        if start:
+            self.start_tmloader()
 
     def create_tmloader_profile(self, name, mods: list, args: str = None):
         empty_profile = {"program": {"id": "TmForever"}, "mods": []}
@@ -190,26 +515,27 @@ class TrackMania:
         for i in mods:
             empty_profile["mods"].append({"id": i})
 
-        path = self.tmloader_path + f"database/TmForever/profiles/{name}.yaml"
-        with open(path, "w") as f:
-            yaml.safe_dump(empty_profile, f)
+        return self.profiles().update(name, empty_profile)
 
-    def get_profiles(self):
+    def profiles(self):
         folder_path = self.tmloader_path + "database/TmForever/profiles/"
-        data_list = {}
+        if self._profiles is None or self._profiles.folder != folder_path:
+            from profiles import ProfileCatalog
+            self._profiles = ProfileCatalog(folder_path)
+            self._profiles.listing_watched = self.watcher is not None and self.watcher.watching("profiles")
+        return self._profiles
 
-        for filename in os.listdir(folder_path):
-            if filename.endswith((".yaml", ".yml")):
-                file_path = os.path.join(folder_path, filename)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = yaml.safe_load(f)
-                    data_list[filename] = data
+    def iter_profiles(self):
+        """Profile names and descriptions, without parsing the mod lists."""
+        return self.profiles().entries()
 
-        return data_list
+    def get_profiles(self):
+        return self.profiles().all()
 
-    def launch_openplanet(self):
+    def launch_openplanet(self, extra_env=None):
         """Only use if you have Openplanet installed (Private TMUF version)"""
-        run_wine(Path(self.path + "TmForever.bak.exe"), extra_env={"WINEDLLOVERRIDES": "dinput8.dll=n,b"})
+        return self._launch(Path(self.path + "TmForever.bak.exe"),
+                            extra_env={**(extra_env or {}), "WINEDLLOVERRIDES": "dinput8.dll=n,b"})
 
 
 
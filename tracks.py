@@ -0,0 +1,190 @@
+"""Bulk track downloads from TrackMania Exchange"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from downloader import DownloadError
+
+TRACK_URLS = {
+    "nations": "https://nations.tm-exchange.com/trackgbx/",
+    "united": "https://tmuf.exchange/trackgbx/",
+}
+MANIFEST_NAME = ".tmx-tracks.json"
+
+
+def track_url(track_id, united=False):
+    return TRACK_URLS["united" if united else "nations"] + str(track_id)
+
+
+def parse_track_list(lines, united=False):
+    """Parse one track per line: ``123``, ``nations:123`` or ``united:123``. Blank lines and # comments are skipped."""
+    tracks = []
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        site, _, track_id = line.rpartition(":")
+        site = site.strip().lower()
+        if site in ("", "tmnf", "nations"):
+            is_united = united if site == "" else False
+        elif site in ("tmuf", "united"):
+            is_united = True
+        else:
+            raise ValueError(f"Unknown exchange '{site}' in track list")
+        tracks.append((track_id.strip(), is_united))
+    return tracks
+
+
+def manifest_key(track_id, united=False):
+    return ("united:" if united else "nations:") + str(track_id)
+
+
+def load_manifest(tracks_folder):
+    try:
+        with open(os.path.join(tracks_folder, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(tracks_folder, manifest):
+    path = os.path.join(tracks_folder, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+class RateLimiter:
+    """Token bucket shared by all download threads to cap the total bandwidth in bytes per second."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class TrackQueue:
+    """Downloads many TMX tracks through an asyncio queue.
+
+    Each exchange host gets at most ``per_host`` concurrent downloads, ``bandwidth`` (bytes per second)
+    caps all of them together, failures are retried with exponential backoff and tracks already
+    recorded in the folder's manifest are skipped. ``progress(finished, total)`` is called after every
+    track; if it raises, the remaining tracks are dropped and the exception is re-raised.
+    """
+    def __init__(self, tm, per_host=4, bandwidth=None, retries=3, backoff=1.0, progress=None):
+        self.tm = tm
+        self.progress = progress
+        self.per_host = per_host
+        self.limiter = RateLimiter(bandwidth) if bandwidth else None
+        self.retries = retries
+        self.backoff = backoff
+
+    def download(self, tracks):
+        return asyncio.run(self.run(tracks))
+
+    async def run(self, tracks):
+        tracks_folder = self.tm.tracks_folder()
+        manifest = load_manifest(tracks_folder)
+        summary = {"downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0, "errors": {}}
+        start = time.perf_counter()
+        stopped = []
+
+        queue = asyncio.Queue()
+        for track_id, united in tracks:
+            queue.put_nowait((track_id, united))
+
+        hosts = {urlsplit(url).netloc for url in TRACK_URLS.values()}
+        semaphores = {host: asyncio.Semaphore(self.per_host) for host in hosts}
+        workers = self.per_host * len(hosts)
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            async def worker():
+                while True:
+                    track_id, united = await queue.get()
+                    try:
+                        await self._download_one(loop, executor, semaphores, tracks_folder, manifest, summary,
+                                                 track_id, united)
+                        if self.progress and not stopped:
+                            self.progress(summary["downloaded"] + summary["skipped"] + summary["failed"],
+                                          len(tracks))
+                    except Exception as e:
+                        stopped.append(e)
+                        while not queue.empty():
+                            queue.get_nowait()
+                            queue.task_done()
+                    finally:
+                        queue.task_done()
+
+            tasks = [asyncio.create_task(worker()) for _ in range(min(workers, max(1, len(tracks))))]
+            await queue.join()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        save_manifest(tracks_folder, manifest)
+        summary["seconds"] = time.perf_counter() - start
+        print(format_summary(summary))
+        if stopped:
+            raise stopped[0]
+        return summary
+
+    async def _download_one(self, loop, executor, semaphores, tracks_folder, manifest, summary, track_id, united):
+        key = manifest_key(track_id, united)
+        known = manifest.get(key)
+        if known and os.path.exists(os.path.join(tracks_folder, known)):
+            summary["skipped"] += 1
+            return
+
+        url = track_url(track_id, united)
+        async with semaphores[urlsplit(url).netloc]:
+            attempt = 0
+            while True:
+                received = [0]
+
+                def progress(done, total):
+                    if self.limiter:
+                        self.limiter.consume(done - received[0])
+                    received[0] = done
+
+                try:
+                    path = await loop.run_in_executor(
+                        executor, lambda: self.tm.download_track(track_id, united, progress=progress))
+                    break
+                except (DownloadError, OSError) as e:
+                    status = getattr(e, "status", None)
+                    attempt += 1
+                    if attempt > self.retries or (status is not None and status < 500 and status != 429):
+                        summary["failed"] += 1
+                        summary["errors"][key] = str(e)
+                        return
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+        manifest[key] = os.path.basename(path)
+        summary["downloaded"] += 1
+        summary["bytes"] += received[0]
+
+
+def format_summary(summary):
+    seconds = max(summary["seconds"], 1e-9)
+    lines = [f"Tracks: {summary['downloaded']} downloaded, {summary['skipped']} skipped, {summary['failed']} failed "
+             f"in {summary['seconds']:.1f}s ({summary['bytes'] / seconds / 1024:.1f} KiB/s, "
+             f"{summary['downloaded'] / seconds:.1f} tracks/s)"]
+    for key, error in summary["errors"].items():
+        lines.append(f"  {key}: {error}")
+    return "\n".join(lines)
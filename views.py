@@ -0,0 +1,420 @@
+"""Flet user interface, only imported when the window is actually shown"""
+import configparser
+import io
+import threading
+import time
+
+import flet as ft
+
+from configstore import DebouncedWriter
+from jobs import JobScheduler, JobQueueFullError, RUNNING, QUEUED, FAILED
+from wine import get_wine_supervisor
+
+# The selected profile is saved once the radio buttons have been left alone this long
+CONFIG_DELAY = 1.0
+# Wine output reaches the log view in batches, at most this often and this many lines at a time
+LOG_INTERVAL = 0.25
+LOG_BATCH = 200
+
+tm = None
+jobs = None
+config_writer = None
+
+
+def submit_job(name, function):
+    """Run ``function(job)`` in the background; clicks return right away."""
+    try:
+        return jobs.submit(name, function)
+    except JobQueueFullError as e:
+        print(f"Could not start {name}: {e}")
+
+
+class EnvironmentDropDown(ft.Dropdown):
+    def __init__(self, environments=None):
+        super().__init__()
+        if environments is None:
+            environments = ["CarCommon", "StadiumCar", "DesertCar", "RallyCar", "BayCar", "CoastCar", "IslandCar",
+                            "SnowCar"]
+        for env in environments:
+            self.options.append(ft.DropdownOption(key=env, content=ft.Text(value=env)))
+        self.value = "CarCommon"
+        self.label = "Environment"
+
+class DownloadModal(ft.AlertDialog):
+    def __init__(self, page: ft.Page, title: str):
+        super().__init__()
+        self.page = page
+        self.column = ft.Column(controls=[ft.Text(title)])
+        self.dropdown = None
+        self.content = self.column
+
+        self.actions= [ft.ElevatedButton("Download", icon=ft.Icons.SAVE, on_click=lambda e: self.save())]
+
+    def save(self):
+        self.open = False
+        self.page.update()
+
+class DownloadTrack(DownloadModal):
+    def __init__(self, page: ft.Page):
+        super().__init__(page, "Paste one or more IDs from either TrackMania Nations Exchange or TrackMania United Exchange")
+        self.title = "Download Track"
+        self.url = ft.TextField(label="TrackMania Exchange ID(s)", multiline=True)
+        self.dropdown = ft.Dropdown(value="Nations", options=[ft.DropdownOption(key="Nations", content=ft.Text(value="TrackMania Nations Forever Exchange")), ft.DropdownOption(key="United", content=ft.Text(value="TrackMania United Forever Exchange"))])
+        self.info = ft.Text(selectable=True)
+        self.column.controls.append(self.dropdown)
+        self.column.controls.append(self.url)
+        self.column.controls.append(self.info)
+        self.actions.insert(0, ft.TextButton("Look up", icon=ft.Icons.SEARCH, on_click=lambda e: self.look_up()))
+
+    def look_up(self):
+        """Show the name, author and environment of the pasted IDs from the local TMX catalog."""
+        united = self.dropdown.value == "United"
+        track_ids = (self.url.value or "").replace(",", " ").split()
+
+        def look_up(job):
+            from tmx import TrackCatalog
+            catalog = TrackCatalog()
+            try:
+                tracks = catalog.lookup(track_ids, united)
+            finally:
+                catalog.close()
+            self.info.value = "\n".join(
+                f"{track_id}: {track['name']} by {track['author']} ({track['environment']})" if track else
+                f"{track_id}: not found" for track_id, track in tracks.items())
+            self.page.update()
+
+        if track_ids:
+            submit_job(f"Look up {len(track_ids)} tracks", look_up)
+
+    def save(self):
+        united = False
+        if self.dropdown.value == "United":
+            united = True
+        track_ids = self.url.value.replace(",", " ").split()
+        if len(track_ids) == 1:
+            submit_job(f"Track {track_ids[0]}", lambda job: tm.download_track(track_ids[0], united, progress=job.progress))
+        elif track_ids:
+            def download(job):
+                job.unit = "tracks"
+                return tm.download_tracks([(track_id, united) for track_id in track_ids], progress=job.progress)
+            submit_job(f"{len(track_ids)} tracks", download)
+        super().save()
+
+class ManiaParkDownload(DownloadModal):
+    def __init__(self, page: ft.Page, title: str, description: str = "Use a direct link to the file. Click the copy link button on ManiaPark as example"):
+        super().__init__(page, description)
+        self.title = title
+        self.url = ft.TextField(label="Direct Link")
+        self.create_locator = ft.Checkbox(label="Create Locator (So others can see your Skin/Mod)", value=True)
+        self.dropdown = None
+
+        if tm.united:
+            self.dropdown = self.get_dropdown()
+            self.column.controls.append(self.dropdown)
+        self.column.controls.append(self.url)
+        self.column.controls.append(self.create_locator)
+
+    def save(self):
+        super().save()
+
+    def get_dropdown(self):
+        return EnvironmentDropDown()
+
+    def get_environment(self):
+        if self.dropdown is None:
+            return "StadiumCar"
+        return self.dropdown.value
+
+class TextureModDownload(ManiaParkDownload):
+    def save(self):
+        url, environment, locator = self.url.value, self.get_environment(), self.create_locator.value
+        submit_job("Texture mod", lambda job: tm.download_texture_mod(url, environment, progress=job.progress, locator=locator))
+        super().save()
+
+    def get_environment(self):
+        if self.dropdown is None:
+            return "Stadium"
+        return self.dropdown.value
+
+    def get_dropdown(self):
+        return EnvironmentDropDown(["Stadium", "Alpine", "Bay", "Island", "Rally", "Speed", "Coast"])
+
+class SkinDownload(ManiaParkDownload):
+    def save(self):
+        url, environment, locator = self.url.value, self.get_environment(), self.create_locator.value
+        submit_job("Car skin", lambda job: tm.download_car_skin(url, environment, progress=job.progress, locator=locator))
+        super().save()
+
+
+def log(line: str, log_view: ft.Text):
+    log_view.value += ("" if log_view.value.endswith("\n") or log_view.value == "" else "\n") + line
+    if len(log_view.value) > 10_000:
+        log_view.value = log_view.value[-10_000:]  # truncate
+    log_view.update()
+
+
+def run(trackmania):
+    global tm
+    tm = trackmania
+    try:
+        ft.app(target=main)
+    finally:
+        if config_writer is not None:
+            config_writer.flush()
+        if jobs is not None:
+            jobs.shutdown(wait=False)
+
+
+class JobRow(ft.Row):
+    def __init__(self, job):
+        super().__init__(spacing=8, vertical_alignment=ft.CrossAxisAlignment.CENTER)
+        self.job = job
+        self.bar = ft.ProgressBar(value=None, expand=True)
+        self.status = ft.Text("Queued", size=12, width=220, no_wrap=True)
+        self.cancel = ft.IconButton(ft.Icons.CLOSE, tooltip="Cancel", on_click=lambda e: job.cancel())
+        self.controls = [ft.Text(job.name, size=12, width=110, no_wrap=True), self.bar, self.status, self.cancel]
+
+    def refresh(self):
+        job = self.job
+        active = job.state in (QUEUED, RUNNING)
+        self.bar.value = job.fraction if job.state == RUNNING else (None if active else 1.0)
+        self.bar.color = ft.Colors.ERROR if job.state == FAILED else None
+        self.status.value = job.status()
+        self.cancel.disabled = not active or job.cancelled
+        self.status.tooltip = self.status.value
+
+
+def main(page: ft.Page):
+    config = configparser.ConfigParser()
+    page.title = "TrackMania Toolkit"
+    page.theme_mode = "dark"
+    page.padding = 16
+    page.horizontal_alignment = "stretch"
+
+
+    config_profile = config.read("config.ini")
+    if config_profile:
+        launch_profile = config["general"]["profile"]
+        print(launch_profile)
+    else:
+        launch_profile = "default"
+
+    selected_label = ft.Text(f"Selected: " + launch_profile, weight=ft.FontWeight.W_600)
+
+    def render_config():
+        buffer = io.StringIO()
+        config.write(buffer)
+        return buffer.getvalue().encode()
+
+    global config_writer
+    config_writer = DebouncedWriter("config.ini", render_config, CONFIG_DELAY)
+
+    def on_radio_change(e: ft.ControlEvent):
+        selected_label.value = f"Selected: {radio_group.value}"
+        nonlocal launch_profile
+        launch_profile = radio_group.value
+
+        config["general"] = {"profile": radio_group.value}
+        config_writer.schedule()
+
+        page.update()
+
+
+    radio_column = ft.Column([ft.Text("Detecting TrackMania...", italic=True)], tight=True, spacing=6)
+
+    def add_profiles():
+        radio_column.controls.clear()
+        for profile in tm.iter_profiles():
+            description = profile.description
+            if not description:
+                description = "TMLoader Profile: " + profile.name
+            radio_column.controls.append(ft.Radio(value=profile.name, label=description, data=profile))
+
+    radio_group = ft.RadioGroup(
+        value=launch_profile,
+        content=radio_column,
+        on_change=on_radio_change,
+    )
+
+
+    def launch():
+        clicked = time.monotonic()
+        config_writer.flush()
+        page.window.destroy()
+        tm.start_tmloader_profile(launch_profile, clicked=clicked)
+    left_panel = ft.Container(
+        ft.Column([ft.Text("Select one", weight=ft.FontWeight.BOLD), radio_group, selected_label, ft.ElevatedButton("Start", icon=ft.Icons.START, on_click=lambda e: launch())], spacing=10),
+        padding=12, border_radius=12, bgcolor=ft.Colors.SURFACE, expand=True
+    )
+
+    log_view = ft.Text("", selectable=True, size=12)
+    jobs_column = ft.Column(spacing=4)
+    job_rows = {}
+    job_rows_lock = threading.Lock()
+
+    def on_job_update(job):
+        with job_rows_lock:
+            row = job_rows.get(job.id)
+            if row is None:
+                row = job_rows[job.id] = JobRow(job)
+                jobs_column.controls.append(row)
+            row.refresh()
+            if job.state not in (QUEUED, RUNNING):
+                log(f"{job.name}: {job.status()}", log_view)
+            page.update()
+
+    global jobs
+    jobs = JobScheduler(on_update=on_job_update)
+
+    log_card = ft.Container(
+        ft.Column([ft.Text("Jobs", weight=ft.FontWeight.BOLD), jobs_column,
+                   ft.Text("Log", weight=ft.FontWeight.BOLD), log_view], spacing=8),
+        padding=12, border_radius=12, bgcolor=ft.Colors.SURFACE, expand=True
+    )
+
+    uvme = ft.ElevatedButton("Install UVME", icon=ft.Icons.DOWNLOAD,
+                             on_click=lambda e: submit_job("Install UVME", lambda job: tm.download_uvme(progress=job.progress)))
+
+    def set_uvme_button():
+        if tm.uvme_uninstaller:
+            uvme.text = "Uninstall UVME"
+            uvme.icon = ft.Icons.REMOVE
+            uvme.on_click = lambda e: submit_job("Uninstall UVME", lambda job: tm.uninstall_uvme())
+        else:
+            uvme.text = "Install UVME"
+            uvme.icon = ft.Icons.DOWNLOAD
+            uvme.on_click = lambda e: submit_job("Install UVME", lambda job: tm.download_uvme(progress=job.progress))
+
+
+    actions_col = ft.Column(
+        controls=[
+            uvme,
+            ft.ElevatedButton("Start Vanilla Game", icon=ft.Icons.BUILD, on_click=lambda e: submit_job("Vanilla game", lambda job: tm.start_vanilla())),
+            ft.ElevatedButton("Start Launcher", icon=ft.Icons.REFRESH, on_click=lambda e: submit_job("Launcher", lambda job: tm.start_launcher())),
+            ft.ElevatedButton("Install TwinkieTweaks", icon=ft.Icons.REFRESH, on_click=lambda e: submit_job("TwinkieTweaks", lambda job: tm.install_twinkietweaks(progress=job.progress))),
+            ft.ElevatedButton("Download Skin", icon=ft.Icons.DOWNLOAD, on_click=lambda e: page.open(SkinDownload(page, "Download Car Skin"))),
+            ft.ElevatedButton("Download Texture Mod", icon=ft.Icons.DOWNLOAD, on_click=lambda e: page.open(TextureModDownload(page, "Download Texture Mod"))),
+            ft.ElevatedButton("Download Track", icon=ft.Icons.DOWNLOAD, on_click=lambda e: page.open(DownloadTrack(page))),
+        ],
+        spacing=10,
+        horizontal_alignment=ft.CrossAxisAlignment.STRETCH,
+        alignment=ft.MainAxisAlignment.START,
+    )
+
+    for control in actions_col.controls:
+        control.disabled = True
+
+    def add_actions():
+        set_uvme_button()
+        for control in actions_col.controls:
+            control.disabled = False
+        if tm.tmloader_path:
+            actions_col.controls.append(ft.ElevatedButton("Start TMLoader", icon=ft.Icons.LAUNCH, on_click=lambda e: submit_job("TMLoader", lambda job: tm.start_tmloader())))
+
+    right_panel = ft.Container(
+        ft.Column([ft.Text("Actions", weight=ft.FontWeight.BOLD), actions_col], spacing=10),
+        padding=12, border_radius=12, bgcolor=ft.Colors.SURFACE, expand=True
+    )
+
+    main_row = ft.Row([left_panel, right_panel, log_card], spacing=16, alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
+
+    # --- Countdown
+    remaining_text = ft.Text("5 s", weight=ft.FontWeight.W_600)
+    progress = ft.ProgressBar(value=0)
+    pause_btn = ft.OutlinedButton("Pause", icon=ft.Icons.PAUSE, disabled=True)
+
+    state = {"running": False, "remaining": 5, "total": 5}
+
+    def _update_ui():
+        total = max(state["total"], 1)
+        progress.value = 1 - (state["remaining"] / total)
+        remaining_text.value = f"{state['remaining']} s" if not state["running"] else f"{state['remaining']} s remaining"
+        pause_btn.disabled = not state["running"]
+
+        page.update()
+        if state["remaining"] <= 0 and tm.detected.is_set():
+            clicked = time.monotonic()
+            config_writer.flush()
+            page.window.destroy()
+            tm.start_tmloader_profile(launch_profile, clicked=clicked)
+
+    def start_clicked(e):
+        if state["remaining"] <= 0:
+            return
+        state["running"] = True
+        _update_ui()
+
+        def tick():
+            while state["running"] and state["remaining"] > 0:
+                time.sleep(1)
+                state["remaining"] = max(0, state["remaining"] - 1)
+                _update_ui()
+            if state["remaining"] <= 0:
+                state["running"] = False
+                _update_ui()
+                log("Countdown finished.", log_view)
+
+        threading.Thread(target=tick, daemon=True).start()
+
+    def pause_clicked(e):
+        state["running"] = False
+        _update_ui()
+
+    pause_btn.on_click = pause_clicked
+
+    bottom_bar = ft.Container(
+        content=ft.Column(
+            [
+                ft.Row([ft.Container(expand=True), remaining_text]),
+                progress,
+                ft.Row([pause_btn],
+                       alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+            ],
+            spacing=10,
+        ),
+        padding=12,
+        border=ft.border.all(1, ft.Colors.OUTLINE_VARIANT),
+        border_radius=12,
+        bgcolor=ft.Colors.SURFACE,
+    )
+
+    page.add(ft.Column([main_row, bottom_bar, ft.Container(expand=True), ft.Text("Made with ❤️ by AroPix")], spacing=16, expand=True))
+    page.update()
+
+    def detect():
+        # The window is already on screen; detection fills in profiles and actions once it is done
+        try:
+            if not tm.detected.is_set():
+                tm.detect()
+        except Exception as e:
+            radio_column.controls.clear()
+            log(f"Could not detect TrackMania: {e!r}", log_view)
+            page.update()
+            return
+        if tm.prewarm:
+            tm.prewarm_wineserver()
+        add_profiles()
+        add_actions()
+        tm.watch(on_change=on_detection_change)
+        start_clicked("")
+
+    def on_detection_change(parts):
+        # Called from the watcher thread after UVME, TMLoader or the profiles changed on disk
+        if parts & {"registry", "game"}:
+            set_uvme_button()
+        if parts & {"profiles", "tmloader"} and tm.tmloader_path:
+            add_profiles()
+        page.update()
+
+    threading.Thread(target=detect, daemon=True).start()
+
+    def pump_wine_output():
+        output = get_wine_supervisor().output
+        seq = output.seq
+        while True:
+            time.sleep(LOG_INTERVAL)
+            lines, seq = output.since(seq)
+            if lines:
+                log("\n".join(lines[-LOG_BATCH:]), log_view)
+
+    threading.Thread(target=pump_wine_output, daemon=True).start()
@@ -0,0 +1,341 @@
+"""Supervisor for wine processes
+
+Processes are started with asyncio on one background event loop, which drains stdout and stderr
+as they are produced into a bounded ring buffer (wine can print thousands of debug lines per
+second) and passes them on to our own stdout and stderr, where Lutris logs them. Callers get a
+WineProcess handle to wait on, time out or kill.
+"""
+import asyncio
+import collections
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from tracing import add_span, span
+
+MAX_LINES = 5000
+MAX_LINE_LENGTH = 1 << 20
+# Seconds a pre-warmed wineserver stays up once the last wine process of its prefix exited
+PREWARM_PERSIST = 60
+STOP_TIMEOUT = 10
+
+
+class OutputBuffer:
+    """Ring buffer of output lines; readers poll it with the sequence number they have seen so far."""
+    def __init__(self, max_lines=MAX_LINES):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    def append(self, line):
+        with self._lock:
+            self.lines.append(line)
+            self.seq += 1
+
+    def since(self, seq):
+        """``(lines, seq)``: every line after ``seq`` still in the buffer and the sequence to poll with next."""
+        with self._lock:
+            missing = min(self.seq - seq, len(self.lines))
+            lines = list(self.lines)[len(self.lines) - missing:] if missing > 0 else []
+            return lines, self.seq
+
+    def tail(self, count):
+        with self._lock:
+            return list(self.lines)[-count:]
+
+
+class WineProcess:
+    def __init__(self, supervisor, args, name):
+        self.supervisor = supervisor
+        self.args = args
+        self.name = name
+        self.pid = None
+        self.returncode = None
+        self.started = time.monotonic()
+        self.spawned = None
+        self.finished = None
+        self.lines = collections.deque(maxlen=200)
+        self.slots = None
+        self._process = None
+        self._done = threading.Event()
+
+    @property
+    def running(self):
+        return not self._done.is_set()
+
+    @property
+    def spawn_seconds(self):
+        return None if self.spawned is None else self.spawned - self.started
+
+    @property
+    def duration(self):
+        """Seconds from launch to exit, or so far while it is still running."""
+        return (self.finished or time.monotonic()) - self.started
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def kill(self):
+        self._signal("kill")
+
+    def terminate(self):
+        self._signal("terminate")
+
+    def _signal(self, method):
+        if self._process is not None and self.running:
+            self.supervisor.loop.call_soon_threadsafe(self._send, method)
+
+    def _send(self, method):
+        try:
+            getattr(self._process, method)()
+        except ProcessLookupError:
+            pass
+
+    def __repr__(self):
+        return f"<WineProcess {self.name} pid={self.pid} returncode={self.returncode}>"
+
+
+class WineSupervisor:
+    """Owns the event loop thread that every wine process is launched from and drained on."""
+    def __init__(self, max_lines=MAX_LINES):
+        self.output = OutputBuffer(max_lines)
+        self.processes = collections.deque(maxlen=100)
+        self.loop = None
+        # Optional semaphore (possibly shared between processes) capping concurrent wine processes
+        self.slots = None
+        # Whether output also goes to our stdout/stderr, as it did when wine inherited them
+        self.forward = True
+        self._lock = threading.Lock()
+
+    def start(self, args, env=None, cwd=None, name=None):
+        """Launch ``args`` and return its WineProcess once it is running (spawn errors are raised here).
+
+        With ``slots`` set this blocks until a slot is free.
+        """
+        handle = WineProcess(self, args, name or str(args[-1]))
+        slots = handle.slots = self.slots
+        if slots is not None:
+            slots.acquire()
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._spawn(handle, env, cwd), self._get_loop())
+            future.result()
+        except BaseException:
+            if slots is not None:
+                slots.release()
+            raise
+        self.processes.append(handle)
+        return handle
+
+    def run(self, args, env=None, cwd=None, name=None, timeout=None):
+        handle = self.start(args, env=env, cwd=cwd, name=name)
+        try:
+            return handle.wait(timeout)
+        except subprocess.TimeoutExpired:
+            handle.kill()
+            raise
+
+    def running(self):
+        return [handle for handle in self.processes if handle.running]
+
+    def _get_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="wine-supervisor", daemon=True).start()
+            return self.loop
+
+    async def _spawn(self, handle, env, cwd):
+        protocol = _WineProtocol(self, handle)
+        transport, _ = await self.loop.subprocess_exec(
+            lambda: protocol, *handle.args, env=env, cwd=cwd, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        handle._process = transport
+        handle.pid = transport.get_pid()
+        handle.spawned = time.monotonic()
+        self.loop.create_task(self._supervise(handle, transport, protocol))
+
+    async def _supervise(self, handle, transport, protocol):
+        try:
+            await protocol.exited
+            handle.returncode = transport.get_returncode()
+        finally:
+            handle.finished = time.monotonic()
+            if handle.slots is not None:
+                handle.slots.release()
+            handle._done.set()
+            add_span("wine.process", handle.started, handle.finished, lane=(handle.pid, f"wine {handle.name}"),
+                     exe=handle.name, pid=handle.pid, returncode=handle.returncode,
+                     spawn_seconds=handle.spawn_seconds)
+        self.output.append(f"[{handle.name}] exited with {handle.returncode} after {handle.duration:.1f}s")
+        # Children such as the game started by TMLoader or wineserver inherit the pipes; keep reading
+        # what they write until the last of them closes them
+        await protocol.closed
+        protocol.flush()
+        transport.close()
+
+    def _line(self, handle, line, fd=1):
+        decoded = line.decode("utf-8", errors="replace").rstrip("\r")
+        text = f"[{handle.name}] " + decoded
+        handle.lines.append(text)
+        self.output.append(text)
+        if self.forward:
+            stream = sys.stderr if fd == 2 else sys.stdout
+            try:
+                stream.write(decoded + "\n")
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+
+
+class _WineProtocol(asyncio.SubprocessProtocol):
+    """Splits both pipes into lines as data arrives. Unlike asyncio.subprocess.Process.wait,
+    ``exited`` resolves when the process exits even if something else still holds its pipes."""
+    def __init__(self, supervisor, handle):
+        self.supervisor = supervisor
+        self.handle = handle
+        self.partial = {1: b"", 2: b""}
+        self.exited = supervisor.loop.create_future()
+        self.closed = supervisor.loop.create_future()
+
+    def pipe_data_received(self, fd, data):
+        *lines, rest = (self.partial[fd] + data).split(b"\n")
+        if len(rest) > MAX_LINE_LENGTH:
+            lines.append(rest)
+            rest = b""
+        self.partial[fd] = rest
+        for line in lines:
+            self.supervisor._line(self.handle, line, fd)
+
+    def pipe_connection_lost(self, fd, exc):
+        self.flush(fd)
+
+    def flush(self, fd=None):
+        for pipe in (fd,) if fd is not None else tuple(self.partial):
+            if self.partial.get(pipe):
+                self.supervisor._line(self.handle, self.partial[pipe], pipe)
+                self.partial[pipe] = b""
+
+    def process_exited(self):
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_wine_supervisor():
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = WineSupervisor()
+        return _supervisor
+
+
+def find_wineserver(wine=None):
+    """The wineserver matching ``wine``: $WINESERVER, then next to the wine binary, then on PATH."""
+    wineserver = os.environ.get("WINESERVER")
+    if wineserver:
+        return wineserver
+    wine = wine or os.environ.get("WINE")
+    if wine:
+        candidate = os.path.join(os.path.dirname(wine), "wineserver")
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which("wineserver")
+
+
+class WineServer:
+    """A wineserver for one prefix, started ahead of a launch so wine does not pay for starting it
+    and loading the registry. It stays up for ``persist`` seconds after its last client exits, then
+    shuts itself down, so nothing has to stop it at exit."""
+    def __init__(self, pfx, wineserver=None, persist=PREWARM_PERSIST):
+        self.pfx = pfx
+        self.wineserver = wineserver or find_wineserver()
+        self.persist = persist
+        self.started = None
+        self.ready = threading.Event()
+        self._thread = None
+
+    def _run(self, *args, timeout=None):
+        env = os.environ.copy()
+        env["WINEPREFIX"] = self.pfx
+        return subprocess.run([self.wineserver] + list(args), env=env, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout).returncode
+
+    def start(self, timeout=30):
+        """Start the server; returns once it is accepting clients."""
+        if self.wineserver is None:
+            print("wineserver not found, not pre-warming")
+            return False
+        begin = time.monotonic()
+        # Without -f wineserver forks into the background once its socket is ready
+        with span("wine.wineserver_start", pfx=self.pfx):
+            returncode = self._run(f"-p{self.persist}", timeout=timeout)
+        if returncode != 0:
+            print(f"Could not start wineserver for {self.pfx}")
+            return False
+        self.started = time.monotonic() - begin
+        self.ready.set()
+        return True
+
+    def start_in_background(self):
+        self._thread = threading.Thread(target=self.start, name="wineserver-prewarm", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, wait=True, timeout=STOP_TIMEOUT):
+        """Shut the server down now, after up to ``timeout`` seconds for the wine processes we started.
+
+        Never ``wineserver -w``: that waits for the server itself, which a persistent one only does
+        once its persistence runs out.
+        """
+        deadline = time.monotonic() + timeout
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if not self.ready.is_set():
+            return
+        if wait:
+            for handle in get_wine_supervisor().running():
+                try:
+                    handle.wait(max(0.0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    break
+        try:
+            self._run("-k", timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            pass
+        self.ready.clear()
+
+
+def wait_for_windows_process(name, timeout=30, interval=0.02, alive=None):
+    """Poll /proc until a process whose program is ``name`` (e.g. TmForever.exe) shows up.
+
+    Under wine the Windows process's argv[0] is its Windows (or Unix) path, which is what is
+    matched, case-insensitively. Returns the monotonic time it was seen, or None on timeout or
+    once ``alive()`` returns False.
+    """
+    name = name.lower()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and (alive is None or alive()):
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/cmdline", "rb") as f:
+                    program = f.read().split(b"\0", 1)[0].decode("utf-8", errors="replace")
+            except OSError:
+                continue
+            if program.replace("\\", "/").rsplit("/", 1)[-1].lower() == name:
+                return time.monotonic()
+        time.sleep(interval)
+    return None